@@ -0,0 +1,104 @@
+# browse.py
+# Browse tab queries: parameterised filters and keyset ("load more") pagination.
+# Requirements: pip install psycopg2-binary
+#
+# Each sort order pages on (sort key, song_id) of the last row seen, so the
+# next page is an index range scan that costs the same at page 1000 as at
+# page 1. Every sort key has a matching (tenant_id, key, song_id) index in
+# MUSICAPPDATABASE.sql; ratings are COALESCEd to a sentinel outside 0-5
+# so NULLs still sort last and the key stays comparable.
+#
+# browse_facets() returns the genre / access / rating-band counts behind the
+# filter labels from one GROUPING SETS scan, cached per tenant and role
+# until songs change.
+
+import catalog_cache
+
+BROWSE_PAGE_SIZE = 50
+
+# rating band label -> lower bound; checked top-down, anything unrated is "Unrated"
+RATING_BANDS = [("4-5 ⭐", 4), ("3-4 ⭐", 3), ("2-3 ⭐", 2), ("0-2 ⭐", 0)]
+
+# sort label -> (sort key expression, direction); song_id follows the same direction
+BROWSE_SORTS = {
+    "Rating (High to Low)": ("COALESCE(rating, -1)", "DESC"),
+    "Rating (Low to High)": ("COALESCE(rating, 99)", "ASC"),
+    "Title A-Z":            ("title", "ASC"),
+    "Title Z-A":            ("title", "DESC"),
+}
+
+
+def browse_page(cur, sort_by, tenant_id=None, genre=None, premium=None,
+                after=None, limit=BROWSE_PAGE_SIZE):
+    # Returns (rows, next_cursor); pass next_cursor back as `after` for the next page
+    key_expr, direction = BROWSE_SORTS[sort_by]
+    comparator = "<" if direction == "DESC" else ">"
+
+    where = []
+    params = {"limit": limit}
+    if tenant_id:
+        # RLS enforces this as well; spelling it out lets the planner use the browse indexes
+        where.append("tenant_id = %(tenant_id)s")
+        params["tenant_id"] = tenant_id
+    if genre:
+        where.append("genre = %(genre)s")
+        params["genre"] = genre
+    if premium is not None:
+        where.append("is_premium = %(premium)s")
+        params["premium"] = premium
+    if after:
+        where.append(f"({key_expr}, song_id) {comparator} (%(after_key)s, %(after_id)s)")
+        params["after_key"], params["after_id"] = after
+
+    cur.execute(f"""
+        SELECT song_id, title, artist, genre, rating, is_premium, {key_expr} AS sort_key
+        FROM songs
+        WHERE {" AND ".join(where) or "TRUE"}
+        ORDER BY {key_expr} {direction}, song_id {direction}
+        LIMIT %(limit)s
+    """, params)
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = (rows[-1][6], rows[-1][0])
+    return [tuple(row[:6]) for row in rows], next_cursor
+
+
+# ── facet counts ─────────────────────────────────────────────────────────────
+facet_cache = catalog_cache.TenantCache("browse_facets")
+
+_BAND_CASE = "CASE" + "".join(
+    f" WHEN rating >= {low} THEN '{label}'" for label, low in RATING_BANDS
+) + " ELSE 'Unrated' END"
+
+# GROUPING(genre, is_premium, rating_band): 3 = per genre, 5 = per access, 6 = per band, 7 = total
+FACETS_SQL = f"""
+    SELECT GROUPING(genre, is_premium, rating_band), genre, is_premium, rating_band, COUNT(*)
+    FROM (
+        SELECT genre, COALESCE(is_premium, FALSE) AS is_premium, {_BAND_CASE} AS rating_band
+        FROM songs
+    ) visible
+    GROUP BY GROUPING SETS ((genre), (is_premium), (rating_band), ())
+"""
+
+
+def browse_facets(cur, identity):
+    # Counts reflect what the caller's RLS lets them see, hence the role scope
+    def load():
+        facets = {"total": 0, "genres": {}, "premium": {True: 0, False: 0},
+                  "rating_bands": {label: 0 for label, _ in RATING_BANDS}}
+        cur.execute(FACETS_SQL)
+        for grouping_id, genre, is_premium, rating_band, count in cur.fetchall():
+            if grouping_id == 3:
+                facets["genres"][genre] = count
+            elif grouping_id == 5:
+                facets["premium"][is_premium] = count
+            elif grouping_id == 6:
+                facets["rating_bands"][rating_band] = count
+            else:
+                facets["total"] = count
+        facets["genres"] = dict(sorted(facets["genres"].items(), key=lambda item: str(item[0])))
+        return facets
+
+    return facet_cache.get(identity.tenant_id, identity.db_role, load)
@@ -0,0 +1,196 @@
+# bulk_import.py
+# Bulk song catalog import from CSV or JSONL, loaded with COPY.
+# Requirements: pip install psycopg2-binary pandas numpy
+#
+#   python APP/manage.py import-songs catalog.csv --tenant UUID [--rejects bad.csv] [--dry-run]
+#
+# Columns: title, artist, genre, rating (optional, 0-5), is_premium (optional,
+# true/false/yes/no/1/0, blank = free). The file is read CHUNK_ROWS rows at a
+# time; every check is a whole-column pandas/NumPy operation, and rows that
+# fail one go to the rejects file with the reason instead of stopping the load.
+#
+# Good rows are COPYed into a temp staging table, then merged into songs with
+# one INSERT ... SELECT: the first row per (title, artist) wins and songs the
+# tenant already has (same title and artist) are skipped. The whole import is
+# one transaction running as appuser with app.current_tenant set, so songs'
+# RLS checks every row, and the statement-level songs triggers (summaries,
+# age pools) fire once.
+
+import csv
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+IMPORT_ROLE  = "appuser"
+CHUNK_ROWS   = 50_000
+
+TEXT_LIMITS  = {"title": 150, "artist": 50, "genre": 60}    # VARCHAR sizes in songs
+COLUMNS      = ["title", "artist", "genre", "rating", "is_premium"]
+REQUIRED     = ["title", "artist", "genre"]
+TRUE_VALUES  = {"true", "t", "yes", "y", "1"}
+FALSE_VALUES = {"false", "f", "no", "n", "0", ""}
+
+BEGIN_SQL = """
+    SELECT set_config('role', %s, true),
+           set_config('app.current_tenant', %s, true),
+           pg_advisory_xact_lock(hashtext('song_import:' || %s))
+"""
+STAGE_SQL = """
+    CREATE TEMP TABLE song_import_stage (
+        record_no  BIGINT,
+        title      TEXT,
+        artist     TEXT,
+        genre      TEXT,
+        rating     NUMERIC(3,1),
+        is_premium BOOLEAN
+    ) ON COMMIT DROP
+"""
+COPY_SQL = ("COPY song_import_stage (record_no, title, artist, genre, rating, is_premium) "
+            "FROM STDIN WITH (FORMAT csv)")
+MERGE_SQL = """
+    WITH firsts AS (
+        SELECT DISTINCT ON (title, artist) *
+        FROM song_import_stage
+        ORDER BY title, artist, record_no
+    ), inserted AS (
+        INSERT INTO songs (title, artist, genre, rating, is_premium, tenant_id)
+        SELECT f.title, f.artist, f.genre, f.rating, f.is_premium, current_setting('app.current_tenant')::uuid
+        FROM firsts f
+        WHERE NOT EXISTS (
+            SELECT 1 FROM songs s
+            WHERE s.tenant_id = current_setting('app.current_tenant')::uuid
+              AND s.title = f.title AND s.artist = f.artist
+        )
+        ORDER BY f.record_no
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM song_import_stage),
+           (SELECT COUNT(*) FROM firsts),
+           (SELECT COUNT(*) FROM inserted)
+"""
+
+
+class ImportFileError(Exception):
+    pass
+
+
+def read_chunks(path, fmt=None, chunk_rows=CHUNK_ROWS):
+    # Yields DataFrames of raw values with a 1-based record_no column
+    fmt = fmt or ("jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv")
+    if fmt == "jsonl":
+        reader = pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                             skipinitialspace=True)
+    record_no = 1
+    for chunk in reader:
+        chunk.columns = [str(c).strip().lower() for c in chunk.columns]
+        missing = [c for c in REQUIRED if c not in chunk.columns]
+        if missing:
+            raise ImportFileError(f"{path}: missing column(s) {', '.join(missing)}")
+        for column in COLUMNS:
+            if column not in chunk.columns:
+                chunk[column] = ""
+        chunk = chunk[COLUMNS].copy()
+        chunk.insert(0, "record_no", np.arange(record_no, record_no + len(chunk)))
+        record_no += len(chunk)
+        yield chunk
+
+
+def validate(chunk):
+    # -> (good rows ready for COPY, rejected rows with a reason column)
+    text = {c: chunk[c].fillna("").astype(str).str.strip() for c in COLUMNS}
+    rating_raw = text["rating"]
+    rating = pd.to_numeric(rating_raw, errors="coerce")
+    premium_raw = text["is_premium"].str.lower()
+
+    # first failing check names the reason; order matters
+    checks = []
+    for column in REQUIRED:
+        checks.append((text[column] == "", f"{column} is empty"))
+    for column, limit in TEXT_LIMITS.items():
+        checks.append((text[column].str.len() > limit, f"{column} longer than {limit} characters"))
+    checks.append(((rating_raw != "") & rating.isna(), "rating is not a number"))
+    checks.append(((rating < 0) | (rating > 5), "rating outside 0-5"))
+    checks.append((~premium_raw.isin(TRUE_VALUES | FALSE_VALUES), "is_premium is not a yes/no value"))
+
+    reason = np.select([mask.to_numpy(dtype=bool) for mask, _ in checks],
+                       [label for _, label in checks], default="")
+    bad = reason != ""
+
+    good = pd.DataFrame({
+        "record_no": chunk["record_no"],
+        "title": text["title"],
+        "artist": text["artist"],
+        "genre": text["genre"],
+        "rating": rating,                   # NUMERIC(3,1) rounds on COPY
+        "is_premium": premium_raw.isin(TRUE_VALUES),
+    })[~bad]
+    rejected = chunk[bad].assign(reason=reason[bad])
+    return good, rejected
+
+
+def import_songs(conn, path, tenant_id, rejects_path=None, fmt=None,
+                 chunk_rows=CHUNK_ROWS, dry_run=False):
+    # Returns counts and timings; with dry_run=True the merge runs and is rolled back
+    started = time.perf_counter()
+    validate_s = copy_s = 0.0
+    total = rejected = 0
+    rejects_path = rejects_path or os.path.splitext(path)[0] + ".rejects.csv"
+    rejects_file = None
+
+    autocommit = conn.autocommit
+    conn.autocommit = False         # staging + merge are one transaction
+    try:
+        with conn.cursor() as cur:
+            cur.execute(BEGIN_SQL, (IMPORT_ROLE, tenant_id, tenant_id))
+            cur.execute(STAGE_SQL)
+
+            for chunk in read_chunks(path, fmt, chunk_rows):
+                step = time.perf_counter()
+                good, bad = validate(chunk)
+                total += len(chunk)
+                if len(bad):
+                    if rejects_file is None:
+                        rejects_file = open(rejects_path, "w", newline="", encoding="utf-8")
+                        csv.writer(rejects_file).writerow(["record_no"] + COLUMNS + ["reason"])
+                    bad.to_csv(rejects_file, header=False, index=False)
+                    rejected += len(bad)
+                buffer = io.StringIO()
+                good.to_csv(buffer, header=False, index=False)
+                buffer.seek(0)
+                validate_s += time.perf_counter() - step
+
+                step = time.perf_counter()
+                cur.copy_expert(COPY_SQL, buffer)
+                copy_s += time.perf_counter() - step
+
+            step = time.perf_counter()
+            cur.execute("ANALYZE song_import_stage")    # temp tables get no autovacuum stats
+            cur.execute(MERGE_SQL)
+            staged, distinct, inserted = cur.fetchone()
+            merge_s = time.perf_counter() - step
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = autocommit
+        if rejects_file is not None:
+            rejects_file.close()
+
+    elapsed = time.perf_counter() - started
+    return dict(
+        rows=total, rejected=rejected, file_duplicates=staged - distinct,
+        existing=distinct - inserted, inserted=inserted, dry_run=dry_run,
+        rejects_path=rejects_path if rejected else None,
+        validate_s=round(validate_s, 2), copy_s=round(copy_s, 2), merge_s=round(merge_s, 2),
+        total_s=round(elapsed, 2), rows_per_s=round(total / elapsed) if elapsed else 0,
+    )
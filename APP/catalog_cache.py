@@ -0,0 +1,162 @@
+# catalog_cache.py
+# Process-wide caches for data derived from the songs catalog.
+# Requirements: pip install psycopg2-binary
+#
+# Entries are keyed by (tenant_id, scope). The scope is normally the DB role,
+# because RLS gives each role a different view of the same tenant. A trigger
+# on songs NOTIFYs 'songs_changed' with the tenant id, the op and the song_id;
+# the listener thread drops that tenant's entries from every cache. In-memory
+# indexes register on_insert() to append an INSERTed row (the payload carries
+# it) and on_invalidate() to rebuild after anything else. The TTL bounds
+# staleness for processes that don't run the listener (e.g. the console app).
+
+import json
+import select
+import threading
+import time
+
+import psycopg2
+
+SONGS_CHANGED_CHANNEL = "songs_changed"
+DEFAULT_TTL           = 300     # seconds
+LISTEN_RETRY_DELAY    = 5       # seconds before re-connecting the listener
+
+_caches = []
+_caches_lock = threading.Lock()
+_listeners = []     # callbacks(tenant_id) for in-memory indexes that update themselves
+_insert_listeners = []      # callbacks(tenant_id, song) for indexes that can append a new song
+
+
+class TenantCache:
+    def __init__(self, name, ttl=DEFAULT_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}          # (tenant_id, scope) -> (loaded_at, value)
+        self._generation = 0        # bumped on every invalidation
+        self._lock = threading.Lock()
+        with _caches_lock:
+            _caches.append(self)
+
+    def get(self, tenant_id, scope, loader):
+        key = (tenant_id, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            # Don't store a value that was loaded across an invalidation
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            self._generation += 1
+            if tenant_id is None:
+                self._entries.clear()
+                return
+            # Entries without a tenant (adminn's cross-tenant view) go too
+            for key in [k for k in self._entries if k[0] in (tenant_id, None)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "entries": len(self._entries),
+                    "hits": self.hits, "misses": self.misses}
+
+
+def invalidate_tenant(tenant_id=None):
+    with _caches_lock:
+        caches = list(_caches)
+        listeners = list(_listeners)
+    for cache in caches:
+        cache.invalidate(tenant_id)
+    for callback in listeners:
+        callback(tenant_id)
+
+
+def song_inserted(tenant_id, song):
+    # song: the songs_changed payload of an INSERT (song_id, title, artist, ...)
+    with _caches_lock:
+        caches = list(_caches)
+        listeners = list(_insert_listeners)
+    for cache in caches:
+        cache.invalidate(tenant_id)
+    for callback in listeners:
+        callback(tenant_id, song)
+
+
+def on_invalidate(callback):
+    with _caches_lock:
+        _listeners.append(callback)
+    return callback
+
+
+def on_insert(callback):
+    with _caches_lock:
+        _insert_listeners.append(callback)
+    return callback
+
+
+def cache_stats():
+    with _caches_lock:
+        return [cache.stats() for cache in _caches]
+
+
+# ── songs_changed listener ──────────────────────────────────────────────────
+def handle_notification(payload):
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        message = None
+    if not isinstance(message, dict):
+        # bare tenant id from an older notify_songs_changed()
+        invalidate_tenant(payload or None)
+        return
+    if message.get("op") == "INSERT":
+        song_inserted(message.get("tenant_id"), message)
+    else:
+        invalidate_tenant(message.get("tenant_id"))
+
+
+def start_invalidation_listener(connect_kwargs, channel=SONGS_CHANGED_CHANNEL):
+    thread = threading.Thread(
+        target=_listen, args=(connect_kwargs, channel),
+        name="songs-changed-listener", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _listen(connect_kwargs, channel):
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**connect_kwargs)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {channel}")
+
+            # Anything may have changed while nobody was listening
+            invalidate_tenant(None)
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    handle_notification(notify.payload)
+        except psycopg2.Error:
+            time.sleep(LISTEN_RETRY_DELAY)
+        finally:
+            if conn is not None:
+                conn.close()
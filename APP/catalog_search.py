@@ -0,0 +1,31 @@
+# catalog_search.py
+# Catalog search shared by the console app and the Streamlit Search tab.
+# Requirements: pip install psycopg2-binary
+#
+# Both front ends call search_songs() in the database: trigram-indexed,
+# ranked by similarity, keyset-paginated, and filtered by the caller's RLS.
+
+SEARCH_FIELDS    = ("all", "title", "artist", "genre")
+SEARCH_PAGE_SIZE = 20
+
+SEARCH_SQL = """
+    SELECT song_id, title, artist, genre, rating, is_premium, score
+    FROM search_songs(%s, %s, %s, %s, %s, %s)
+"""
+
+
+def search_songs(cur, term, field="all", limit=SEARCH_PAGE_SIZE, after=None, own_only=False):
+    # Returns (rows, next_cursor); pass next_cursor back as `after` for the next page
+    field = field.lower()
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"Unknown search field: {field}")
+
+    after_score, after_id = after if after else (None, None)
+    cur.execute(SEARCH_SQL, (term, field, limit, after_score, after_id, own_only))
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = (last[6], last[0])
+    return rows, next_cursor
@@ -0,0 +1,15 @@
+# dashboard.py
+# Analytics Dashboard data: every panel comes from one round trip to
+# tenant_dashboard_snapshot(), cached per tenant and role until songs change.
+
+import catalog_cache
+
+snapshot_cache = catalog_cache.TenantCache("dashboard_snapshot")
+
+
+def tenant_dashboard_snapshot(cur, identity):
+    def load():
+        cur.execute("SELECT tenant_dashboard_snapshot()")
+        return cur.fetchone()[0]
+
+    return snapshot_cache.get(identity.tenant_id, identity.db_role, load)
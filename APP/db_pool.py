@@ -0,0 +1,281 @@
+# db_pool.py
+# Process-wide connection pool shared by every Streamlit session.
+# Requirements: pip install psycopg2-binary
+#
+# Sessions no longer pin a backend: a connection is checked out for one
+# script run, the login identity (role + tenant + username) is replayed on
+# checkout and wiped again on return, so any backend can serve any session.
+
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import InterfaceError, OperationalError
+
+import instrumentation
+import watchdog
+
+# ── CONNECTION SETTINGS (same login the app always used) ─────────────────────
+APP_LOGIN_CONFIG = {
+    "dbname":   "backup",
+    "user":     "app_login",
+    "password": "app123",
+    "host":     "localhost",
+    "port":     "5432"
+}
+
+POOL_MIN_SIZE     = 2       # backends opened up front
+POOL_MAX_SIZE     = 20      # hard cap, keep well below max_connections
+POOL_WAIT_TIMEOUT = 10.0    # seconds a checkout may wait for a free backend
+POOL_MAX_IDLE     = 300.0   # recycle backends idle longer than this
+LATENCY_SAMPLES   = 1000    # checkout latencies kept for percentiles
+# ─────────────────────────────────────────────────────────────────────────────
+
+# What user_login() established for a session; replayed on every checkout
+SessionIdentity = namedtuple("SessionIdentity", ["username", "db_role", "tenant_id"])
+
+# SET ROLE doesn't pick up ALTER ROLE ... SET, so the role's timeout profile
+# (watchdog.ROLE_PROFILES) and the application_name the watchdog reads are
+# replayed with the identity; RESET falls back to app_login's connect options.
+APPLY_IDENTITY_SQL = """
+    SELECT set_config('role', %s, false),
+           set_config('app.current_tenant', %s, false),
+           set_config('app.current_username', %s, false),
+           set_config('statement_timeout', %s, false),
+           set_config('idle_in_transaction_session_timeout', %s, false),
+           set_config('application_name', %s, false)
+"""
+
+RESET_IDENTITY_SQL = ("RESET ROLE; RESET app.current_tenant; RESET app.current_username; "
+                      "RESET statement_timeout; RESET idle_in_transaction_session_timeout; RESET application_name;")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TenantConnectionPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 wait_timeout=POOL_WAIT_TIMEOUT, max_idle=POOL_MAX_IDLE,
+                 **connect_kwargs):
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_idle = max_idle
+        self._connect_kwargs = connect_kwargs or dict(APP_LOGIN_CONFIG)
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, last_returned_monotonic)]
+        self._open = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        for _ in range(min_size):
+            self._idle.append((self._new_conn(), time.monotonic()))
+            self._open += 1
+
+    def _new_conn(self):
+        login = self._connect_kwargs.get("user", APP_LOGIN_CONFIG["user"])
+        settings = {"application_name": watchdog.application_name(login),
+                    "options": watchdog.connect_options(login)}
+        settings.update(self._connect_kwargs)
+        conn = psycopg2.connect(connection_factory=instrumentation.InstrumentedConnection, **settings)
+        conn.autocommit = True
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # ── raw acquire / release ────────────────────────────────────────────────
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.wait_timeout
+        waited = False
+        conn = last_used = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection free after {self.wait_timeout:.0f}s "
+                        f"({self.max_size} in use)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait = time.monotonic() - started
+                self._waits += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+        try:
+            if conn is None:
+                conn = self._new_conn()
+            elif conn.closed or time.monotonic() - last_used > self.max_idle:
+                # Likely cut by the server's idle timeout – don't even try it
+                self._close_quietly(conn)
+                conn = self._new_conn()
+                self._count_reconnect()
+        except Exception:
+            self._forget(None)
+            raise
+        return conn
+
+    def _release(self, conn, broken=False):
+        if not broken and not conn.closed:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(RESET_IDENTITY_SQL)
+            except (OperationalError, InterfaceError):
+                broken = True
+            instrumentation.tag(conn, None, None)
+
+        if broken or conn.closed:
+            self._forget(conn)
+            return
+
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _forget(self, conn):
+        if conn is not None:
+            self._close_quietly(conn)
+        with self._cond:
+            self._in_use -= 1
+            self._open -= 1
+            self._cond.notify()
+
+    def _count_reconnect(self):
+        with self._cond:
+            self._reconnects += 1
+
+    # ── identity replay ──────────────────────────────────────────────────────
+    @staticmethod
+    def _apply_identity(conn, identity):
+        if identity is None:
+            instrumentation.tag(conn, APP_LOGIN_CONFIG["user"], None)
+            return
+        instrumentation.tag(conn, identity.db_role, identity.tenant_id)
+        statement_timeout, idle_timeout = watchdog.session_settings(identity.db_role)
+        with conn.cursor() as cur:
+            cur.execute(APPLY_IDENTITY_SQL, (
+                identity.db_role or "none",
+                identity.tenant_id or "",
+                identity.username or "",
+                statement_timeout,
+                idle_timeout,
+                watchdog.application_name(identity.db_role, identity.tenant_id),
+            ))
+
+    def _prepare(self, conn, identity):
+        try:
+            self._apply_identity(conn, identity)
+            return conn
+        except (OperationalError, InterfaceError):
+            # Backend died while sitting in the pool: reconnect once, transparently
+            self._close_quietly(conn)
+            conn = self._new_conn()
+            self._count_reconnect()
+            self._apply_identity(conn, identity)
+            return conn
+
+    @contextmanager
+    def checkout(self, identity):
+        started = time.monotonic()
+        conn = self._acquire()
+        try:
+            conn = self._prepare(conn, identity)
+        except Exception:
+            self._forget(conn)
+            raise
+        with self._cond:
+            self._latencies.append(time.monotonic() - started)
+
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            self._release(conn, broken=True)
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    # ── login ────────────────────────────────────────────────────────────────
+    def login(self, username, password, tenant_id=None):
+        with self.checkout(None) as conn:
+            with conn.cursor() as cur:
+                if tenant_id:
+                    cur.execute("SELECT user_login(%s, %s, %s)", (username, password, tenant_id))
+                else:
+                    cur.execute("SELECT user_login(%s, %s)", (username, password))
+                result = cur.fetchone()[0]
+
+                if "successful" not in result.lower():
+                    return result, None
+
+                # Capture what user_login switched to so later checkouts can replay it
+                cur.execute("SELECT current_user, current_setting('app.current_tenant', true)")
+                db_role, current_tenant = cur.fetchone()
+
+        return result, SessionIdentity(username, db_role, current_tenant or None)
+
+    # ── stats ────────────────────────────────────────────────────────────────
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            stats = {
+                "max_size":      self.max_size,
+                "open":          self._open,
+                "idle":          len(self._idle),
+                "in_use":        self._in_use,
+                "checkouts":     self._checkouts,
+                "waits":         self._waits,
+                "wait_total_ms": round(self._wait_total * 1000, 1),
+                "wait_max_ms":   round(self._wait_max * 1000, 1),
+                "timeouts":      self._timeouts,
+                "reconnects":    self._reconnects,
+            }
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        stats["checkout_p50_ms"] = pct(0.50)
+        stats["checkout_p95_ms"] = pct(0.95)
+        stats["checkout_max_ms"] = round(latencies[-1] * 1000, 2) if latencies else 0.0
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
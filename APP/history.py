@@ -0,0 +1,60 @@
+# history.py
+# My History tab: keyset pages of the caller's plays, newest first, and a CSV
+# export of the whole history that streams through a server-side cursor.
+# Requirements: pip install psycopg2-binary
+#
+# Pages walk the my_history view on (played_at, history_id) of the last row
+# seen, which idx_play_history_user_recent serves in index order, so page 100
+# costs what page 1 does. The listening stats never come from these rows:
+# my_listening_stats() reads the per-user play rollups.
+
+import csv
+
+HISTORY_PAGE_SIZE = 50
+EXPORT_FETCH_SIZE = 5000        # rows per round trip of the export cursor
+
+HISTORY_COLUMNS = ["Title", "Artist", "Genre", "Rating", "Premium", "Played At", "Duration"]
+
+HISTORY_SQL = """
+    SELECT history_id, title, artist, genre, rating, is_premium, played_at, listen_duration
+    FROM my_history
+    {where}
+    ORDER BY played_at DESC, history_id DESC
+"""
+
+
+def history_page(cur, after=None, limit=HISTORY_PAGE_SIZE):
+    # Returns (rows, next_cursor); pass next_cursor back as `after` for the next page
+    where, params = "", []
+    if after:
+        where = "WHERE (played_at, history_id) < (%s, %s)"
+        params.extend(after)
+    cur.execute(HISTORY_SQL.format(where=where) + " LIMIT %s", params + [limit])
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = (rows[-1][6], rows[-1][0])
+    return [tuple(row[1:]) for row in rows], next_cursor
+
+
+def export_history_csv(conn, out, fetch_size=EXPORT_FETCH_SIZE):
+    # Writes the caller's full history to the text file `out`; returns the row count.
+    # A named cursor keeps the result on the server and hands over fetch_size
+    # rows at a time, so memory stays flat however long the history is.
+    autocommit = conn.autocommit
+    conn.autocommit = False         # named cursors live inside a transaction
+    written = 0
+    try:
+        writer = csv.writer(out)
+        writer.writerow(HISTORY_COLUMNS)
+        with conn.cursor(name="history_export") as cur:
+            cur.itersize = fetch_size
+            cur.execute(HISTORY_SQL.format(where=""))
+            for row in cur:
+                writer.writerow(row[1:])
+                written += 1
+    finally:
+        conn.rollback()             # read-only: nothing to commit
+        conn.autocommit = autocommit
+    return written
@@ -0,0 +1,47 @@
+# identity_context.py
+# Who is logged in, loaded once at login instead of re-queried on every rerun.
+# Requirements: pip install psycopg2-binary
+#
+# IdentityContext carries what the tabs need to know about the user plus the
+# three fields TenantConnectionPool replays on checkout (username, db_role,
+# tenant_id), so it can be handed straight to pool.checkout(). Anything that
+# changes the user's subscription must call refresh() and store the result.
+
+from collections import namedtuple
+
+IdentityContext = namedtuple(
+    "IdentityContext",
+    ["username", "db_role", "tenant_id", "role_type", "is_premium", "age"]
+)
+
+USER_CONTEXT_SQL = "SELECT role_type, tenant_id::text, age FROM users WHERE user_name = %s"
+
+
+def login(pool, username, password, tenant_id=None):
+    # Same contract as pool.login(): (message, IdentityContext or None)
+    result, session = pool.login(username, password, tenant_id)
+    if session is None:
+        return result, None
+    return result, load(pool, session)
+
+
+def load(pool, session):
+    # checkout(None) runs as app_login, which may read users for any tenant
+    with pool.checkout(None) as conn:
+        with conn.cursor() as cur:
+            cur.execute(USER_CONTEXT_SQL, (session.username,))
+            row = cur.fetchone()
+
+    if row is None:
+        # appuser / adminn are database roles without a users row
+        return IdentityContext(session.username, session.db_role, session.tenant_id,
+                               None, False, None)
+
+    role_type, tenant_id, age = row
+    # user_login() switches listeners to the role named by role_type
+    return IdentityContext(session.username, role_type, session.tenant_id or tenant_id,
+                           role_type, role_type == "listener_premium", age)
+
+
+def refresh(pool, identity):
+    return load(pool, identity)
@@ -0,0 +1,317 @@
+# instrumentation.py
+# Per-statement timings for both apps: an instrumented psycopg2 connection/cursor.
+# Requirements: pip install psycopg2-binary
+#
+# Connections made with connection_factory=InstrumentedConnection hand out
+# cursors that time every execute() and record, per (SQL fingerprint, role,
+# tenant): calls, errors (and the last error message, even when the caller
+# swallows the exception), rows returned, an estimate of the bytes fetched,
+# and a latency histogram. Stats live in this process only, in ROLLING_SLOTS
+# one-minute slots, so "last 5 minutes" and "since start" both come cheap.
+#
+# The fingerprint is the query text with literals and parameters replaced by
+# ? and whitespace collapsed; parameters are never recorded.
+#
+# MUSICAPP_METRICS_EXPORT=<file path or http(s) URL> makes start_exporter()
+# append (file, JSON lines) or POST (URL) a snapshot every
+# MUSICAPP_METRICS_INTERVAL seconds and once more at exit.
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from bisect import bisect_left
+from functools import lru_cache
+
+import psycopg2.extensions
+
+# Histogram bucket upper bounds in ms; the last bucket is open-ended
+BUCKETS_MS       = [0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+SLOT_SECONDS     = 60
+ROLLING_SLOTS    = 60           # one-minute slots kept per statement
+BYTES_SAMPLE     = 20           # fetched rows measured per fetch; the rest are extrapolated
+MAX_KEYS         = 5000         # distinct (fingerprint, role, tenant) kept
+
+EXPORT_TARGET    = os.environ.get("MUSICAPP_METRICS_EXPORT", "")
+EXPORT_INTERVAL  = float(os.environ.get("MUSICAPP_METRICS_INTERVAL", "60"))
+
+_COMMENT_RE  = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_LITERAL_RE  = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_LIST_RE     = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE    = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    text = _COMMENT_RE.sub(" ", str(sql))
+    text = _LITERAL_RE.sub("?", text)
+    text = _LIST_RE.sub("(?...)", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+# ── stats ────────────────────────────────────────────────────────────────────
+class _Slot:
+    __slots__ = ("minute", "calls", "errors", "total_s", "max_s", "rows", "bytes", "buckets")
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.calls = self.errors = self.rows = self.bytes = 0
+        self.total_s = self.max_s = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+
+class _Statement:
+    __slots__ = ("slots", "last_error", "last_error_at")
+
+    def __init__(self):
+        self.slots = []
+        self.last_error = None
+        self.last_error_at = None
+
+    def slot(self, minute):
+        if not self.slots or self.slots[-1].minute != minute:
+            self.slots.append(_Slot(minute))
+            if len(self.slots) > ROLLING_SLOTS:
+                del self.slots[0]
+        return self.slots[-1]
+
+
+_stats = {}              # (fingerprint, role, tenant) -> _Statement
+_lock = threading.Lock()
+_started = time.time()
+
+
+def _minute(now=None):
+    return int((now or time.time()) // SLOT_SECONDS)
+
+
+def record(sql, role, tenant, seconds, rows=0, error=None):
+    key = (fingerprint(sql), role or "-", tenant or "-")
+    with _lock:
+        statement = _stats.get(key)
+        if statement is None:
+            if len(_stats) >= MAX_KEYS:
+                return key
+            statement = _stats[key] = _Statement()
+        slot = statement.slot(_minute())
+        slot.calls += 1
+        slot.total_s += seconds
+        slot.max_s = max(slot.max_s, seconds)
+        slot.rows += max(rows, 0)
+        slot.buckets[bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        if error is not None:
+            slot.errors += 1
+            message = str(error).strip()
+            statement.last_error = message.splitlines()[0][:300] if message else type(error).__name__
+            statement.last_error_at = time.time()
+    return key
+
+
+def record_fetch(key, rows, nbytes):
+    with _lock:
+        statement = _stats.get(key)
+        if statement is not None and statement.slots:
+            statement.slots[-1].rows += rows
+            statement.slots[-1].bytes += nbytes
+
+
+def _percentile(buckets, total, q):
+    # upper bound of the bucket holding the q-th call (the open bucket reports its lower bound)
+    if not total:
+        return 0.0
+    target, seen = q * total, 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= target:
+            return float(BUCKETS_MS[min(i, len(BUCKETS_MS) - 1)])
+    return float(BUCKETS_MS[-1])
+
+
+def snapshot(window_minutes=None):
+    # -> list of per-statement dicts over the last window_minutes (None = all kept slots)
+    oldest = _minute() - window_minutes + 1 if window_minutes else None
+    result = []
+    with _lock:
+        for (fp, role, tenant), statement in _stats.items():
+            slots = [s for s in statement.slots if oldest is None or s.minute >= oldest]
+            calls = sum(s.calls for s in slots)
+            if not calls:
+                continue
+            buckets = [sum(column) for column in zip(*(s.buckets for s in slots))]
+            total_s = sum(s.total_s for s in slots)
+            result.append({
+                "fingerprint": fp,
+                "role":        role,
+                "tenant":      tenant,
+                "calls":       calls,
+                "errors":      sum(s.errors for s in slots),
+                "total_ms":    round(total_s * 1000, 1),
+                "avg_ms":      round(total_s * 1000 / calls, 2),
+                "p50_ms":      _percentile(buckets, calls, 0.50),
+                "p95_ms":      _percentile(buckets, calls, 0.95),
+                "p99_ms":      _percentile(buckets, calls, 0.99),
+                "max_ms":      round(max(s.max_s for s in slots) * 1000, 2),
+                "rows":        sum(s.rows for s in slots),
+                "bytes":       sum(s.bytes for s in slots),
+                "histogram":   buckets,
+                "last_error":  statement.last_error,
+            })
+    return result
+
+
+def slowest(limit=20, window_minutes=None, key="p95_ms"):
+    return sorted(snapshot(window_minutes), key=lambda row: (row[key], row["max_ms"]), reverse=True)[:limit]
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+# ── instrumented psycopg2 classes ────────────────────────────────────────────
+def _row_bytes(rows):
+    sample = rows[:BYTES_SAMPLE]
+    if not sample:
+        return 0
+    measured = sum(len(str(value)) for row in sample for value in row)
+    return measured * len(rows) // len(sample)
+
+
+class InstrumentedCursorMixin:
+    _instrument_key = None
+
+    def _tags(self):
+        conn = self.connection
+        return getattr(conn, "instrument_role", None), getattr(conn, "instrument_tenant", None)
+
+    def _timed(self, method, query, vars):
+        role, tenant = self._tags()
+        started = time.perf_counter()
+        try:
+            result = method(query, vars)
+        except Exception as e:
+            record(query, role, tenant, time.perf_counter() - started, error=e)
+            raise
+        # client-side cursors know their row count now; named cursors count rows as they are fetched
+        rows = 0 if self.name else max(self.rowcount, 0)
+        self._instrument_key = record(query, role, tenant, time.perf_counter() - started, rows)
+        return result
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def _fetched(self, rows, count_rows):
+        if self._instrument_key is not None and rows:
+            record_fetch(self._instrument_key, len(rows) if count_rows else 0, _row_bytes(rows))
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._fetched([row], bool(self.name))
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        return self._fetched(rows, bool(self.name))
+
+    def fetchall(self):
+        return self._fetched(super().fetchall(), bool(self.name))
+
+    def __iter__(self):
+        # named cursors stream in itersize batches; rows are counted as they arrive.
+        # A plain cursor's __iter__ returns the cursor itself, so a for loop over it
+        # would land back here: step it with next() instead.
+        rows = super().__iter__()
+        batch = []
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            batch.append(row)
+            if len(batch) >= 1000:
+                self._fetched(batch, bool(self.name))
+                batch = []
+            yield row
+        self._fetched(batch, bool(self.name))
+
+
+_cursor_classes = {}
+
+
+def instrumented_cursor_class(base):
+    if issubclass(base, InstrumentedCursorMixin):
+        return base
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        cls = _cursor_classes[base] = type(f"Instrumented{base.__name__}", (InstrumentedCursorMixin, base), {})
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    # instrument_role / instrument_tenant label the stats; see tag()
+    instrument_role = None
+    instrument_tenant = None
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = instrumented_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def tag(conn, role, tenant):
+    if isinstance(conn, InstrumentedConnection):
+        conn.instrument_role = role
+        conn.instrument_tenant = tenant
+
+
+# ── export ───────────────────────────────────────────────────────────────────
+_exporter = None
+
+
+def export(target=EXPORT_TARGET):
+    if not target:
+        return
+    payload = {"at": time.time(), "pid": os.getpid(), "started": _started, "buckets_ms": BUCKETS_MS,
+               "statements": snapshot()}
+    body = json.dumps(payload)
+    if target.startswith(("http://", "https://")):
+        request = urllib.request.Request(target, data=body.encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=5).close()
+    else:
+        with open(target, "a", encoding="utf-8") as f:
+            f.write(body + "\n")
+
+
+def _export_quietly(target):
+    try:
+        export(target)
+    except Exception as e:
+        print(f"metrics export to {target} failed: {e}")
+
+
+def start_exporter(target=EXPORT_TARGET, interval=EXPORT_INTERVAL):
+    # One background exporter per process; a no-op unless a target is configured
+    global _exporter
+    if not target or _exporter is not None:
+        return _exporter
+
+    def run():
+        while True:
+            time.sleep(interval)
+            _export_quietly(target)
+
+    _exporter = threading.Thread(target=run, name="metrics-export", daemon=True)
+    _exporter.start()
+    atexit.register(_export_quietly, target)
+    return _exporter
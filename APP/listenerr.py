@@ -1,11 +1,16 @@
 # finL.py
 # Updated: Added search option for all roles
-# Requirements: pip install psycopg2-binary matplotlib
+# Requirements: pip install psycopg2-binary matplotlib numpy
 
 import psycopg2
 import matplotlib.pyplot as plt
 from psycopg2 import Error as PsycopgError
 
+import instrumentation
+import similarity
+import typeahead
+from catalog_search import search_songs
+
 # ── CHANGE THESE TO TEST DIFFERENT ROLES / TENANTS ──────────────────────────
 DB_USER      = "listener_premium"                         # appuser, adminn, listener_free, listener_premium
 DB_TENANT_ID = "244f866c-7a71-460e-a493-2c4a9daf4e7e"     # ← real UUID from your tenants table
@@ -27,9 +32,10 @@ DB_CONFIG = {
 }
 
 def connect():
-   try:
-        conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        conn = psycopg2.connect(connection_factory=instrumentation.InstrumentedConnection, **DB_CONFIG)
         conn.autocommit = True
+        instrumentation.tag(conn, DB_USER, DB_TENANT_ID)
 
         print(f"Connected as {DB_USER}")
 
@@ -78,7 +84,12 @@ def add_song_interactive(conn):
             cur.execute("""
                 INSERT INTO songs (title, artist, genre, rating, is_premium, tenant_id)
                 VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING song_id
             """, (title, artist, genre, rating, is_premium, DB_TENANT_ID))
+            song_id = cur.fetchone()[0]
+        # Keep the autocomplete and "more like this" indexes current without rebuilding them
+        typeahead.song_added(DB_TENANT_ID, song_id, title, artist, is_premium)
+        similarity.song_added(DB_TENANT_ID, song_id, genre, artist, rating, is_premium)
         print(f"\nSong added: {title} by {artist} ({genre}, {rating}/5, {'Premium' if is_premium else 'Free'})")
     except PsycopgError as e:
         print(f"Failed to add song: {e}")
@@ -248,8 +259,36 @@ def show_genre_counts(conn):
     except PsycopgError as e:
         print(f"Genre counts error: {e}")
 
+def enable_typeahead(conn):
+    # Tab completes song titles from the in-memory index, no query per keystroke
+    try:
+        import readline
+    except ImportError:
+        return
+    try:
+        with conn.cursor() as cur:
+            typeahead.get_index(cur, DB_TENANT_ID, DB_USER)
+    except PsycopgError as e:
+        print(f"Autocomplete unavailable: {e}")
+        return
+
+    matches = []
+
+    def complete(text, state):
+        if state == 0:
+            with conn.cursor() as cur:
+                suggestions = typeahead.suggest(cur, DB_TENANT_ID, DB_USER, readline.get_line_buffer())
+            matches[:] = [title for _, title, _ in suggestions]
+        return matches[state] if state < len(matches) else None
+
+    readline.set_completer_delims("")
+    readline.set_completer(complete)
+    readline.parse_and_bind("tab: complete")
+
+
 def search_song(conn):
     print("\nSearch songs (title or artist) – type 'exit' to stop")
+    enable_typeahead(conn)
     while True:
         term = input("> ").strip()
         if term.lower() == "exit":
@@ -259,38 +298,9 @@ def search_song(conn):
 
         try:
             with conn.cursor() as cur:
-                if DB_USER in ["appuser", "adminn"]:
-                    # For uploaders: filter by ownership (appuser own only, admin all)
-                    if DB_USER == "appuser":
-                        cur.execute("""
-                            SELECT title, artist, genre, rating, is_premium
-                            FROM songs
-                            WHERE (LOWER(title) LIKE LOWER(%s) OR LOWER(artist) LIKE LOWER(%s))
-                              AND added_by = current_user
-                            ORDER BY title
-                            LIMIT 10
-                        """, (f"%{term}%", f"%{term}%"))
-                    else:  # adminn sees all
-                        cur.execute("""
-                            SELECT title, artist, genre, rating, is_premium
-                            FROM songs
-                            WHERE LOWER(title) LIKE LOWER(%s)
-                               OR LOWER(artist) LIKE LOWER(%s)
-                            ORDER BY title
-                            LIMIT 10
-                        """, (f"%{term}%", f"%{term}%"))
-                else:
-                    # Listeners use broad search (already filtered by RLS)
-                    cur.execute("""
-                        SELECT title, artist, genre, rating, is_premium
-                        FROM songs
-                        WHERE LOWER(title) LIKE LOWER(%s)
-                           OR LOWER(artist) LIKE LOWER(%s)
-                        ORDER BY title
-                        LIMIT 10
-                    """, (f"%{term}%", f"%{term}%"))
-
-                rows = cur.fetchall()
+                # Trigram-ranked search; RLS already limits what each role sees,
+                # appuser additionally only searches their own uploads
+                rows, _ = search_songs(cur, term, limit=10, own_only=(DB_USER == "appuser"))
 
             if not rows:
                 print(f"No results for '{term}'")
@@ -299,7 +309,7 @@ def search_song(conn):
             print(f"\nResults for '{term}' ({len(rows)} found):")
             visible = 0
             for r in rows:
-                title, artist, genre, rating, is_premium = r
+                song_id, title, artist, genre, rating, is_premium, score = r
                 if DB_USER == "listener_free" and is_premium:
                     continue
                 visible += 1
@@ -381,6 +391,7 @@ def upgrade_to_premium(conn):
 
 def main():
     conn = None
+    instrumentation.start_exporter()
     try:
         conn = connect()
 
@@ -0,0 +1,370 @@
+# manage.py
+# Maintenance commands for the music app database.
+# Requirements: pip install psycopg2-binary
+#
+#   python APP/manage.py partitions ensure [--ahead 3]
+#   python APP/manage.py partitions retain --keep-months 12 [--drop] [--dry-run]
+#   python APP/manage.py partitions report
+#   python APP/manage.py rollups rebuild
+#   python APP/manage.py recommender build [--tenant UUID] [--top-k 20]
+#   python APP/manage.py age-pools refresh [--tenant UUID] [--pool-size 500]
+#   python APP/manage.py stats reconcile [--repair]
+#   python APP/manage.py import-songs FILE --tenant UUID [--format csv|jsonl] [--rejects PATH] [--dry-run]
+#   python APP/manage.py watchdog run [--interval 5] [--dry-run] [--once]
+#   python APP/manage.py watchdog report [--limit 50]
+#   python APP/manage.py slow-report snapshot [--label TEXT] [--plans 5]
+#   python APP/manage.py slow-report show [SNAPSHOT] [--by total|mean] [--nested]
+#   python APP/manage.py slow-report diff BEFORE AFTER
+#   python APP/manage.py slow-report list
+#
+# Runs as the schema owner (DDL), not as app_login: set MANAGE_DSN.
+# Meant for cron, e.g. "partitions ensure" daily and "partitions retain" monthly.
+
+import argparse
+import os
+import re
+import sys
+from datetime import date
+
+import psycopg2
+
+MANAGE_DSN = os.environ.get("MANAGE_DSN", "dbname=backup user=postgres host=localhost port=5432")
+
+# ── play_history partitions ──────────────────────────────────────────────────
+PARTITION_PARENT   = "play_history"
+ARCHIVE_SCHEMA     = "play_archive"
+DEFAULT_AHEAD      = 3       # months pre-created beyond the current one
+DEFAULT_KEEP       = 12      # months of history kept attached
+
+_MONTH_RE = re.compile(r"^play_history_y(\d{4})m(\d{2})$")
+
+PARTITIONS_SQL = """
+    SELECT c.relname,
+           pg_get_expr(c.relpartbound, c.oid)    AS bounds,
+           c.reltuples::bigint                   AS est_rows,
+           pg_total_relation_size(c.oid)         AS total_bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = %s::regclass
+    ORDER BY c.relname
+"""
+
+
+def connect(dsn=MANAGE_DSN):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+def partition_month(name):
+    match = _MONTH_RE.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def months_before(day, months):
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def list_partitions(cur):
+    cur.execute(PARTITIONS_SQL, (PARTITION_PARENT,))
+    return cur.fetchall()
+
+
+def ensure_partitions(cur, ahead=DEFAULT_AHEAD):
+    cur.execute("SELECT * FROM ensure_play_history_partitions(%s)", (ahead,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def retain_partitions(cur, keep_months=DEFAULT_KEEP, drop=False, dry_run=False, today=None):
+    # Detaches every monthly partition that ends before the retention cutoff;
+    # detached months move to ARCHIVE_SCHEMA, or are dropped with drop=True
+    cutoff = months_before((today or date.today()).replace(day=1), keep_months - 1)
+    expired = [name for name, *_ in list_partitions(cur)
+               if partition_month(name) and partition_month(name) < cutoff]
+
+    if not dry_run:
+        if not drop:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+        for name in expired:
+            cur.execute(f"ALTER TABLE {PARTITION_PARENT} DETACH PARTITION {name}")
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+            else:
+                cur.execute(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+    return cutoff, expired
+
+
+def report_partitions(cur):
+    rows = []
+    for name, bounds, est_rows, total_bytes in list_partitions(cur):
+        rows.append([name, bounds, max(est_rows, 0), _pretty_bytes(total_bytes)])
+    return rows
+
+
+def _pretty_bytes(size):
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _print_table(headers, rows):
+    widths = [max([len(str(h))] + [len(str(r[i])) for r in rows]) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+def cmd_partitions(args):
+    conn = connect(args.dsn)
+    with conn.cursor() as cur:
+        if args.action == "ensure":
+            created = ensure_partitions(cur, args.ahead)
+            print(f"Created {len(created)} partition(s): {', '.join(created) or '-'}")
+        elif args.action == "retain":
+            cutoff, expired = retain_partitions(cur, args.keep_months, args.drop, args.dry_run)
+            verb = "Would detach" if args.dry_run else ("Dropped" if args.drop else f"Archived to {ARCHIVE_SCHEMA}")
+            print(f"Keeping plays from {cutoff:%Y-%m} on. {verb}: {', '.join(expired) or '-'}")
+        else:
+            _print_table(["partition", "bounds", "est. rows", "size"], report_partitions(cur))
+    conn.close()
+
+
+# ── play rollups ─────────────────────────────────────────────────────────────
+def cmd_rollups(args):
+    # The trigger keeps the rollups current; rebuild is for backfills and repairs
+    conn = connect(args.dsn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT rebuild_play_rollups()")
+        print(f"Rebuilt play rollups from {cur.fetchone()[0]:,} plays")
+    conn.close()
+
+
+# ── co-listen recommender ────────────────────────────────────────────────────
+def cmd_recommender(args):
+    # NumPy/SciPy are only needed for this command
+    import recommender
+
+    conn = connect(args.dsn)
+    conn.autocommit = False         # named cursor + one swap transaction per tenant
+    rows = []
+    for result in recommender.build_all(conn, args.tenant, args.top_k):
+        rows.append([result["tenant_id"], result["users"], result["songs"], result["pairs"],
+                     result["recommendations"], result["load_s"], result["similarity_s"],
+                     result["scoring_s"], result["write_s"]])
+    conn.close()
+    _print_table(["tenant", "users", "songs", "pairs", "recs", "load s", "similarity s", "scoring s", "write s"],
+                 rows)
+
+
+# ── age-group candidate pools ───────────────────────────────────────────────
+def cmd_age_pools(args):
+    # Pools rebuild themselves on the first request after a songs change;
+    # this pre-warms them, e.g. after a bulk import or a genre_age_groups edit
+    conn = connect(args.dsn)
+    rows = []
+    with conn.cursor() as cur:
+        if args.tenant:
+            tenants = [args.tenant]
+        else:
+            cur.execute("SELECT tenant_id::text FROM tenants ORDER BY name")
+            tenants = [row[0] for row in cur.fetchall()]
+        for tenant_id in tenants:
+            cur.execute("SELECT refresh_age_pools(%s, %s)", (tenant_id, args.pool_size))
+            rows.append([tenant_id, cur.fetchone()[0]])
+    conn.close()
+    _print_table(["tenant", "pooled songs"], rows)
+
+
+# ── song summaries ───────────────────────────────────────────────────────────
+def cmd_stats(args):
+    # The songs triggers keep the summaries current; this checks them against a
+    # full recount and, with --repair, rebuilds the ones that drifted
+    conn = connect(args.dsn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT * FROM reconcile_song_stats(%s)", (args.repair,))
+        rows = [list(row) for row in cur.fetchall()]
+    conn.close()
+    _print_table(["summary", "rows", "drifted", "zero rows", "repaired"], rows)
+    if any(row[2] for row in rows) and not args.repair:
+        print("Drift found: re-run with --repair to rebuild the drifted summaries")
+        return 1
+    return 0
+
+
+# ── bulk catalog import ─────────────────────────────────────────────────────
+def cmd_import_songs(args):
+    # pandas is only needed for this command
+    import bulk_import
+
+    conn = connect(args.dsn)
+    try:
+        result = bulk_import.import_songs(conn, args.file, args.tenant, args.rejects, args.format,
+                                          args.chunk_rows, args.dry_run)
+    except (bulk_import.ImportFileError, OSError, ValueError) as e:     # unreadable or malformed file
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    verb = "Would insert" if result["dry_run"] else "Inserted"
+    print(f"{verb} {result['inserted']:,} of {result['rows']:,} rows: {result['rejected']:,} rejected, "
+          f"{result['file_duplicates']:,} duplicated in the file, {result['existing']:,} already in the catalog")
+    if result["rejects_path"]:
+        print(f"Rejected rows and reasons: {result['rejects_path']}")
+    _print_table(["validate s", "copy s", "merge s", "total s", "rows/s"],
+                 [[result["validate_s"], result["copy_s"], result["merge_s"], result["total_s"],
+                   f"{result['rows_per_s']:,}"]])
+    return 0
+
+
+# ── long-running query watchdog ─────────────────────────────────────────────
+def cmd_watchdog(args):
+    import watchdog
+
+    conn = connect(args.dsn)
+    try:
+        if args.action == "run":
+            mode = " (dry run)" if args.dry_run else ""
+            print(f"Watching every {args.interval:g}s{mode}; Ctrl+C to stop")
+            watchdog.run(conn, args.interval, args.dry_run, args.once)
+        else:
+            with conn.cursor() as cur:
+                rows = [[f"{r[0]:%Y-%m-%d %H:%M:%S}", r[1], r[2], str(r[3] or "-")[:8], r[4], r[5], r[6],
+                         {None: "dry run", True: "yes", False: "gone"}[r[7]], (r[8] or "")[:60]]
+                        for r in watchdog.recent_events(cur, args.limit)]
+            _print_table(["logged", "pid", "role", "tenant", "state", "runtime s", "action", "applied", "query"],
+                         rows)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    return 0
+
+
+# ── pg_stat_statements slow query report ────────────────────────────────────
+def _ms(value):
+    return "-" if value is None else f"{value:,.1f}"
+
+
+def cmd_slow_report(args):
+    import slow_queries
+
+    conn = connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            if args.action == "snapshot":
+                result = slow_queries.take_snapshot(cur, args.label, args.plans)
+                print(f"Snapshot {result['snapshot_id']} at {result['taken_at']:%Y-%m-%d %H:%M:%S}: "
+                      f"{result['statements']} statements, {result['plans']} plans captured")
+            elif args.action == "list":
+                _print_table(["snapshot", "taken", "label", "statements", "plans"],
+                             [[r[0], f"{r[1]:%Y-%m-%d %H:%M:%S}", r[2] or "-", r[3], r[4]]
+                              for r in slow_queries.list_snapshots(cur, args.limit)])
+            elif args.action == "show":
+                groups = slow_queries.report(cur, args.snapshot, args.by, args.limit, args.nested)
+                _print_table(["group", "kind", "roles", "calls", "total ms", "mean ms", "rows", "blks read", "query"],
+                             [[g["group"], g["kind"], g["roles"], f"{g['calls']:,}", _ms(g["total_ms"]),
+                               _ms(g["mean_ms"]), f"{g['rows']:,}", f"{g['blks_read']:,}",
+                               " ".join(g["query"].split())[:60]] for g in groups])
+                plans = [g for g in groups if g["plan_summary"] or g["plan_error"]]
+                if plans:
+                    print("\nPlans:")
+                    for g in plans:
+                        print(f"  {g['group']}: {g['plan_summary'] or g['plan_error']}")
+            else:
+                if args.snapshot is None or args.after is None:
+                    print("diff needs two snapshot ids: BEFORE AFTER", file=sys.stderr)
+                    return 1
+                rows = slow_queries.diff(cur, args.snapshot, args.after, args.limit, args.nested)
+                _print_table(["group", "calls before", "calls after", "mean ms before", "mean ms after", "change",
+                              "query"],
+                             [[r["group"], r["calls_before"], r["calls_after"], _ms(r["mean_before"]),
+                               _ms(r["mean_after"]), "-" if r["change"] is None else f"{r['change']:+.0%}",
+                               " ".join(r["query"].split())[:50]] for r in rows])
+    except slow_queries.SnapshotError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+# ── entry point ──────────────────────────────────────────────────────────────
+def build_parser():
+    parser = argparse.ArgumentParser(description="Music app database maintenance")
+    parser.add_argument("--dsn", default=MANAGE_DSN, help="libpq connection string (default: $MANAGE_DSN)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    partitions = commands.add_parser("partitions", help="play_history monthly partitions")
+    partitions.add_argument("action", choices=["ensure", "retain", "report"])
+    partitions.add_argument("--ahead", type=int, default=DEFAULT_AHEAD, help="months to pre-create")
+    partitions.add_argument("--keep-months", type=int, default=DEFAULT_KEEP, help="months to keep attached")
+    partitions.add_argument("--drop", action="store_true", help="drop expired months instead of archiving")
+    partitions.add_argument("--dry-run", action="store_true", help="only list what retain would detach")
+    partitions.set_defaults(func=cmd_partitions)
+
+    rollups = commands.add_parser("rollups", help="play rollup tables")
+    rollups.add_argument("action", choices=["rebuild"])
+    rollups.set_defaults(func=cmd_rollups)
+
+    recs = commands.add_parser("recommender", help="co-listen recommendations batch")
+    recs.add_argument("action", choices=["build"])
+    recs.add_argument("--tenant", help="only this tenant (default: every tenant with plays)")
+    recs.add_argument("--top-k", type=int, default=20, help="recommendations stored per user")
+    recs.set_defaults(func=cmd_recommender)
+
+    pools = commands.add_parser("age-pools", help="age-group recommendation candidate pools")
+    pools.add_argument("action", choices=["refresh"])
+    pools.add_argument("--tenant", help="only this tenant (default: every tenant)")
+    pools.add_argument("--pool-size", type=int, default=500, help="songs kept per age group and access level")
+    pools.set_defaults(func=cmd_age_pools)
+
+    stats = commands.add_parser("stats", help="trigger-maintained song summaries")
+    stats.add_argument("action", choices=["reconcile"])
+    stats.add_argument("--repair", action="store_true", help="rebuild summaries that drifted")
+    stats.set_defaults(func=cmd_stats)
+
+    imports = commands.add_parser("import-songs", help="bulk song catalog import (CSV or JSONL)")
+    imports.add_argument("file")
+    imports.add_argument("--tenant", required=True, help="tenant the songs are imported into")
+    imports.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    imports.add_argument("--rejects", help="where rejected rows go (default: FILE.rejects.csv)")
+    imports.add_argument("--chunk-rows", type=int, default=50_000, help="rows validated and copied at a time")
+    imports.add_argument("--dry-run", action="store_true", help="validate and merge, then roll back")
+    imports.set_defaults(func=cmd_import_songs)
+
+    dog = commands.add_parser("watchdog", help="cancel / terminate statements over their role's budget")
+    dog.add_argument("action", choices=["run", "report"])
+    dog.add_argument("--interval", type=float, default=5.0, help="seconds between polls")
+    dog.add_argument("--dry-run", action="store_true", help="log what would be signalled, signal nothing")
+    dog.add_argument("--once", action="store_true", help="poll once and exit (e.g. from cron)")
+    dog.add_argument("--limit", type=int, default=50, help="events shown by report")
+    dog.set_defaults(func=cmd_watchdog)
+
+    slow = commands.add_parser("slow-report", help="pg_stat_statements snapshots, rankings and plans")
+    slow.add_argument("action", choices=["snapshot", "show", "diff", "list"])
+    slow.add_argument("snapshot", nargs="?", type=int, help="snapshot to show (default: latest); diff: BEFORE")
+    slow.add_argument("after", nargs="?", type=int, help="diff: AFTER snapshot")
+    slow.add_argument("--label", help="snapshot label, e.g. the deployed version")
+    slow.add_argument("--plans", type=int, default=5, help="top offenders to EXPLAIN per snapshot")
+    slow.add_argument("--by", choices=["total", "mean"], default="total", help="rank by total or mean time")
+    slow.add_argument("--nested", action="store_true", help="include statements run inside functions")
+    slow.add_argument("--limit", type=int, default=15, help="rows shown")
+    slow.set_defaults(func=cmd_slow_report)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args) or 0
+    except psycopg2.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# play_ingest.py
+# Buffered play-event ingestion: "▶️ Play Song" no longer costs a transaction.
+# Requirements: pip install psycopg2-binary
+#
+# submit() gates the play against a cached song -> premium map and appends it
+# to a bounded in-process buffer. A background thread writes the buffer with
+# one multi-row INSERT per batch, on a dedicated app_login connection, when
+# FLUSH_SIZE events are waiting or FLUSH_INTERVAL has passed. A full buffer
+# blocks callers for up to ENQUEUE_TIMEOUT (backpressure) and then raises
+# PlayBufferFull. close() - also registered with atexit - flushes what's left.
+# on_play() callbacks (e.g. trending.py) see every accepted play immediately.
+
+import atexit
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+import psycopg2
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.extras import execute_values
+
+import catalog_cache
+
+BUFFER_MAX       = 50000    # events held in memory before submit() blocks
+FLUSH_SIZE       = 1000     # events per INSERT
+FLUSH_INTERVAL   = 1.0      # seconds an event may wait for a flush
+ENQUEUE_TIMEOUT  = 5.0      # seconds submit() blocks on a full buffer
+RETRY_DELAY      = 2.0      # seconds before retrying after a lost connection
+FLUSH_SAMPLES    = 1000     # flush durations kept for percentiles
+
+# Same outcomes record_song_play() reports
+PLAY_QUEUED   = "Play recorded successfully."
+PLAY_DENIED   = "Permission Denied: Free users can't play premium songs."
+PLAY_NO_SONG  = "Error: Song not found."
+
+INSERT_SQL = "INSERT INTO play_history (user_name, song_id, listen_duration, tenant_id, played_at) VALUES %s"
+
+# ── premium gate ─────────────────────────────────────────────────────────────
+premium_cache = catalog_cache.TenantCache("song_premium")
+
+SONG_UNKNOWN, SONG_FREE, SONG_PREMIUM = 0, 1, 2
+
+
+def song_premium_map(cur, tenant_id):
+    # (song_ids, flags): the tenant's song_ids ascending in an array('i') and a
+    # parallel bytearray of flags, 5 B per song of this tenant. song_id is a
+    # global SERIAL, so a table indexed by it would cost every tenant the
+    # global max id. song_premium_flags() is SECURITY DEFINER, so free listeners
+    # still learn which hidden songs are premium; cached per tenant, not per role.
+    def load():
+        cur.execute("SELECT song_id, is_premium FROM song_premium_flags()")
+        song_ids, flags = array("i"), bytearray()
+        for song_id, is_premium in cur.fetchall():
+            song_ids.append(song_id)
+            flags.append(SONG_PREMIUM if is_premium else SONG_FREE)
+        return song_ids, flags
+
+    return premium_cache.get(tenant_id, "all", load)
+
+
+def song_flag(premium_map, song_id):
+    song_ids, flags = premium_map
+    i = bisect_left(song_ids, song_id)
+    return flags[i] if i < len(song_ids) and song_ids[i] == song_id else SONG_UNKNOWN
+
+
+# callbacks(tenant_id, song_id, is_premium, played_at) for in-memory views of plays
+_play_listeners = []
+
+
+def on_play(callback):
+    _play_listeners.append(callback)
+    return callback
+
+
+class PlayBufferFull(Exception):
+    pass
+
+
+class PlayEventBuffer:
+    def __init__(self, connect_kwargs, buffer_max=BUFFER_MAX, flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, enqueue_timeout=ENQUEUE_TIMEOUT):
+        self._connect_kwargs = connect_kwargs
+        self.buffer_max = buffer_max
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()     # one writer at a time
+        self._conn = None
+        self._closed = False
+
+        self._started = time.monotonic()
+        self._submitted = 0
+        self._denied = 0
+        self._blocked = 0
+        self._rejected = 0
+        self._written = 0
+        self._failed = 0
+        self._flushes = 0
+        self._max_buffered = 0
+        self._flush_times = deque(maxlen=FLUSH_SAMPLES)
+        self._last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="play-ingest", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ── producers ────────────────────────────────────────────────────────────
+    def submit(self, cur, identity, song_id, duration=None):
+        # cur is the caller's session cursor, only used to load the premium map
+        flag = song_flag(song_premium_map(cur, identity.tenant_id), song_id)
+        if flag == SONG_UNKNOWN:
+            return PLAY_NO_SONG
+        if flag == SONG_PREMIUM and identity.db_role == "listener_free":
+            with self._cond:
+                self._denied += 1
+            return PLAY_DENIED
+
+        event = (identity.username, song_id, duration, identity.tenant_id, time.time())
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            if self._closed:
+                raise PlayBufferFull("Play ingestion is shut down")
+            if len(self._events) >= self.buffer_max:
+                self._blocked += 1
+                self._cond.notify_all()         # wake the flusher early
+                while len(self._events) >= self.buffer_max:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._closed:
+                        self._rejected += 1
+                        raise PlayBufferFull(
+                            f"Play buffer full ({self.buffer_max} events) for {self.enqueue_timeout:.0f}s"
+                        )
+                    self._cond.wait(remaining)
+            self._events.append(event)
+            self._submitted += 1
+            self._max_buffered = max(self._max_buffered, len(self._events))
+            if len(self._events) >= self.flush_size:
+                self._cond.notify_all()
+
+        for callback in _play_listeners:
+            callback(identity.tenant_id, song_id, flag == SONG_PREMIUM, event[4])
+        return PLAY_QUEUED
+
+    # ── flusher ──────────────────────────────────────────────────────────────
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._events) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except (OperationalError, InterfaceError):
+                time.sleep(RETRY_DELAY)
+            except Exception as e:
+                # Never let the flusher die: producers would fill the buffer for good
+                self._last_error = str(e)
+                time.sleep(RETRY_DELAY)
+
+    def _take(self):
+        with self._cond:
+            batch = [self._events.popleft() for _ in range(min(self.flush_size, len(self._events)))]
+            self._cond.notify_all()             # room for blocked producers
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._events.extendleft(reversed(batch))
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**self._connect_kwargs)
+        return self._conn
+
+    def _drop_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def _rollback(self):
+        try:
+            if self._conn is not None and not self._conn.closed:
+                self._conn.rollback()
+        except psycopg2.Error:
+            self._drop_connection()
+
+    def flush(self):
+        # Writes everything buffered so far, FLUSH_SIZE rows per INSERT
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return
+                started = time.perf_counter()
+                try:
+                    self._write(batch)
+                except (OperationalError, InterfaceError) as e:
+                    # Connection lost: keep the events for the next attempt
+                    self._requeue(batch)
+                    self._last_error = str(e)
+                    self._drop_connection()
+                    raise
+                except psycopg2.Error as e:
+                    # The server refused the whole batch (e.g. a revoked grant):
+                    # retrying won't help, so count it as failed and keep going
+                    self._rollback()
+                    self._last_error = str(e)
+                    with self._cond:
+                        self._failed += len(batch)
+                    continue
+                with self._cond:
+                    self._flushes += 1
+                    self._flush_times.append(time.perf_counter() - started)
+
+    def _write(self, batch):
+        conn = self._connection()
+        try:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur, INSERT_SQL, batch,
+                    template="(%s, %s, %s, %s, to_timestamp(%s))", page_size=len(batch)
+                )
+            conn.commit()
+            with self._cond:
+                self._written += len(batch)
+        except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+            # One bad row (e.g. a song deleted meanwhile) must not drop the batch
+            conn.rollback()
+            self._last_error = str(e)
+            self._write_rows(conn, batch)
+
+    def _write_rows(self, conn, batch):
+        written = failed = 0
+        with conn.cursor() as cur:
+            for event in batch:
+                cur.execute("SAVEPOINT play_row")
+                try:
+                    execute_values(cur, INSERT_SQL, [event], template="(%s, %s, %s, %s, to_timestamp(%s))")
+                    written += 1
+                except (psycopg2.IntegrityError, psycopg2.DataError):
+                    cur.execute("ROLLBACK TO SAVEPOINT play_row")
+                    failed += 1
+        conn.commit()
+        with self._cond:
+            self._written += written
+            self._failed += failed
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=self.flush_interval + 1)
+        try:
+            self.flush()
+        except psycopg2.Error:
+            pass
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+
+    # ── stats ────────────────────────────────────────────────────────────────
+    def stats(self):
+        with self._cond:
+            flush_times = sorted(self._flush_times)
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            stats = {
+                "buffered":       len(self._events),
+                "buffer_max":     self.buffer_max,
+                "max_buffered":   self._max_buffered,
+                "submitted":      self._submitted,
+                "written":        self._written,
+                "failed":         self._failed,
+                "denied":         self._denied,
+                "blocked":        self._blocked,
+                "rejected":       self._rejected,
+                "flushes":        self._flushes,
+                "rows_per_sec":   round(self._written / elapsed, 1),
+                "last_error":     self._last_error,
+            }
+
+        def pct(p):
+            if not flush_times:
+                return 0.0
+            return round(flush_times[min(len(flush_times) - 1, int(p * len(flush_times)))] * 1000, 2)
+
+        stats["flush_p50_ms"] = pct(0.50)
+        stats["flush_max_ms"] = round(flush_times[-1] * 1000, 2) if flush_times else 0.0
+        return stats
@@ -0,0 +1,184 @@
+# recommender.py
+# Co-listen ("people who played this also played") recommender, built in batch.
+# Requirements: pip install psycopg2-binary numpy scipy
+#
+#   python APP/manage.py recommender build [--tenant UUID] [--top-k 20]
+#
+# Per tenant:
+#   1. R = users x songs, weight log1p(minutes listened) from play_history
+#   2. item-item cosine similarity R_n^T R_n (R_n = column-normalised R),
+#      computed in blocks sized by their output and pruned to NEIGHBOURS per song
+#   3. scores = R_users @ S, minus songs already played, minus premium songs
+#      for anyone not known to be listener_premium; TOP_K kept per user
+#   4. swapped into user_recommendations in one transaction (COPY), so the
+#      Recommendations tab is a single indexed lookup via my_recommendations()
+
+import csv
+import io
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+TOP_K            = 20           # recommendations stored per user
+NEIGHBOURS       = 50           # similar songs kept per song
+DEFAULT_DURATION = 180          # seconds assumed for a play without listen_duration
+WORK_BUDGET      = 20_000_000   # max nonzeros produced by one sparse product block
+
+PLAYS_SQL = """
+    SELECT user_name, song_id, SUM(COALESCE(listen_duration, %s))
+    FROM play_history
+    WHERE tenant_id = %s
+    GROUP BY user_name, song_id
+"""
+TENANTS_SQL = "SELECT DISTINCT tenant_id::text FROM play_song_daily"
+PREMIUM_USERS_SQL = "SELECT user_name FROM users WHERE tenant_id = %s AND role_type = 'listener_premium'"
+PREMIUM_SONGS_SQL = "SELECT song_id FROM songs WHERE tenant_id = %s AND is_premium IS NOT FALSE"
+
+
+# ── sparse helpers ───────────────────────────────────────────────────────────
+def build_matrix(rows):
+    # rows: iterable of (user_name, song_id, seconds) -> (user_names, song_ids, csr R)
+    users, user_idx, songs, song_idx = [], {}, [], {}
+    r_idx, c_idx, weights = [], [], []
+    for user_name, song_id, seconds in rows:
+        if user_name not in user_idx:
+            user_idx[user_name] = len(users)
+            users.append(user_name)
+        if song_id not in song_idx:
+            song_idx[song_id] = len(songs)
+            songs.append(song_id)
+        r_idx.append(user_idx[user_name])
+        c_idx.append(song_idx[song_id])
+        weights.append(float(seconds))
+    matrix = sp.csr_matrix(
+        (np.log1p(np.asarray(weights, dtype=np.float32) / 60.0), (r_idx, c_idx)),
+        shape=(len(users), len(songs)), dtype=np.float32
+    )
+    return users, np.asarray(songs, dtype=np.int64), matrix
+
+
+def top_per_row(matrix, k):
+    # Keeps the k largest entries of every row, fully vectorised (no per-row loop)
+    matrix = sp.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, rows))
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    keep = order[rank < k]
+    return sp.csr_matrix((matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape)
+
+
+def _blocks(work, budget=WORK_BUDGET):
+    # Contiguous [start, end) row ranges whose summed work stays under budget
+    start, total = 0, 0
+    for i, amount in enumerate(np.asarray(work).tolist()):
+        if total and total + amount > budget:
+            yield start, i
+            start, total = i, 0
+        total += amount
+    if start < len(work):
+        yield start, len(work)
+
+
+def item_similarity(matrix, neighbours=NEIGHBOURS):
+    # Cosine similarity between songs (columns), top `neighbours` per song
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    normalised = sp.csr_matrix(matrix @ sp.diags(1.0 / np.maximum(norms, 1e-12)))
+    by_song = normalised.T.tocsr()
+    # a song's output row can touch every song its listeners played; counted on
+    # the nonzero pattern, since the normalised weights are <= 1
+    user_degree = np.diff(normalised.indptr)
+    work = (by_song != 0).astype(np.int64) @ user_degree
+
+    blocks = []
+    for start, end in _blocks(work):
+        block = (by_song[start:end] @ normalised).tocoo()
+        off_diagonal = block.col != block.row + start
+        block = sp.csr_matrix((block.data[off_diagonal], (block.row[off_diagonal], block.col[off_diagonal])),
+                              shape=block.shape)
+        blocks.append(top_per_row(block, neighbours))
+    return sp.vstack(blocks, format="csr") if blocks else sp.csr_matrix((matrix.shape[1], matrix.shape[1]))
+
+
+def score_users(matrix, similarity, premium_songs, premium_users, top_k=TOP_K):
+    # Yields (user_index, song_index, score, rank) arrays block by block
+    played = np.diff(matrix.indptr)
+    premium_cols = sp.diags(premium_songs.astype(np.float32))
+    for start, end in _blocks(played * NEIGHBOURS):
+        listened = matrix[start:end]
+        scores = listened @ similarity
+        # never recommend what the user already played
+        scores = scores - scores.multiply(listened.astype(bool))
+        # free (or unknown) users never get premium songs
+        free_rows = sp.diags((~premium_users[start:end]).astype(np.float32))
+        scores = scores - free_rows @ scores @ premium_cols
+        best = top_per_row(scores, top_k).tocoo()
+
+        order = np.lexsort((-best.data, best.row))
+        rows, cols, data = best.row[order], best.col[order], best.data[order]
+        first = np.searchsorted(rows, rows, side="left")
+        yield rows + start, cols, data, np.arange(len(rows)) - first + 1
+
+
+def compute(matrix, premium_songs, premium_users, top_k=TOP_K, neighbours=NEIGHBOURS):
+    # Pure NumPy/SciPy part of the batch, also used by BENCH/bench_recommender.py
+    timings = {}
+    started = time.perf_counter()
+    similarity = item_similarity(matrix, neighbours)
+    timings["similarity_s"] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    parts = list(score_users(matrix, similarity, premium_songs, premium_users, top_k))
+    timings["scoring_s"] = round(time.perf_counter() - started, 2)
+    if parts:
+        result = tuple(np.concatenate(column) for column in zip(*parts))
+    else:
+        result = tuple(np.empty(0) for _ in range(4))
+    return result, timings
+
+
+# ── batch job ────────────────────────────────────────────────────────────────
+def build_tenant(conn, tenant_id, top_k=TOP_K, neighbours=NEIGHBOURS):
+    started = time.perf_counter()
+    with conn.cursor(name="recommender_plays") as cur:
+        cur.itersize = 100_000
+        cur.execute(PLAYS_SQL, (DEFAULT_DURATION, tenant_id))
+        users, song_ids, matrix = build_matrix(cur)
+    with conn.cursor() as cur:
+        cur.execute(PREMIUM_USERS_SQL, (tenant_id,))
+        premium_user_names = {row[0] for row in cur.fetchall()}
+        cur.execute(PREMIUM_SONGS_SQL, (tenant_id,))
+        premium_song_ids = np.fromiter((row[0] for row in cur.fetchall()), dtype=np.int64)
+    load_s = time.perf_counter() - started
+
+    premium_users = np.fromiter((name in premium_user_names for name in users), dtype=bool, count=len(users))
+    premium_songs = np.isin(song_ids, premium_song_ids)
+    (user_rows, song_cols, scores, ranks), timings = compute(matrix, premium_songs, premium_users, top_k, neighbours)
+
+    started = time.perf_counter()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for user_row, song_col, score, rank in zip(user_rows, song_cols, scores, ranks):
+        writer.writerow((tenant_id, users[user_row], int(rank), int(song_ids[song_col]), f"{score:.6g}"))
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM user_recommendations WHERE tenant_id = %s", (tenant_id,))
+        cur.copy_expert("COPY user_recommendations (tenant_id, user_name, rank, song_id, score) "
+                        "FROM STDIN WITH (FORMAT csv)", buffer)
+    conn.commit()
+    timings["write_s"] = round(time.perf_counter() - started, 2)
+
+    return dict(tenant_id=tenant_id, users=len(users), songs=len(song_ids), pairs=matrix.nnz,
+                recommendations=len(scores), load_s=round(load_s, 2), **timings)
+
+
+def build_all(conn, tenant_id=None, top_k=TOP_K):
+    if tenant_id:
+        tenants = [tenant_id]
+    else:
+        with conn.cursor() as cur:
+            cur.execute(TENANTS_SQL)
+            tenants = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    return [build_tenant(conn, tenant, top_k) for tenant in tenants]
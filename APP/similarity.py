@@ -0,0 +1,290 @@
+# similarity.py
+# Content-based "more like this": nearest songs by genre, artist, rating and tier.
+# Requirements: pip install psycopg2-binary numpy
+#
+# Works from catalog metadata alone, so a song is matchable the moment it is
+# added - no play history needed. Each song becomes a small L2-normalised
+# float32 vector (cosine similarity = dot product):
+#   genre     hashed one-hot, GENRE_DIMS buckets
+#   artist    signed hashed one-hot, ARTIST_DIMS buckets
+#   rating    centred to [-1, 1]
+#   premium   +1 / -1
+# DIMS = 114 floats is ~460 B per song (~460 MB per 1M songs in one tenant).
+#
+# Up to BRUTE_FORCE_LIMIT songs a query batch is one matrix product against
+# the whole tenant. Beyond that the index trains an IVF layer: spherical
+# k-means centroids (~sqrt(n) lists) and each query scans only the NPROBE
+# closest lists. New songs are assigned to their nearest list as they
+# arrive; the centroids are retrained once the catalog doubles.
+#
+# Indexes are kept per (tenant, role) and loaded through the caller's RLS,
+# like typeahead.py, and follow the catalog the same way: song_added() appends
+# this process's inserts and songs_changed INSERT notifications; any other
+# notification (UPDATE/DELETE) or REBUILD_TTL rebuilds the index from scratch,
+# so a song flipped to premium leaves the listener_free index.
+
+import threading
+import time
+import zlib
+from array import array
+
+import numpy as np
+
+import catalog_cache
+
+GENRE_DIMS         = 16
+ARTIST_DIMS        = 96
+DIMS               = GENRE_DIMS + ARTIST_DIMS + 2
+WEIGHT_GENRE       = 1.0
+WEIGHT_ARTIST      = 1.2
+WEIGHT_RATING      = 0.6
+WEIGHT_PREMIUM     = 0.3
+
+DEFAULT_K          = 8
+BRUTE_FORCE_LIMIT  = 50_000     # songs before the IVF layer is trained
+NPROBE             = 8          # lists scanned per query
+KMEANS_SAMPLE      = 20_000
+KMEANS_ITERATIONS  = 8
+REBUILD_TTL        = catalog_cache.DEFAULT_TTL   # seconds before a rebuild even without a notification
+
+
+def _bucket(text, dims):
+    # crc32 rather than hash(): must be stable across processes and restarts
+    digest = zlib.crc32((text or "").strip().lower().encode("utf-8"))
+    return digest % dims, (1.0 if (digest >> 16) & 1 else -1.0)
+
+
+def feature_vectors(rows):
+    # rows: [(song_id, genre, artist, rating, is_premium)] -> (n, DIMS) float32
+    vectors = np.zeros((len(rows), DIMS), dtype=np.float32)
+    for i, (_, genre, artist, rating, is_premium) in enumerate(rows):
+        genre_bucket, _ = _bucket(genre, GENRE_DIMS)
+        artist_bucket, sign = _bucket(artist, ARTIST_DIMS)
+        vectors[i, genre_bucket] = WEIGHT_GENRE
+        vectors[i, GENRE_DIMS + artist_bucket] = sign * WEIGHT_ARTIST
+        vectors[i, -2] = WEIGHT_RATING * ((float(rating) - 2.5) / 2.5 if rating is not None else 0.0)
+        vectors[i, -1] = WEIGHT_PREMIUM * (1.0 if is_premium else -1.0)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._size = 0
+        self._vectors = np.zeros((1024, DIMS), dtype=np.float32)
+        self._song_ids = np.zeros(1024, dtype=np.int64)
+        self._premium = np.zeros(1024, dtype=bool)
+        self._row_of = {}
+        self._centroids = None
+        self._lists = []                # IVF: array("i") of rows per centroid
+        self._trained_size = 0
+        self._added = []                # rows from song_added(), in arrival order
+        self.stale = False
+        self.built_at = time.monotonic()
+        self.refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    # ── building ─────────────────────────────────────────────────────────────
+    def _append(self, rows):
+        if not rows:
+            return
+        vectors = feature_vectors(rows)
+        start = self._size
+        needed = start + len(rows)
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors))
+            self._vectors = np.resize(self._vectors, (capacity, DIMS))
+            self._song_ids = np.resize(self._song_ids, capacity)
+            self._premium = np.resize(self._premium, capacity)
+        self._vectors[start:needed] = vectors
+        for offset, (song_id, _, _, _, is_premium) in enumerate(rows):
+            self._song_ids[start + offset] = song_id
+            self._premium[start + offset] = bool(is_premium)
+            self._row_of[song_id] = start + offset
+        self._size = needed
+
+        if len(self) > BRUTE_FORCE_LIMIT and len(self) > 2 * self._trained_size:
+            self._train()
+        elif self._centroids is not None:
+            for row, best in zip(range(start, needed), np.argmax(vectors @ self._centroids.T, axis=1)):
+                self._lists[best].append(row)
+
+    def _train(self):
+        # Spherical k-means on a sample, then every song goes to its nearest centroid
+        n = len(self)
+        vectors = self._vectors[:n]
+        rng = np.random.default_rng(n)
+        sample = vectors[rng.choice(n, min(n, KMEANS_SAMPLE), replace=False)]
+        n_lists = max(1, int(np.sqrt(n)))
+        centroids = sample[rng.choice(len(sample), min(n_lists, len(sample)), replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        lists = [array("i") for _ in range(len(centroids))]
+        for start in range(0, n, 65536):
+            for row, best in enumerate(np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1), start):
+                lists[best].append(row)
+        self._centroids, self._lists, self._trained_size = centroids, lists, n
+
+    def load(self, rows):
+        # rows: iterable of (song_id, genre, artist, rating, is_premium), into a fresh index
+        batch = []
+        with self._lock:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= 10000:
+                    self._append(batch)
+                    batch = []
+            self._append(batch)
+
+    def add(self, song_id, genre, artist, rating, is_premium):
+        # The same song can come from song_added() and its own notification,
+        # or be in a rebuild already: both are skipped
+        with self._lock:
+            self._added.append((song_id, genre, artist, rating, is_premium))
+            if song_id in self._row_of:
+                return
+            self._append([(song_id, genre, artist, rating, is_premium)])
+
+    def added_since(self, mark):
+        with self._lock:
+            return self._added[mark:]
+
+    # ── queries ──────────────────────────────────────────────────────────────
+    def _candidates(self, query):
+        probe = np.argpartition(-(self._centroids @ query), min(NPROBE, len(self._lists)) - 1)[:NPROBE]
+        rows = [np.frombuffer(self._lists[c], dtype=np.int32) for c in probe if len(self._lists[c])]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+
+    def similar(self, song_ids, k=DEFAULT_K, include_premium=True):
+        # {song_id: [(similar_song_id, cosine)]} for every known song_id, best first
+        with self._lock:
+            n = len(self)
+            rows = [self._row_of[s] for s in song_ids if s in self._row_of]
+            if not rows:
+                return {}
+            vectors = self._vectors[:n]
+            premium = self._premium[:n]
+            song_id_array = self._song_ids[:n]
+            queries = vectors[rows]
+
+            if self._centroids is None:
+                # one (queries x songs) product for the whole batch
+                scores = queries @ vectors.T
+                if not include_premium:
+                    scores[:, premium] = -np.inf
+                scores[np.arange(len(rows)), rows] = -np.inf
+                candidate_sets = [None] * len(rows)
+            else:
+                candidate_sets = [self._candidates(q) for q in queries]
+                scores = None
+
+            results = {}
+            for i, row in enumerate(rows):
+                if scores is not None:
+                    candidates, row_scores = None, scores[i]
+                else:
+                    candidates = candidate_sets[i]
+                    candidates = candidates[candidates != row]
+                    if not include_premium:
+                        candidates = candidates[~premium[candidates]]
+                    row_scores = vectors[candidates] @ queries[i]
+                top = min(k, len(row_scores))
+                if top == 0:
+                    results[int(song_id_array[row])] = []
+                    continue
+                best = np.argpartition(-row_scores, top - 1)[:top]
+                best = best[np.argsort(-row_scores[best])]
+                best = best[np.isfinite(row_scores[best])]
+                hits = best if candidates is None else candidates[best]
+                results[int(song_id_array[row])] = [(int(song_id_array[h]), float(row_scores[b]))
+                                                    for h, b in zip(hits, best)]
+            return results
+
+    def memory_bytes(self):
+        with self._lock:
+            return (self._vectors.nbytes + self._song_ids.nbytes + self._premium.nbytes
+                    + sum(len(lst) * 4 for lst in self._lists))
+
+
+# ── per-tenant registry ──────────────────────────────────────────────────────
+_indexes = {}                # (tenant_id, scope) -> SimilarityIndex
+_indexes_lock = threading.Lock()
+
+SONGS_SQL = "SELECT song_id, genre, artist, rating, is_premium FROM songs ORDER BY song_id"
+
+
+def _fetch_rows(cur):
+    cur.execute(SONGS_SQL)
+    while True:
+        batch = cur.fetchmany(10000)
+        if not batch:
+            return
+        yield from (tuple(row) for row in batch)
+
+
+def get_index(cur, tenant_id, scope):
+    # cur must carry the same role/tenant as scope: RLS decides what gets indexed
+    key = (tenant_id, scope)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SimilarityIndex()
+            index.stale = True
+
+    if index.stale or time.monotonic() - index.built_at > REBUILD_TTL:
+        with index.refresh_lock:
+            with _indexes_lock:
+                current = _indexes.get(key)
+            if current is not index:
+                return current          # another thread already swapped in a rebuild
+            # Cleared first so a notification arriving mid-build isn't lost
+            index.stale = False
+            mark = len(index.added_since(0))
+            try:
+                fresh = SimilarityIndex()
+                fresh.load(_fetch_rows(cur))
+            except Exception:
+                index.stale = True
+                raise
+            # Songs added while the build ran may have committed after its snapshot
+            for row in index.added_since(mark):
+                fresh.add(*row)
+            with _indexes_lock:
+                fresh.stale = index.stale
+                _indexes[key] = index = fresh
+    return index
+
+
+def more_like_this(cur, tenant_id, scope, song_ids, k=DEFAULT_K):
+    index = get_index(cur, tenant_id, scope)
+    # Same rule as songs_listener_free_policy: free listeners never see premium songs
+    return index.similar(song_ids, k, include_premium=(scope != "listener_free"))
+
+
+def song_added(tenant_id, song_id, genre, artist, rating, is_premium):
+    with _indexes_lock:
+        indexes = [idx for (t, _), idx in _indexes.items() if t in (tenant_id, None)]
+    for index in indexes:
+        index.add(song_id, genre, artist, rating, is_premium)
+
+
+@catalog_cache.on_insert
+def _song_inserted(tenant_id, song):
+    song_added(tenant_id, song["song_id"], song["genre"], song["artist"], song["rating"], song["is_premium"])
+
+
+@catalog_cache.on_invalidate
+def _mark_stale(tenant_id):
+    with _indexes_lock:
+        for (t, _), index in _indexes.items():
+            if tenant_id is None or t in (tenant_id, None):
+                index.stale = True
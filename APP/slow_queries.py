@@ -0,0 +1,279 @@
+# slow_queries.py
+# Slow query report from pg_stat_statements, with stored snapshots and plans.
+# Requirements: pip install psycopg2-binary
+#               PostgreSQL 13+ with shared_preload_libraries = 'pg_stat_statements'
+#               (pg_stat_statements.track = 'all' also records the statements
+#               inside plpgsql functions)
+#
+#   python APP/manage.py slow-report snapshot [--label v1.4] [--plans 5]
+#   python APP/manage.py slow-report show [SNAPSHOT] [--by total|mean] [--nested]
+#   python APP/manage.py slow-report diff BEFORE AFTER
+#   python APP/manage.py slow-report list
+#
+# pg_stat_statements counters are cumulative, so a snapshot stores them as
+# they are and every report works on the difference to the snapshot before
+# it ("what ran between two snapshots"). Taking a snapshot right before and
+# after a deployment and diffing the two intervals shows what got slower.
+#
+# Statements are grouped by the app's SQL function they call ("search_songs()")
+# or, for ad-hoc SQL, by pg_stat_statements' queryid. The top offenders of
+# each snapshot get an EXPLAIN plan, run as the role that issued them and
+# rolled back; statements with $n parameters need EXPLAIN (GENERIC_PLAN),
+# i.e. PostgreSQL 16+.
+
+import json
+import re
+
+from psycopg2.extras import Json, execute_values
+
+SNAPSHOT_ROWS      = 1000       # pg_stat_statements entries kept per snapshot (by total time)
+DEFAULT_PLANS      = 5          # top offenders explained per snapshot
+EXPLAIN_TIMEOUT    = "5s"
+GENERIC_PLAN_MIN   = 160000     # server_version_num with EXPLAIN (GENERIC_PLAN)
+
+_CALL_RE    = re.compile(r"\b([a-z_][a-z0-9_]*)\s*\(", re.I)
+_EXPLAIN_RE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES|TABLE)\b", re.I)
+
+FUNCTIONS_SQL = """
+    SELECT p.proname
+    FROM pg_proc p
+    JOIN pg_language l ON l.oid = p.prolang
+    WHERE p.pronamespace = 'public'::regnamespace
+      AND l.lanname IN ('sql', 'plpgsql')
+      AND p.prokind = 'f'
+"""
+
+STATEMENTS_SQL = """
+    SELECT s.queryid, r.rolname, {toplevel} AS toplevel, s.query, s.calls, s.total_exec_time,
+           s.rows, s.shared_blks_hit, s.shared_blks_read, s.temp_blks_written
+    FROM pg_stat_statements s
+    JOIN pg_roles r ON r.oid = s.userid
+    WHERE s.dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND s.queryid IS NOT NULL
+      AND s.query NOT ILIKE '%%pg_stat_statements%%'
+      AND s.query NOT ILIKE '%%query_snapshot%%'
+    ORDER BY s.total_exec_time DESC
+    LIMIT %s
+"""
+
+INSERT_SNAPSHOT_SQL = """
+    INSERT INTO query_snapshots(label, server_version) VALUES (%s, %s)
+    RETURNING snapshot_id, taken_at
+"""
+
+INSERT_STATS_SQL = """
+    INSERT INTO query_snapshot_stats(snapshot_id, queryid, db_role, toplevel, query, calls, total_ms,
+                                     rows, shared_blks_hit, shared_blks_read, temp_blks_written, query_group)
+    VALUES %s
+"""
+
+# One row per statement: its counters over the interval since the previous
+# snapshot. Counters that went down were reset in between, so they count whole.
+INTERVAL_SQL = """
+    WITH prev AS (
+        SELECT max(snapshot_id) AS snapshot_id FROM query_snapshots WHERE snapshot_id < %(snapshot)s
+    )
+    SELECT c.queryid, c.db_role, c.toplevel, c.query, c.query_group, c.plan_summary, c.plan_error,
+           CASE WHEN p.calls IS NULL OR c.calls < p.calls THEN c.calls ELSE c.calls - p.calls END AS calls,
+           CASE WHEN p.calls IS NULL OR c.calls < p.calls THEN c.total_ms ELSE c.total_ms - p.total_ms END AS total_ms,
+           CASE WHEN p.calls IS NULL OR c.calls < p.calls THEN c.rows ELSE c.rows - p.rows END AS rows,
+           CASE WHEN p.calls IS NULL OR c.calls < p.calls THEN c.shared_blks_read
+                ELSE c.shared_blks_read - p.shared_blks_read END AS blks_read
+    FROM query_snapshot_stats c
+    LEFT JOIN query_snapshot_stats p
+           ON p.snapshot_id = (SELECT snapshot_id FROM prev)
+          AND (p.queryid, p.db_role, p.toplevel) = (c.queryid, c.db_role, c.toplevel)
+    WHERE c.snapshot_id = %(snapshot)s
+"""
+
+SAVE_PLAN_SQL = """
+    UPDATE query_snapshot_stats SET plan = %s, plan_summary = %s, plan_error = %s
+    WHERE snapshot_id = %s AND queryid = %s AND db_role = %s AND toplevel = %s
+"""
+
+LIST_SQL = """
+    SELECT s.snapshot_id, s.taken_at, s.label, count(q.queryid) AS statements, count(q.plan) AS plans
+    FROM query_snapshots s
+    LEFT JOIN query_snapshot_stats q USING (snapshot_id)
+    GROUP BY s.snapshot_id
+    ORDER BY s.snapshot_id DESC
+    LIMIT %s
+"""
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# ── grouping ─────────────────────────────────────────────────────────────────
+def app_functions(cur):
+    cur.execute(FUNCTIONS_SQL)
+    return {row[0].lower() for row in cur.fetchall()}
+
+
+def query_group(query, functions):
+    # first app function the statement calls, e.g. "search_songs()"; None = ad-hoc
+    for name in _CALL_RE.findall(query or ""):
+        if name.lower() in functions:
+            return f"{name.lower()}()"
+    return None
+
+
+# ── plans ────────────────────────────────────────────────────────────────────
+def summarize_plan(plan):
+    # "Seq Scan songs, Index Scan play_history ... (cost 1234)" from EXPLAIN JSON
+    scans = []
+
+    def walk(node):
+        if node.get("Relation Name"):
+            scan = f"{node['Node Type']} {node['Relation Name']}"
+            if scan not in scans:
+                scans.append(scan)
+        elif node.get("Node Type") == "Function Scan":
+            scans.append(f"Function Scan {node.get('Function Name', '?')}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    root = plan[0]["Plan"]
+    walk(root)
+    return f"{', '.join(scans) or root['Node Type']} (cost {root.get('Total Cost', 0):,.0f})"
+
+
+def explain(cur, query, role, tenant_id, server_version):
+    # -> (plan JSON, error). Runs in its own transaction, always rolled back.
+    if not _EXPLAIN_RE.match(query or ""):
+        return None, "not explainable (utility statement)"
+    generic = "$" in query
+    if generic and server_version < GENERIC_PLAN_MIN:
+        return None, "parameterized: EXPLAIN (GENERIC_PLAN) needs PostgreSQL 16+"
+
+    options = "GENERIC_PLAN, FORMAT JSON" if generic else "FORMAT JSON"
+    conn = cur.connection
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        cur.execute("SET LOCAL statement_timeout = %s", (EXPLAIN_TIMEOUT,))
+        # the issuing role's RLS policies shape the plan; tenant is any real one
+        cur.execute("SELECT set_config('app.current_tenant', %s, true)", (tenant_id or "",))
+        cur.execute("SELECT rolsuper FROM pg_roles WHERE rolname = %s", (role,))
+        row = cur.fetchone()
+        if row and not row[0]:
+            cur.execute("SELECT set_config('role', %s, true)", (role,))
+        cur.execute(f"EXPLAIN ({options}) {query}")
+        plan = cur.fetchone()[0]
+        return (json.loads(plan) if isinstance(plan, str) else plan), None
+    except Exception as e:
+        return None, str(e).strip().splitlines()[0][:300]
+    finally:
+        conn.rollback()
+        conn.autocommit = autocommit
+
+
+def capture_plans(cur, snapshot_id, server_version, limit=DEFAULT_PLANS):
+    cur.execute("SELECT tenant_id::text FROM tenants ORDER BY created_at LIMIT 1")
+    row = cur.fetchone()
+    tenant_id = row[0] if row else None
+
+    offenders = sorted(interval_stats(cur, snapshot_id), key=lambda s: s["total_ms"], reverse=True)[:limit]
+    for stat in offenders:
+        plan, error = explain(cur, stat["query"], stat["db_role"], tenant_id, server_version)
+        summary = summarize_plan(plan) if plan else None
+        cur.execute(SAVE_PLAN_SQL, (Json(plan) if plan else None, summary, error,
+                                    snapshot_id, stat["queryid"], stat["db_role"], stat["toplevel"]))
+    return len(offenders)
+
+
+# ── snapshots ────────────────────────────────────────────────────────────────
+def take_snapshot(cur, label=None, plans=DEFAULT_PLANS):
+    cur.execute("SELECT current_setting('server_version_num')::int")
+    server_version = cur.fetchone()[0]
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    if cur.fetchone() is None:
+        raise SnapshotError("pg_stat_statements is not installed: CREATE EXTENSION pg_stat_statements "
+                            "(and add it to shared_preload_libraries)")
+
+    toplevel = "s.toplevel" if server_version >= 140000 else "TRUE"
+    cur.execute(STATEMENTS_SQL.format(toplevel=toplevel), (SNAPSHOT_ROWS,))
+    statements = cur.fetchall()
+
+    functions = app_functions(cur)
+    cur.execute(INSERT_SNAPSHOT_SQL, (label, server_version))
+    snapshot_id, taken_at = cur.fetchone()
+    if statements:
+        execute_values(cur, INSERT_STATS_SQL,
+                       [(snapshot_id,) + tuple(row) + (query_group(row[3], functions),) for row in statements])
+    explained = capture_plans(cur, snapshot_id, server_version, plans) if plans else 0
+    return {"snapshot_id": snapshot_id, "taken_at": taken_at, "statements": len(statements),
+            "plans": explained}
+
+
+def list_snapshots(cur, limit=20):
+    cur.execute(LIST_SQL, (limit,))
+    return cur.fetchall()
+
+
+def latest_snapshot(cur):
+    cur.execute("SELECT max(snapshot_id) FROM query_snapshots")
+    return cur.fetchone()[0]
+
+
+def interval_stats(cur, snapshot_id):
+    cur.execute(INTERVAL_SQL, {"snapshot": snapshot_id})
+    columns = [col[0] for col in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+# ── reports ──────────────────────────────────────────────────────────────────
+def report(cur, snapshot_id=None, by="total", limit=15, nested=False):
+    # -> groups ranked by total or mean time over the snapshot's interval.
+    # Statements inside functions (toplevel = FALSE) are left out unless
+    # nested=True: their time is already part of the calling function's.
+    snapshot_id = snapshot_id or latest_snapshot(cur)
+    if snapshot_id is None:
+        return []
+    groups = {}
+    for stat in interval_stats(cur, snapshot_id):
+        if not stat["calls"] or (not stat["toplevel"] and not nested):
+            continue
+        key = stat["query_group"] or f"#{stat['queryid']}"
+        group = groups.setdefault(key, {
+            "group": key, "kind": "function" if stat["query_group"] else ("nested" if not stat["toplevel"] else "ad-hoc"),
+            "calls": 0, "total_ms": 0.0, "rows": 0, "blks_read": 0, "roles": set(),
+            "query": stat["query"], "plan_summary": None, "plan_error": None,
+        })
+        group["calls"] += stat["calls"]
+        group["total_ms"] += stat["total_ms"]
+        group["rows"] += stat["rows"]
+        group["blks_read"] += stat["blks_read"]
+        group["roles"].add(stat["db_role"])
+        if stat["plan_summary"] or stat["plan_error"]:
+            group["plan_summary"] = group["plan_summary"] or stat["plan_summary"]
+            group["plan_error"] = group["plan_error"] or stat["plan_error"]
+
+    for group in groups.values():
+        group["mean_ms"] = group["total_ms"] / group["calls"]
+        group["roles"] = ", ".join(sorted(group["roles"]))
+    key = "mean_ms" if by == "mean" else "total_ms"
+    return sorted(groups.values(), key=lambda g: g[key], reverse=True)[:limit]
+
+
+def diff(cur, before, after, limit=15, nested=False):
+    # -> per group: mean time in the interval ending at `before` vs the one ending at `after`
+    old = {g["group"]: g for g in report(cur, before, limit=SNAPSHOT_ROWS, nested=nested)}
+    new = {g["group"]: g for g in report(cur, after, limit=SNAPSHOT_ROWS, nested=nested)}
+    rows = []
+    for key in set(old) | set(new):
+        o, n = old.get(key), new.get(key)
+        rows.append({
+            "group":        key,
+            "query":        (n or o)["query"],
+            "calls_before": o["calls"] if o else 0,
+            "calls_after":  n["calls"] if n else 0,
+            "mean_before":  o["mean_ms"] if o else None,
+            "mean_after":   n["mean_ms"] if n else None,
+            "change":       n["mean_ms"] / o["mean_ms"] - 1 if o and n and o["mean_ms"] else None,
+            "total_after":  n["total_ms"] if n else 0.0,
+        })
+    # biggest regressions first, then groups that only exist on one side
+    rows.sort(key=lambda r: (r["change"] is None, -(r["change"] or 0), -r["total_after"]))
+    return rows[:limit]
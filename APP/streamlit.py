@@ -1,11 +1,28 @@
 import streamlit as st
-import psycopg2
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from psycopg2.extras import DictCursor
 from datetime import datetime
+import io
 import random
+import tempfile
+import time
+
+import browse
+import catalog_cache
+import catalog_search
+import dashboard
+import db_pool
+import history
+import identity_context
+import instrumentation
+import play_ingest
+import similarity
+import slow_queries
+import trending
+import watchdog
+import typeahead
 
 # Page configuration
 st.set_page_config(
@@ -158,6 +175,30 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# One pool per server process, shared by every browser session
+@st.cache_resource
+def get_pool():
+    return db_pool.TenantConnectionPool()
+
+pool = get_pool()
+
+# Drops cached catalog data (dashboard snapshot, ...) when songs change
+@st.cache_resource
+def start_cache_listener():
+    return catalog_cache.start_invalidation_listener(db_pool.APP_LOGIN_CONFIG)
+
+start_cache_listener()
+
+# Batches play events into multi-row INSERTs; flushed on shutdown as well
+@st.cache_resource
+def get_play_buffer():
+    return play_ingest.PlayEventBuffer(db_pool.APP_LOGIN_CONFIG)
+
+play_buffer = get_play_buffer()
+
+# Per-statement timings live in instrumentation.py; exported only if configured
+instrumentation.start_exporter()
+
 # Initialize session state
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -203,23 +244,11 @@ with st.sidebar:
             
             if st.button("🎵 Login as Listener", use_container_width=True):
                 try:
-                    conn = psycopg2.connect(
-                        dbname="backup", 
-                        user="app_login", 
-                        password="app123", 
-                        host="localhost", 
-                        port="5432"
-                    )
-                    conn.autocommit = True
-                    cur = conn.cursor(cursor_factory=DictCursor)
-                    
                     # Call login with 2 parameters (listener doesn't need tenant)
-                    cur.execute("SELECT user_login(%s, %s)", (username, password))
-                    result = cur.fetchone()[0]
+                    result, identity = identity_context.login(pool, username, password)
                     
-                    if "successful" in result.lower():
-                        st.session_state.conn = conn
-                        st.session_state.cur = cur
+                    if identity:
+                        st.session_state.identity = identity
                         st.session_state.username = username
                         st.session_state.role = "listener"
                         st.session_state.logged_in = True
@@ -227,7 +256,6 @@ with st.sidebar:
                         st.rerun()
                     else:
                         st.error(f"❌ {result}")
-                        conn.close()
                 except Exception as e:
                     st.error(f"Connection failed: {str(e)}")
         
@@ -242,23 +270,11 @@ with st.sidebar:
             
             if st.button("💼 Login as Appuser", use_container_width=True):
                 try:
-                    conn = psycopg2.connect(
-                        dbname="backup", 
-                        user="app_login", 
-                        password="app123", 
-                        host="localhost", 
-                        port="5432"
-                    )
-                    conn.autocommit = True
-                    cur = conn.cursor(cursor_factory=DictCursor)
-                    
                     # Call login with 3 parameters (appuser needs tenant)
-                    cur.execute("SELECT user_login(%s, %s, %s)", (username, password, tenant_id))
-                    result = cur.fetchone()[0]
+                    result, identity = identity_context.login(pool, username, password, tenant_id)
                     
-                    if "successful" in result.lower():
-                        st.session_state.conn = conn
-                        st.session_state.cur = cur
+                    if identity:
+                        st.session_state.identity = identity
                         st.session_state.username = username
                         st.session_state.role = "appuser"
                         st.session_state.tenant_id = tenant_id
@@ -267,7 +283,6 @@ with st.sidebar:
                         st.rerun()
                     else:
                         st.error(f"❌ {result}")
-                        conn.close()
                 except Exception as e:
                     st.error(f"Connection failed: {str(e)}")
         
@@ -277,23 +292,11 @@ with st.sidebar:
             
             if st.button("👑 Login as Adminn", use_container_width=True):
                 try:
-                    conn = psycopg2.connect(
-                        dbname="backup", 
-                        user="app_login", 
-                        password="app123", 
-                        host="localhost", 
-                        port="5432"
-                    )
-                    conn.autocommit = True
-                    cur = conn.cursor(cursor_factory=DictCursor)
-                    
                     # Call login with 2 parameters
-                    cur.execute("SELECT user_login(%s, %s)", (username, password))
-                    result = cur.fetchone()[0]
+                    result, identity = identity_context.login(pool, username, password)
                     
-                    if "successful" in result.lower():
-                        st.session_state.conn = conn
-                        st.session_state.cur = cur
+                    if identity:
+                        st.session_state.identity = identity
                         st.session_state.username = username
                         st.session_state.role = "admin"
                         st.session_state.logged_in = True
@@ -301,7 +304,6 @@ with st.sidebar:
                         st.rerun()
                     else:
                         st.error(f"❌ {result}")
-                        conn.close()
                 except Exception as e:
                     st.error(f"Connection failed: {str(e)}")
     
@@ -313,10 +315,27 @@ with st.sidebar:
             <p><b>Role:</b> {st.session_state.role.upper()}</p>
         </div>
         """, unsafe_allow_html=True)
-        
+
+        if st.session_state.role == "admin":
+            with st.expander("🔌 Connection Pool", expanded=False):
+                pool_stats = pool.stats()
+                col1, col2 = st.columns(2)
+                col1.metric("In Use", f"{pool_stats['in_use']}/{pool_stats['max_size']}")
+                col2.metric("Idle", pool_stats['idle'])
+                col1.metric("Checkout p95", f"{pool_stats['checkout_p95_ms']} ms")
+                col2.metric("Max Wait", f"{pool_stats['wait_max_ms']} ms")
+                st.json(pool_stats)
+
+            with st.expander("▶️ Play Ingestion", expanded=False):
+                ingest_stats = play_buffer.stats()
+                col1, col2 = st.columns(2)
+                col1.metric("Buffered", f"{ingest_stats['buffered']}/{ingest_stats['buffer_max']}")
+                col2.metric("Rows/s", ingest_stats['rows_per_sec'])
+                col1.metric("Flush p50", f"{ingest_stats['flush_p50_ms']} ms")
+                col2.metric("Rejected", ingest_stats['rejected'])
+                st.json(ingest_stats)
+
         if st.button("🚪 Logout", use_container_width=True):
-            if 'conn' in st.session_state:
-                st.session_state.conn.close()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
@@ -325,20 +344,76 @@ with st.sidebar:
 if not st.session_state.logged_in:
     st.stop()
 
-# Get database connection
-conn = st.session_state.conn
-cur = st.session_state.cur
+# Identity context loaded once at login (identity_context.py); the pool
+# replays it onto a pooled connection for this run
+identity = st.session_state.identity
 username = st.session_state.username
 role = st.session_state.role
 
 # ====================== MAIN CONTENT TABS ======================
-tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
+# Lazy mode only renders (and queries) the selected tab. st.tabs runs every
+# tab body on each rerun, so one button click re-ran all seven tabs' queries.
+LAZY_TABS = True
+TAB_CACHE_TTL = 120   # seconds a tab keeps its last query results
+
+TAB_LABELS = [
     "🏠 Home", "🎵 Browse", "📊 Dashboard", "🔍 Search", 
     "📜 My History", "🎯 Recommendations", "📋 Playlists"
-])
+]
+if role == "admin":
+    TAB_LABELS.append("⚙️ Performance")
+
+# ====================== TAB RESULT CACHE ======================
+# Per-session results keyed by tab, so switching back to a tab doesn't re-query
+def tab_query(tab, key, loader):
+    cache = st.session_state.setdefault("tab_cache", {})
+    entry = cache.get((tab, key))
+    if entry is None or time.monotonic() - entry[0] > TAB_CACHE_TTL:
+        entry = (time.monotonic(), loader())
+        cache[(tab, key)] = entry
+    return entry[1]
+
+def clear_tab_cache(tab):
+    cache = st.session_state.get("tab_cache", {})
+    for cached_key in [k for k in cache if k[0] == tab]:
+        del cache[cached_key]
+
+def fetch_all(cur, query, params=None):
+    cur.execute(query, params)
+    return cur.fetchall()
+
+def fetch_one(cur, query, params=None):
+    cur.execute(query, params)
+    return cur.fetchone()
+
+def render_more_like_this(cur, rows, key):
+    # "More like this" for one of the listed songs (rows start with song_id, title)
+    with st.expander("🎯 More like this"):
+        picked = st.selectbox("Songs similar to", rows, key=f"{key}_similar_to",
+                              format_func=lambda row: f"{row[1]} (#{row[0]})")
+        try:
+            # Nearest songs from the in-memory content index; details under the caller's RLS
+            matches = similarity.more_like_this(cur, identity.tenant_id, identity.db_role, [picked[0]])
+            matches = dict(matches.get(picked[0], []))
+            if not matches:
+                st.info("No similar songs found")
+                return
+            similar = fetch_all(cur, """
+                SELECT song_id, title, artist, genre, rating, is_premium
+                FROM songs WHERE song_id = ANY(%s)
+            """, (list(matches),))
+            similar.sort(key=lambda row: -matches[row[0]])
+            df_similar = pd.DataFrame(
+                [[f"{matches[row[0]]:.0%}"] + list(row[1:6]) for row in similar],
+                columns=["Match", "Title", "Artist", "Genre", "Rating", "Premium"]
+            )
+            df_similar['Premium'] = df_similar['Premium'].apply(lambda x: '💎 Premium' if x else '🎵 Free')
+            st.dataframe(df_similar, use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Error finding similar songs: {e}")
 
 # ====================== TAB 1: HOME ======================
-with tab1:
+def render_home(conn, cur):
     st.markdown("## 🌟 Welcome to WE CAN PLAY")
     
     # Hero section
@@ -354,9 +429,7 @@ with tab1:
     
     with col2:
         if role == "listener":
-            cur.execute("SELECT role_type FROM users WHERE user_name = %s", (username,))
-            user_role = cur.fetchone()
-            if user_role and user_role[0] == 'listener_premium':
+            if identity.is_premium:
                 st.markdown("""
                 <div class="metric-card">
                     <div class="metric-value">💎 PREMIUM</div>
@@ -370,14 +443,30 @@ with tab1:
                     <div class="metric-label">Limited Access</div>
                 </div>
                 """, unsafe_allow_html=True)
+                if st.button("💎 Upgrade to Premium", use_container_width=True):
+                    try:
+                        result = fetch_one(cur, "SELECT subscribe_to_premium()")[0]
+                        conn.commit()
+                        # The subscription may change role_type: reload the context explicitly
+                        st.session_state.identity = identity_context.refresh(pool, identity)
+                        st.success(result)
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Upgrade failed: {e}")
     
     # This Week's Hot Hits
     st.markdown("## 🔥 This Week's Hot Hits")
     try:
-        cur.execute("SELECT * FROM this_week_famous()")
-        hot_songs = cur.fetchall()
+        # Time-decayed trending board: a lookup, then the cards' details by primary key
+        hits = trending.hot_hits(cur, identity.tenant_id, include_premium=(identity.db_role != "listener_free"))
+        details = {}
+        if hits:
+            for row in fetch_all(cur, "SELECT song_id, title, artist, genre, rating, is_premium FROM songs "
+                                      "WHERE song_id = ANY(%s)", ([song_id for song_id, _ in hits],)):
+                details[row[0]] = tuple(row)
+        hot_songs = [details[song_id] + (round(heat, 1),) for song_id, heat in hits if song_id in details]
         if hot_songs:
-            df_hot = pd.DataFrame(hot_songs, columns=["ID", "Title", "Artist", "Genre", "Rating", "Premium", "Play Count"])
+            df_hot = pd.DataFrame(hot_songs, columns=["ID", "Title", "Artist", "Genre", "Rating", "Premium", "Heat"])
             
             # Display as cards
             cols = st.columns(4)
@@ -391,7 +480,7 @@ with tab1:
                         <p>🎸 {song.Genre}</p>
                         <p>⭐ {song.Rating}/5.0</p>
                         <p><span class="{'premium-badge' if song.Premium else 'free-badge'}">{premium_tag}</span></p>
-                        <p>📊 {song.Play_Count} plays this week</p>
+                        <p>🔥 {song.Heat} trending plays</p>
                     </div>
                     """, unsafe_allow_html=True)
         else:
@@ -399,314 +488,335 @@ with tab1:
     except Exception as e:
         st.info(f"✨ Feature coming soon: Popular songs will appear here")
 
+    # Picked for your age: a weighted draw from the tenant's precomputed age-group pool
+    if role == "listener":
+        try:
+            def load_age_picks():
+                picks = fetch_all(cur, "SELECT * FROM get_age_based_recommendations(%s)", (identity.age,))
+                conn.commit()       # the first call after a songs change rebuilds the pools
+                return picks
+
+            picks = tab_query("home", "age_picks", load_age_picks)
+            if picks:
+                head_col, shuffle_col = st.columns([4, 1])
+                head_col.markdown(f"## 🎂 Picked For You · {picks[0]['recommended_for']}")
+                if shuffle_col.button("🔀 Shuffle", use_container_width=True):
+                    clear_tab_cache("home")
+                    st.rerun()
+                df_picks = pd.DataFrame([row[0:5] for row in picks], columns=["Title", "Artist", "Genre", "Rating", "Premium"])
+                df_picks['Premium'] = df_picks['Premium'].apply(lambda x: '💎 Premium' if x else '🎵 Free')
+                st.dataframe(df_picks, use_container_width=True, hide_index=True)
+        except Exception as e:
+            conn.rollback()
+            st.info("✨ Age-based picks will appear here")
+
 # ====================== TAB 2: BROWSE SONGS ======================
-with tab2:
+def render_browse(conn, cur):
     st.markdown("## 🎵 Browse Music Library")
     
-    # Filters
+    # Filters, labelled with per-tenant facet counts (one cached aggregate)
+    facets = browse.browse_facets(cur, identity)
+    access_counts = {"All": facets["total"], "All Free": facets["premium"][False],
+                     "Free Only": facets["premium"][False], "Premium Only": facets["premium"][True]}
+    
     col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
     with col1:
-        genre_filter = st.selectbox("Genre", ["All"] + list(pd.read_sql("SELECT DISTINCT genre FROM songs", conn)['genre'].tolist()))
+        genre_filter = st.selectbox(
+            "Genre", ["All"] + list(facets["genres"]),
+            format_func=lambda g: f"{g} ({facets['total'] if g == 'All' else facets['genres'][g]})"
+        )
     with col2:
+        label_access = lambda a: f"{a} ({access_counts[a]})" if a in access_counts else a
         if role == "listener":
-            cur.execute("SELECT role_type FROM users WHERE user_name = %s", (username,))
-            is_premium_user = cur.fetchone()[0] == 'listener_premium'
-            if not is_premium_user:
-                premium_filter = st.selectbox("Access", ["All Free", "Premium Only (Upgrade needed)"])
+            if not identity.is_premium:
+                premium_filter = st.selectbox("Access", ["All Free", "Premium Only (Upgrade needed)"],
+                                              format_func=label_access)
             else:
-                premium_filter = st.selectbox("Access", ["All", "Free Only", "Premium Only"])
+                premium_filter = st.selectbox("Access", ["All", "Free Only", "Premium Only"],
+                                              format_func=label_access)
         else:
-            premium_filter = st.selectbox("Access", ["All", "Free Only", "Premium Only"])
+            premium_filter = st.selectbox("Access", ["All", "Free Only", "Premium Only"],
+                                          format_func=label_access)
     with col3:
         sort_by = st.selectbox("Sort by", ["Rating (High to Low)", "Rating (Low to High)", "Title A-Z", "Title Z-A"])
     with col4:
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("🔄 Refresh", use_container_width=True):
+            clear_tab_cache("browse")
+            browse.facet_cache.invalidate(identity.tenant_id)
+            st.session_state.pop("browse_results", None)
             st.rerun()
+    st.caption("⭐ " + " · ".join(f"{band}: {count}" for band, count in facets["rating_bands"].items()))
     
-    # Build query
-    query = "SELECT song_id, title, artist, genre, rating, is_premium FROM songs WHERE 1=1"
-    
-    if genre_filter != "All":
-        query += f" AND genre = '{genre_filter}'"
-    
-    if premium_filter == "Free Only":
-        query += " AND is_premium = FALSE"
+    # Translate the filters into browse_page() arguments
+    genre = None if genre_filter == "All" else genre_filter
+    premium = None
+    if premium_filter in ("Free Only", "All Free"):
+        premium = False
     elif premium_filter == "Premium Only" and role != "listener":
-        query += " AND is_premium = TRUE"
+        premium = True
     elif premium_filter == "Premium Only" and role == "listener":
-        # Check if user is premium
-        cur.execute("SELECT role_type FROM users WHERE user_name = %s", (username,))
-        if cur.fetchone()[0] == 'listener_premium':
-            query += " AND is_premium = TRUE"
+        if identity.is_premium:
+            premium = True
         else:
             st.warning("⚠️ You need a Premium subscription to see premium songs!")
-            query += " AND is_premium = FALSE"
-    
-    if sort_by == "Rating (High to Low)":
-        query += " ORDER BY rating DESC NULLS LAST"
-    elif sort_by == "Rating (Low to High)":
-        query += " ORDER BY rating ASC NULLS LAST"
-    elif sort_by == "Title A-Z":
-        query += " ORDER BY title"
-    else:
-        query += " ORDER BY title DESC"
-    
-    query += " LIMIT 50"
+            premium = False
     
     try:
-        cur.execute(query)
-        songs = cur.fetchall()
+        # Keyset pages per sort order; "Load more" fetches only the next page
+        browse_key = (genre, premium, sort_by)
+        results = st.session_state.get("browse_results")
+        if not results or results["key"] != browse_key:
+            rows, next_cursor = browse.browse_page(cur, sort_by, identity.tenant_id, genre, premium)
+            results = {"key": browse_key, "rows": rows, "next": next_cursor}
+            st.session_state.browse_results = results
+        
+        songs = results["rows"]
         if songs:
             df_songs = pd.DataFrame(songs, columns=["ID", "Title", "Artist", "Genre", "Rating", "Premium"])
             df_songs['Premium'] = df_songs['Premium'].apply(lambda x: '💎 Premium' if x else '🎵 Free')
             st.dataframe(df_songs, use_container_width=True, hide_index=True)
-            st.caption(f"📊 Showing {len(songs)} songs")
+            more = "+" if results["next"] else ""
+            st.caption(f"📊 Showing {len(songs)}{more} songs")
+            render_more_like_this(cur, songs, "browse")
+            
+            if results["next"] and st.button("⬇️ Load more songs", use_container_width=True):
+                rows, next_cursor = browse.browse_page(
+                    cur, sort_by, identity.tenant_id, genre, premium, after=results["next"]
+                )
+                results["rows"] = songs + rows
+                results["next"] = next_cursor
+                st.rerun()
         else:
             st.info("No songs found with selected filters")
     except Exception as e:
         st.error(f"Error loading songs: {e}")
 
 # ====================== TAB 3: DASHBOARD ======================
-with tab3:
+def render_dashboard(conn, cur):
     if role in ["admin", "appuser"]:
         st.markdown("## 📊 Analytics Dashboard")
         
+        # Every panel below comes from one cached tenant_dashboard_snapshot() call
+        try:
+            snapshot = dashboard.tenant_dashboard_snapshot(cur, identity)
+        except Exception as e:
+            st.error(f"Error loading dashboard: {e}")
+            return
+        
         # ============ FIRST: TOP SONGS PER GENRE (DENSE_RANK) ============
         st.markdown("### 🏆 Top Songs Per Genre")
         st.caption("Using DENSE_RANK - Same rating = Same rank | No gaps")
         
-        try:
-            # Call the DENSE_RANK function
-            cur.execute("SELECT * FROM top_songs_per_genre() WHERE rank <= 5")
-            top_songs_data = cur.fetchall()
+        top_songs_data = snapshot["top_songs"]
+        if top_songs_data:
+            # Create DataFrame
+            df_top = pd.DataFrame(top_songs_data, columns=["Rank", "Genre", "Title", "Artist", "Rating"])
             
-            if top_songs_data and len(top_songs_data) > 0:
-                # Create DataFrame
-                df_top = pd.DataFrame(top_songs_data, columns=["Rank", "Genre", "Title", "Artist", "Rating"])
-                
-                # Display as simple, clean table
-                st.dataframe(
-                    df_top[['Rank', 'Genre', 'Title', 'Artist', 'Rating']], 
-                    use_container_width=True, 
-                    hide_index=True
-                )
-                
-                # Display as simple expandable sections by genre
-                st.markdown("### 📂 Browse by Genre")
-                for genre in df_top['Genre'].unique():
-                    with st.expander(f"🎵 {genre}", expanded=False):
-                        genre_df = df_top[df_top['Genre'] == genre]
-                        for _, row in genre_df.iterrows():
-                            medal = "🥇" if row['Rank'] == 1 else "🥈" if row['Rank'] == 2 else "🥉" if row['Rank'] == 3 else f"#{row['Rank']}"
-                            st.write(f"{medal} **{row['Title']}** - {row['Artist']} (⭐ {row['Rating']}/5)")
-            else:
-                st.info("No songs found")
-        except Exception as e:
-            st.error(f"Error loading top songs: {e}")
+            # Display as simple, clean table
+            st.dataframe(
+                df_top[['Rank', 'Genre', 'Title', 'Artist', 'Rating']], 
+                use_container_width=True, 
+                hide_index=True
+            )
+            
+            # Display as simple expandable sections by genre
+            st.markdown("### 📂 Browse by Genre")
+            for genre in df_top['Genre'].unique():
+                with st.expander(f"🎵 {genre}", expanded=False):
+                    genre_df = df_top[df_top['Genre'] == genre]
+                    for _, row in genre_df.iterrows():
+                        medal = "🥇" if row['Rank'] == 1 else "🥈" if row['Rank'] == 2 else "🥉" if row['Rank'] == 3 else f"#{row['Rank']}"
+                        st.write(f"{medal} **{row['Title']}** - {row['Artist']} (⭐ {row['Rating']}/5)")
+        else:
+            st.info("No songs found")
         
         st.markdown("---")
         # ============ END DENSE_RANK SECTION ============
         
         # Metrics Row
         col1, col2, col3, col4 = st.columns(4)
-        
-        try:
-            cur.execute("SELECT COUNT(*) FROM songs")
-            total_songs = cur.fetchone()[0]
-            col1.metric("Total Songs", total_songs)
-        except:
-            col1.metric("Total Songs", "N/A")
-        
-        try:
-            cur.execute("SELECT COUNT(*) FROM songs WHERE is_premium = TRUE")
-            premium_songs = cur.fetchone()[0]
-            col2.metric("Premium Songs", premium_songs)
-        except:
-            col2.metric("Premium Songs", "N/A")
-        
-        try:
-            cur.execute("SELECT COUNT(DISTINCT artist) FROM songs")
-            total_artists = cur.fetchone()[0]
-            col3.metric("Unique Artists", total_artists)
-        except:
-            col3.metric("Unique Artists", "N/A")
-        
-        try:
-            cur.execute("SELECT ROUND(AVG(rating), 1) FROM songs WHERE rating IS NOT NULL")
-            avg_rating = cur.fetchone()[0] or 0
-            col4.metric("Avg Rating", f"⭐ {avg_rating}")
-        except:
-            col4.metric("Avg Rating", "N/A")
+        col1.metric("Total Songs", snapshot["total_songs"])
+        col2.metric("Premium Songs", snapshot["premium_songs"])
+        col3.metric("Unique Artists", snapshot["unique_artists"])
+        col4.metric("Avg Rating", f"⭐ {snapshot['avg_rating'] or 0}")
         
         # Charts Row
         col1, col2 = st.columns(2)
         
-        # ============ FIXED: GENRE DISTRIBUTION (Direct Query) ============
+        # ============ GENRE DISTRIBUTION ============
         with col1:
             st.markdown("### 🎵 Genre Distribution")
-            try:
-                # Use direct query instead of function
-                cur.execute("""
-                    SELECT genre, COUNT(*) as song_count, ROUND(AVG(rating), 2) as avg_rating
-                    FROM songs
-                    GROUP BY genre
-                    ORDER BY song_count DESC
-                """)
-                genre_data = cur.fetchall()
-                
-                if genre_data and len(genre_data) > 0:
-                    df_genre = pd.DataFrame(genre_data, columns=["Genre", "Song Count", "Avg Rating"])
-                    fig = px.bar(df_genre, x="Genre", y="Song Count", 
-                                 title="Songs by Genre",
-                                 color="Avg Rating", 
-                                 color_continuous_scale="Viridis")
-                    fig.update_layout(height=400)
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("No genre data available")
-            except Exception as e:
-                st.warning(f"Could not load genre chart: {e}")
-                # Fallback: Show simple table
-                try:
-                    cur.execute("SELECT genre, COUNT(*) FROM songs GROUP BY genre")
-                    simple_data = cur.fetchall()
-                    if simple_data:
-                        st.table(pd.DataFrame(simple_data, columns=["Genre", "Count"]))
-                except:
-                    pass
+            genre_data = snapshot["genres"]
+            if genre_data:
+                df_genre = pd.DataFrame(genre_data, columns=["Genre", "Song Count", "Avg Rating"])
+                fig = px.bar(df_genre, x="Genre", y="Song Count", 
+                             title="Songs by Genre",
+                             color="Avg Rating", 
+                             color_continuous_scale="Viridis")
+                fig.update_layout(height=400)
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No genre data available")
         
-        # ============ FIXED: TOP ARTISTS (Direct Query) ============
+        # ============ TOP ARTISTS ============
         with col2:
             st.markdown("### 🎤 Top Artists")
-            try:
-                # Use direct query instead of function
-                cur.execute("""
-                    SELECT artist, COUNT(*) as song_count, ROUND(AVG(rating), 2) as avg_rating
-                    FROM songs
-                    GROUP BY artist
-                    ORDER BY song_count DESC
-                    LIMIT 10
-                """)
-                artist_data = cur.fetchall()
-                
-                if artist_data and len(artist_data) > 0:
-                    df_artist = pd.DataFrame(artist_data, columns=["Artist", "Song Count", "Avg Rating"])
-                    fig = px.bar(df_artist, x="Artist", y="Song Count", 
-                                 title="Top 10 Artists",
-                                 color="Avg Rating", 
-                                 color_continuous_scale="Plasma")
-                    fig.update_layout(height=400, xaxis_tickangle=-45)
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("No artist data available")
-            except Exception as e:
-                st.warning(f"Could not load artist chart: {e}")
-                # Fallback: Show simple table
-                try:
-                    cur.execute("SELECT artist, COUNT(*) FROM songs GROUP BY artist ORDER BY COUNT(*) DESC LIMIT 5")
-                    simple_data = cur.fetchall()
-                    if simple_data:
-                        st.table(pd.DataFrame(simple_data, columns=["Artist", "Song Count"]))
-                except:
-                    pass
+            artist_data = snapshot["artists"]
+            if artist_data:
+                df_artist = pd.DataFrame(artist_data, columns=["Artist", "Song Count", "Avg Rating"])
+                fig = px.bar(df_artist, x="Artist", y="Song Count", 
+                             title="Top 10 Artists",
+                             color="Avg Rating", 
+                             color_continuous_scale="Plasma")
+                fig.update_layout(height=400, xaxis_tickangle=-45)
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No artist data available")
         
         # Premium vs Free Pie Chart
         st.markdown("### 💎 Premium vs Free Songs")
-        try:
-            cur.execute("SELECT is_premium, COUNT(*) FROM songs GROUP BY is_premium")
-            premium_data = cur.fetchall()
+        premium_data = snapshot["premium_split"]
+        if premium_data:
+            df_premium = pd.DataFrame(premium_data, columns=["Type", "Count"])
+            df_premium['Type'] = df_premium['Type'].map({True: 'Premium 💎', False: 'Free 🎵'})
             
-            if premium_data and len(premium_data) > 0:
-                df_premium = pd.DataFrame(premium_data, columns=["Type", "Count"])
-                df_premium['Type'] = df_premium['Type'].map({True: 'Premium 💎', False: 'Free 🎵'})
-                
-                fig = px.pie(df_premium, values="Count", names="Type", 
-                             title="Premium vs Free Distribution",
-                             color_discrete_sequence=['#764ba2', '#667eea'])
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No premium/free data available")
-        except Exception as e:
-            st.warning(f"Could not load premium chart: {e}")
+            fig = px.pie(df_premium, values="Count", names="Type", 
+                         title="Premium vs Free Distribution",
+                         color_discrete_sequence=['#764ba2', '#667eea'])
+            fig.update_layout(height=400)
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No premium/free data available")
         
-        # Rating Distribution
+        # Rating Distribution (20 buckets binned server-side, only the counts come back)
         st.markdown("### ⭐ Rating Distribution")
-        try:
-            cur.execute("SELECT rating FROM songs WHERE rating IS NOT NULL")
-            rating_data = cur.fetchall()
-            
-            if rating_data and len(rating_data) > 0:
-                df_rating = pd.DataFrame(rating_data, columns=["Rating"])
-                fig = px.histogram(df_rating, x="Rating", 
-                                   title="Song Rating Distribution", 
-                                   nbins=20, 
-                                   color_discrete_sequence=['#667eea'])
-                fig.update_layout(height=400)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No rating data available")
-        except Exception as e:
-            st.warning(f"Could not load rating chart: {e}")
+        rating_data = snapshot["rating_bins"]
+        if rating_data and any(row[2] for row in rating_data):
+            df_rating = pd.DataFrame(rating_data, columns=["From", "To", "Count"])
+            df_rating["Rating"] = (df_rating["From"] + df_rating["To"]) / 2
+            fig = px.bar(df_rating, x="Rating", y="Count",
+                         title="Song Rating Distribution",
+                         hover_data=["From", "To"],
+                         color_discrete_sequence=['#667eea'])
+            fig.update_layout(height=400, bargap=0)
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No rating data available")
             
     else:
         st.info("📊 Analytics Dashboard is available for Admin and Appuser only")
 
 # ====================== TAB 4: SEARCH ======================
-with tab4:
+def pick_suggestion(title):
+    st.session_state.search_term = title
+
+def render_search(conn, cur):
     st.markdown("## 🔍 Advanced Search")
     
     search_col1, search_col2 = st.columns([3, 1])
     with search_col1:
-        search_term = st.text_input("Search songs, artists, or genres", placeholder="e.g., Love, Ed Sheeran, Pop...")
+        search_term = st.text_input("Search songs, artists, or genres", placeholder="e.g., Love, Ed Sheeran, Pop...", key="search_term")
     with search_col2:
         search_type = st.selectbox("Search in", ["All", "Title", "Artist", "Genre"])
     
+    # Suggestions come from the in-memory typeahead index, not a query per keystroke
     if search_term:
         try:
-            if search_type == "Title":
-                query = "SELECT title, artist, genre, rating, is_premium FROM songs WHERE title ILIKE %s"
-                cur.execute(query, (f"%{search_term}%",))
-            elif search_type == "Artist":
-                query = "SELECT title, artist, genre, rating, is_premium FROM songs WHERE artist ILIKE %s"
-                cur.execute(query, (f"%{search_term}%",))
-            elif search_type == "Genre":
-                query = "SELECT title, artist, genre, rating, is_premium FROM songs WHERE genre ILIKE %s"
-                cur.execute(query, (f"%{search_term}%",))
-            else:
-                query = "SELECT title, artist, genre, rating, is_premium FROM songs WHERE title ILIKE %s OR artist ILIKE %s OR genre ILIKE %s"
-                cur.execute(query, (f"%{search_term}%", f"%{search_term}%", f"%{search_term}%"))
+            suggestions = typeahead.suggest(cur, identity.tenant_id, identity.db_role, search_term, limit=4)
+        except Exception:
+            suggestions = []
+        if suggestions:
+            st.caption("💡 Suggestions")
+            for col, (song_id, title, artist) in zip(st.columns(len(suggestions)), suggestions):
+                col.button(f"🎵 {title} – {artist}", key=f"suggest_{song_id}",
+                           on_click=pick_suggestion, args=(title,), use_container_width=True)
+    
+    if search_term:
+        try:
+            # Keyset pages of trigram-ranked results; "Load more" fetches only the next page
+            search_key = (search_type, search_term)
+            results = st.session_state.get("search_results")
+            if not results or results["key"] != search_key:
+                rows, next_cursor = catalog_search.search_songs(cur, search_term, search_type)
+                results = {"key": search_key, "rows": rows, "next": next_cursor}
+                st.session_state.search_results = results
             
-            results = cur.fetchall()
-            if results:
-                df_search = pd.DataFrame(results, columns=["Title", "Artist", "Genre", "Rating", "Premium"])
+            if results["rows"]:
+                df_search = pd.DataFrame(
+                    [row[1:6] for row in results["rows"]],
+                    columns=["Title", "Artist", "Genre", "Rating", "Premium"]
+                )
                 df_search['Premium'] = df_search['Premium'].apply(lambda x: '💎 Premium' if x else '🎵 Free')
-                st.success(f"🎉 Found {len(results)} songs!")
+                more = "+" if results["next"] else ""
+                st.success(f"🎉 Found {len(results['rows'])}{more} songs!")
                 st.dataframe(df_search, use_container_width=True, hide_index=True)
+                render_more_like_this(cur, results["rows"], "search")
+                
+                if results["next"] and st.button("⬇️ Load more results", use_container_width=True):
+                    rows, next_cursor = catalog_search.search_songs(
+                        cur, search_term, search_type, after=results["next"]
+                    )
+                    results["rows"] = results["rows"] + rows
+                    results["next"] = next_cursor
+                    st.rerun()
             else:
                 st.info("😔 No songs found. Try different search terms!")
         except Exception as e:
             st.error(f"Search error: {e}")
 # ====================== TAB 5: HISTORY ======================
-with tab5:
+def export_history():
+    # Streamed through a server-side cursor into an anonymous temp file, which is
+    # gone once closed; the one in-memory copy is what Streamlit serves
+    with pool.checkout(identity) as conn, tempfile.TemporaryFile() as export:
+        text = io.TextIOWrapper(export, encoding="utf-8", newline="")
+        history.export_history_csv(conn, text)
+        text.flush()
+        export.seek(0)
+        data = export.read()
+        text.detach()
+    return data
+
+
+def render_history(conn, cur):
     if role == "listener":
         st.markdown("## 📜 Your Listening Journey")
         
         try:
-            cur.execute("SELECT * FROM my_history")
-            history = cur.fetchall()
+            # Keyset pages, newest first; "Load more" fetches only the next page
+            results = st.session_state.get("history_results")
+            if not results:
+                rows, next_cursor = history.history_page(cur)
+                results = {"rows": rows, "next": next_cursor}
+                st.session_state.history_results = results
             
-            if history:
-                df_history = pd.DataFrame(history, columns=["Title", "Artist", "Genre", "Rating", "Premium", "Played At", "Duration"])
+            plays = results["rows"]
+            if plays:
+                df_history = pd.DataFrame(plays, columns=history.HISTORY_COLUMNS)
                 st.dataframe(df_history, use_container_width=True, hide_index=True)
+                more = "+" if results["next"] else ""
+                st.caption(f"📊 Showing your latest {len(plays)}{more} plays")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if results["next"] and st.button("⬇️ Load more plays", use_container_width=True):
+                        rows, next_cursor = history.history_page(cur, after=results["next"])
+                        results["rows"] = plays + rows
+                        results["next"] = next_cursor
+                        st.rerun()
+                with col2:
+                    # Built only when clicked (Streamlit runs the callable on its own thread, so it
+                    # checks out its own connection) and never kept in session_state
+                    st.download_button("📥 Export full history (CSV)", export_history, file_name="my_history.csv",
+                                       mime="text/csv", use_container_width=True, on_click="ignore")
                 
-                # Stats
+                # Stats come from the per-user play rollups, not from the rows above
+                stats = tab_query("history", "my_stats", lambda: fetch_one(cur, "SELECT * FROM my_listening_stats()"))
                 st.markdown("### 📊 Listening Stats")
                 col1, col2, col3 = st.columns(3)
-                col1.metric("Total Songs Played", len(df_history))
-                col2.metric("Unique Artists", df_history['Artist'].nunique())
-                col3.metric("Avg Rating", f"{df_history['Rating'].mean():.1f}⭐")
+                col1.metric("Total Songs Played", stats["total_plays"])
+                col2.metric("Unique Artists", stats["unique_artists"])
+                col3.metric("Avg Rating", f"{stats['avg_rating']:.1f}⭐" if stats["avg_rating"] is not None else "–")
             else:
                 st.info("🎧 No listening history yet. Start playing some songs!")
         except Exception as e:
@@ -723,12 +833,14 @@ with tab5:
         
         if st.button("▶️ Play Song", type="primary", use_container_width=True):
             try:
-                cur.execute("SELECT record_song_play(%s, %s, %s)", (song_id, duration, username))
-                result = cur.fetchone()[0]
-                conn.commit()
+                # Gated and queued in-process; play_buffer writes plays in batches
+                result = play_buffer.submit(cur, identity, int(song_id), int(duration))
                 if "Permission Denied" in result:
                     st.warning(result)
                 elif "successfully" in result.lower():
+                    # New play: drop the cached history so it shows up
+                    clear_tab_cache("history")
+                    st.session_state.pop("history_results", None)
                     st.success(f"🎵 {result}")
                     st.balloons()
                 else:
@@ -736,4 +848,205 @@ with tab5:
             except Exception as e:
                 st.error(f"Failed to record play: {e}")
     else:
-        st.info("📜 Listening history is available for listeners only")
\ No newline at end of file
+        st.info("📜 Listening history is available for listeners only")
+
+# ====================== TAB 6: RECOMMENDATIONS ======================
+def render_recommendations(conn, cur):
+    st.markdown("## 🎯 Recommended For You")
+    if role != "listener":
+        st.info("🎯 Recommendations are personalised for listeners")
+        return
+    
+    try:
+        # Precomputed by the co-listen batch (manage.py recommender build)
+        recs = tab_query("recommendations", "co_listen",
+                         lambda: fetch_all(cur, "SELECT * FROM my_recommendations(12)"))
+        if recs:
+            st.caption("🎧 Listeners who played your songs also played")
+            df_recs = pd.DataFrame([row[1:6] for row in recs], columns=["Title", "Artist", "Genre", "Rating", "Premium"])
+            df_recs['Premium'] = df_recs['Premium'].apply(lambda x: '💎 Premium' if x else '🎵 Free')
+            st.dataframe(df_recs, use_container_width=True, hide_index=True)
+        else:
+            st.info("🎧 Play a few songs - your recommendations appear after the next batch run")
+    except Exception as e:
+        st.error(f"Error loading recommendations: {e}")
+
+# ====================== TAB 8: PERFORMANCE (ADMIN) ======================
+PERF_WINDOWS = {"Last 5 minutes": 5, "Last 15 minutes": 15, "Last hour": 60}
+PERF_SORT = {"p95": "p95_ms", "Max": "max_ms", "Total time": "total_ms", "Errors": "errors"}
+
+def render_performance(conn, cur):
+    st.markdown("## ⚙️ Statement Performance")
+    st.caption("Every statement this server process ran, grouped by SQL fingerprint, role and tenant")
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    window = col1.selectbox("Window", list(PERF_WINDOWS), key="perf_window")
+    sort = col2.selectbox("Sort by", list(PERF_SORT), key="perf_sort")
+    if col3.button("🧹 Reset", use_container_width=True):
+        instrumentation.reset()
+
+    statements = instrumentation.slowest(50, PERF_WINDOWS[window], PERF_SORT[sort])
+    if statements:
+        render_statement_stats(statements)
+    else:
+        st.info("No statements recorded in this window yet")
+
+    st.markdown("---")
+    render_watchdog(cur)
+    st.markdown("---")
+    render_slow_queries(cur)
+
+def render_statement_stats(statements):
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Statements", sum(s["calls"] for s in statements))
+    col2.metric("Errors", sum(s["errors"] for s in statements))
+    col3.metric("Slowest", f"{max(s['max_ms'] for s in statements)} ms")
+
+    df_perf = pd.DataFrame([{
+        "SQL": s["fingerprint"][:120],
+        "Role": s["role"],
+        "Tenant": s["tenant"][:8],
+        "Calls": s["calls"],
+        "Errors": s["errors"],
+        "p50 ms": s["p50_ms"],
+        "p95 ms": s["p95_ms"],
+        "Max ms": s["max_ms"],
+        "Rows/call": round(s["rows"] / s["calls"], 1),
+        "KB fetched": round(s["bytes"] / 1024, 1),
+        "Last error": s["last_error"] or "",
+    } for s in statements])
+    st.dataframe(df_perf, use_container_width=True, hide_index=True)
+
+    with st.expander("🔎 Statement detail"):
+        picked = st.selectbox("Statement", range(len(statements)),
+                              format_func=lambda i: statements[i]["fingerprint"][:100], key="perf_detail")
+        detail = statements[picked]
+        st.code(detail["fingerprint"], language="sql")
+        buckets = [f"≤{b} ms" for b in instrumentation.BUCKETS_MS] + [f">{instrumentation.BUCKETS_MS[-1]} ms"]
+        fig = px.bar(x=buckets, y=detail["histogram"], labels={"x": "Latency", "y": "Calls"})
+        st.plotly_chart(fig, use_container_width=True)
+
+    if instrumentation.EXPORT_TARGET:
+        st.caption(f"📤 Exported every {instrumentation.EXPORT_INTERVAL:.0f}s to {instrumentation.EXPORT_TARGET}")
+
+# Live database-wide view; the watchdog itself runs as "manage.py watchdog run"
+def render_watchdog(cur):
+    col1, col2 = st.columns([4, 1])
+    col1.markdown("### 🐕 Query Watchdog")
+    if col2.button("🔄 Refresh", use_container_width=True, key="watchdog_refresh"):
+        st.rerun()
+
+    try:
+        activity = watchdog.fetch_activity(cur)
+        if activity:
+            df_activity = pd.DataFrame([{
+                "PID": a["pid"],
+                "Role": a["db_role"],
+                "Tenant": str(a["tenant_id"] or "-")[:8],
+                "State": a["state"],
+                "Running s": round(a["runtime_s"] if a["state"] == "active" else a["state_age_s"], 1),
+                "Budget": f"{watchdog.budget_used(a):.0%}" if watchdog.budget_used(a) is not None else "–",
+                "Waiting on": a["wait_event"] or "",
+                "SQL": (a["query"] or "")[:120],
+            } for a in activity])
+            st.dataframe(df_activity, use_container_width=True, hide_index=True)
+        else:
+            st.success("✅ No statements running right now")
+
+        events = watchdog.recent_events(cur, 20)
+        st.markdown("#### Recent cancels / terminations")
+        if events:
+            df_events = pd.DataFrame([{
+                "When": e["logged_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                "Role": e["db_role"],
+                "Tenant": str(e["tenant_id"] or "-")[:8],
+                "Action": e["action"],
+                "Applied": {None: "dry run", True: "✅", False: "gone"}[e["applied"]],
+                "After s": float(e["runtime_s"] or 0),
+                "SQL": (e["query"] or "")[:120],
+            } for e in events])
+            st.dataframe(df_events, use_container_width=True, hide_index=True)
+        else:
+            st.caption("Nothing cancelled or terminated yet")
+        st.caption("Budgets per role: " + ", ".join(
+            f"{role} {p.statement_timeout_s}s timeout / cancel {p.cancel_after_s}s / terminate {p.terminate_after_s}s"
+            for role, p in watchdog.ROLE_PROFILES.items() if role != "app_login"))
+    except Exception as e:
+        st.error(f"Watchdog view unavailable: {e}")
+
+# Snapshots are taken by "manage.py slow-report snapshot" (cron / around deploys)
+def render_slow_queries(cur):
+    st.markdown("### 📈 Slow Queries (pg_stat_statements)")
+    try:
+        snapshots = slow_queries.list_snapshots(cur)
+        if not snapshots:
+            st.info("No snapshots yet - run: python APP/manage.py slow-report snapshot")
+            return
+
+        labels = {s["snapshot_id"]: f"#{s['snapshot_id']} {s['taken_at']:%Y-%m-%d %H:%M}"
+                                    + (f" ({s['label']})" if s["label"] else "") for s in snapshots}
+        col1, col2, col3 = st.columns([2, 2, 1])
+        snapshot = col1.selectbox("Snapshot", list(labels), format_func=labels.get, key="slow_snapshot")
+        baseline = col2.selectbox("Compare with", [None] + [i for i in labels if i < snapshot],
+                                  format_func=lambda i: "–" if i is None else labels[i], key="slow_baseline")
+        by = col3.radio("Rank by", ["total", "mean"], key="slow_by")
+
+        groups = slow_queries.report(cur, snapshot, by, 20)
+        if groups:
+            df_slow = pd.DataFrame([{
+                "Group": g["group"],
+                "Kind": g["kind"],
+                "Roles": g["roles"],
+                "Calls": g["calls"],
+                "Total ms": round(g["total_ms"], 1),
+                "Mean ms": round(g["mean_ms"], 2),
+                "Blocks read": g["blks_read"],
+                "Plan": g["plan_summary"] or g["plan_error"] or "",
+                "SQL": " ".join(g["query"].split())[:120],
+            } for g in groups])
+            st.dataframe(df_slow, use_container_width=True, hide_index=True)
+            st.caption("Counters cover the interval since the snapshot before this one")
+        else:
+            st.info("Nothing ran in this snapshot's interval")
+
+        if baseline:
+            changes = slow_queries.diff(cur, baseline, snapshot, 20)
+            df_diff = pd.DataFrame([{
+                "Group": r["group"],
+                "Mean ms before": None if r["mean_before"] is None else round(r["mean_before"], 2),
+                "Mean ms after": None if r["mean_after"] is None else round(r["mean_after"], 2),
+                "Change": "new / gone" if r["change"] is None else f"{r['change']:+.0%}",
+                "SQL": " ".join(r["query"].split())[:120],
+            } for r in changes])
+            st.markdown(f"#### {labels[baseline]} → {labels[snapshot]}")
+            st.dataframe(df_diff, use_container_width=True, hide_index=True)
+    except Exception as e:
+        st.error(f"Slow query report unavailable: {e}")
+
+# ====================== RENDER WITH A POOLED CONNECTION ======================
+TAB_RENDERERS = {
+    "🏠 Home": render_home,
+    "🎵 Browse": render_browse,
+    "📊 Dashboard": render_dashboard,
+    "🔍 Search": render_search,
+    "📜 My History": render_history,
+    "🎯 Recommendations": render_recommendations,
+    "⚙️ Performance": render_performance,
+}
+
+if LAZY_TABS:
+    # Only the selected tab's renderer runs, the others keep their cached results
+    active_tab = st.radio("Section", TAB_LABELS, horizontal=True, key="active_tab", label_visibility="collapsed")
+    renderer = TAB_RENDERERS.get(active_tab)
+    if renderer:
+        with pool.checkout(identity) as conn:
+            renderer(conn, conn.cursor(cursor_factory=DictCursor))
+else:
+    tabs = st.tabs(TAB_LABELS)
+    with pool.checkout(identity) as conn:
+        cur = conn.cursor(cursor_factory=DictCursor)
+        for tab, label in zip(tabs, TAB_LABELS):
+            renderer = TAB_RENDERERS.get(label)
+            if renderer:
+                with tab:
+                    renderer(conn, cur)
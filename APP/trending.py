@@ -0,0 +1,122 @@
+# trending.py
+# Time-decayed trending scores for Hot Hits: a lookup instead of a recount.
+# Requirements: pip install psycopg2-binary
+#
+# Each play adds 2 ** ((played_at - epoch) / half_life) to its song's score.
+# That is the usual exponentially decayed count multiplied by the constant
+# 2 ** ((now - epoch) / half_life), so older plays fade smoothly and nothing
+# ever has to be decayed on write. Reads scale scores back to "plays worth
+# of heat right now". Scores only ever grow, so a TOP_K list per tenant
+# stays exact with an O(TOP_K) offer per play, independent of catalog size.
+# Before the weights get near float range the board rebases its epoch.
+#
+# Boards are seeded per tenant from the play_song_hourly rollups, then fed
+# in-process by play_ingest.on_play; RESEED_INTERVAL picks up plays other
+# processes (e.g. the console app) recorded.
+
+import threading
+import time
+from bisect import insort
+
+import play_ingest
+
+HALF_LIFE_HOURS  = 24.0     # a play's weight halves every this many hours
+TOP_K            = 50       # songs kept ranked per tenant (and again for free-only)
+SEED_HALF_LIVES  = 10       # older plays contribute < 0.1%, not worth seeding
+RESEED_INTERVAL  = 900      # seconds before a board is rebuilt from the rollups
+REBASE_EXPONENT  = 512      # rebase before 2 ** exponent approaches float limits
+
+SEED_SQL = "SELECT song_id, is_premium, bucket_epoch, plays FROM trending_seed(%s)"
+
+
+class TrendingBoard:
+    def __init__(self, half_life_hours=HALF_LIFE_HOURS, top_k=TOP_K, epoch=None):
+        self.half_life = half_life_hours * 3600.0
+        self.top_k = top_k
+        self.epoch = time.time() if epoch is None else epoch
+        self.seeded_at = time.monotonic()
+        self._scores = {}                       # song_id -> score in epoch units
+        self._tops = {True: [], False: []}      # include_premium -> ascending [(score, song_id)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _rebase(self, ts):
+        factor = 2.0 ** (-(ts - self.epoch) / self.half_life)
+        self.epoch = ts
+        self._scores = {song_id: score * factor for song_id, score in self._scores.items()}
+        for key, top in self._tops.items():
+            self._tops[key] = [(score * factor, song_id) for score, song_id in top]
+
+    def _offer(self, top, song_id, score):
+        for i, (_, top_id) in enumerate(top):
+            if top_id == song_id:
+                del top[i]
+                break
+        if len(top) < self.top_k:
+            insort(top, (score, song_id))
+        elif score > top[0][0]:
+            insort(top, (score, song_id))
+            del top[0]
+
+    def record(self, song_id, is_premium, ts=None, plays=1):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            if (ts - self.epoch) / self.half_life > REBASE_EXPONENT:
+                self._rebase(ts)
+            score = self._scores.get(song_id, 0.0) + plays * 2.0 ** ((ts - self.epoch) / self.half_life)
+            self._scores[song_id] = score
+            self._offer(self._tops[True], song_id, score)
+            if not is_premium:
+                self._offer(self._tops[False], song_id, score)
+
+    def top(self, n=12, include_premium=True, now=None):
+        # [(song_id, decayed score)], hottest first
+        now = time.time() if now is None else now
+        with self._lock:
+            scale = 2.0 ** (-(now - self.epoch) / self.half_life)
+            ranked = self._tops[include_premium][::-1][:n]
+            return [(song_id, score * scale) for score, song_id in ranked]
+
+
+# ── per-tenant registry ──────────────────────────────────────────────────────
+_boards = {}                 # tenant_id -> TrendingBoard
+_boards_lock = threading.Lock()
+_seed_lock = threading.Lock()
+
+
+def seed_board(cur, half_life_hours=HALF_LIFE_HOURS):
+    # cur carries the tenant (trending_seed reads app.current_tenant)
+    board = TrendingBoard(half_life_hours)
+    cur.execute(SEED_SQL, (SEED_HALF_LIVES * half_life_hours,))
+    for song_id, is_premium, bucket_epoch, plays in cur.fetchall():
+        # an hourly bucket's plays count as if played mid-hour
+        board.record(song_id, is_premium, bucket_epoch + 1800, plays)
+    return board
+
+
+def get_board(cur, tenant_id):
+    board = _boards.get(tenant_id)
+    if board is None or time.monotonic() - board.seeded_at > RESEED_INTERVAL:
+        with _seed_lock:
+            board = _boards.get(tenant_id)
+            if board is None or time.monotonic() - board.seeded_at > RESEED_INTERVAL:
+                board = seed_board(cur)
+                with _boards_lock:
+                    _boards[tenant_id] = board
+    return board
+
+
+def hot_hits(cur, tenant_id, include_premium=True, n=12):
+    if not tenant_id:
+        return []
+    return get_board(cur, tenant_id).top(n, include_premium)
+
+
+@play_ingest.on_play
+def _record_play(tenant_id, song_id, is_premium, played_at):
+    # Only boards that exist are fed; a new board seeds from the rollups anyway
+    board = _boards.get(tenant_id)
+    if board is not None:
+        board.record(song_id, is_premium, played_at)
@@ -0,0 +1,251 @@
+# typeahead.py
+# In-process typeahead index for per-tenant song autocomplete.
+#
+# Built per (tenant, role) from songs, then kept current without a database
+# round trip per keystroke:
+#   - song_added() appends a new song: called for this process's inserts and
+#     for songs_changed INSERT notifications (the payload carries the row),
+#   - any other songs_changed notification (UPDATE/DELETE), or REBUILD_TTL for
+#     processes that don't run the listener, marks the index stale and the
+#     next lookup rebuilds it from scratch, so title edits, deletes and
+#     is_premium flips show up too. Lookups keep using the old index until the
+#     new one is swapped in; songs added meanwhile are carried over.
+#
+# Layout (all compact arrays, no per-song Python objects):
+#   text      bytearray of "title\x1fartist" UTF-8 records, back to back
+#   offsets   array('I'), record i is text[offsets[i]:offsets[i + 1]]
+#   song_ids  array('i'), premium array('b')
+#   postings  {first KEY_LEN chars of a word: array('I') of record numbers}
+#
+# Memory budget: ~45 B text + 4 B offset + 4 B id + 1 B flag + ~6 words x 4 B
+# postings is about 80 B per song, i.e. ~80 MB per 1M songs. MEMORY_BUDGET
+# is the ceiling we plan for; memory_bytes() reports the actual figure. An
+# index built over budget is dropped and that tenant's suggestions come from
+# search_songs() in the database instead, until the next rebuild.
+
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import catalog_cache
+import catalog_search
+
+KEY_LEN          = 3
+MIN_PREFIX       = 2
+MAX_SUGGESTIONS  = 8
+SCAN_LIMIT       = 200                    # matches collected before ranking
+MEMORY_BUDGET    = 96 * 1024 * 1024       # bytes per 1M songs
+MEMORY_FLOOR     = 1024 * 1024            # fixed overhead any index may use (dict, keys)
+REBUILD_TTL      = catalog_cache.DEFAULT_TTL   # seconds before a rebuild even without a notification
+
+SEPARATOR = "\x1f"
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(text):
+    return _WORD_RE.findall(text.lower())
+
+
+class TypeaheadIndex:
+    def __init__(self):
+        self._text = bytearray()
+        self._offsets = array("I", [0])
+        self._song_ids = array("i")
+        self._premium = array("b")
+        self._postings = {}
+        self._loaded = 0            # records from load(); their song_ids are ascending
+        self._added = []            # rows from song_added(), in arrival order
+        self._seen = set()          # their song_ids
+        self.stale = False
+        self.over_budget = False
+        self.built_at = time.monotonic()
+        self.refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._song_ids)
+
+    def _append(self, song_id, title, artist, is_premium):
+        record = f"{title}{SEPARATOR}{artist}"
+        row = len(self._song_ids)
+        self._text += record.encode("utf-8")
+        self._offsets.append(len(self._text))
+        self._song_ids.append(song_id)
+        self._premium.append(1 if is_premium else 0)
+        for word in set(_words(record)):
+            self._postings.setdefault(word[:KEY_LEN], array("I")).append(row)
+
+    def _record(self, row):
+        return self._text[self._offsets[row]:self._offsets[row + 1]].decode("utf-8")
+
+    def _has(self, song_id):
+        if song_id in self._seen:
+            return True
+        row = bisect_left(self._song_ids, song_id, 0, self._loaded)
+        return row < self._loaded and self._song_ids[row] == song_id
+
+    def load(self, rows):
+        # rows: iterable of (song_id, title, artist, is_premium), ascending song_id,
+        # into a fresh index
+        with self._lock:
+            for song_id, title, artist, is_premium in rows:
+                self._append(song_id, title, artist, is_premium)
+            self._loaded = len(self._song_ids)
+
+    def add(self, song_id, title, artist, is_premium):
+        # The same song can come from song_added() and its own notification,
+        # or be in a rebuild already: both are skipped
+        with self._lock:
+            self._added.append((song_id, title, artist, is_premium))
+            if self.over_budget or self._has(song_id):
+                return
+            self._append(song_id, title, artist, is_premium)
+            self._seen.add(song_id)
+
+    def added_since(self, mark):
+        with self._lock:
+            return self._added[mark:]
+
+    def _candidates(self, token):
+        if len(token) >= KEY_LEN:
+            return self._postings.get(token[:KEY_LEN], ())
+        # Short prefix: every key starting with it
+        rows = set()
+        for key, postings in self._postings.items():
+            if key.startswith(token):
+                rows.update(postings)
+        return sorted(rows)
+
+    def suggest(self, prefix, include_premium=True, limit=MAX_SUGGESTIONS):
+        tokens = _words(prefix)
+        if not tokens or len(prefix.strip()) < MIN_PREFIX:
+            return []
+        query = prefix.strip().lower()
+        # The longest token is the most selective one to drive the scan
+        lead = max(tokens, key=len)
+
+        matches = []
+        with self._lock:
+            for row in self._candidates(lead):
+                if not include_premium and self._premium[row]:
+                    continue
+                record = self._record(row)
+                words = _words(record)
+                if all(any(word.startswith(token) for word in words) for token in tokens):
+                    title, artist = record.split(SEPARATOR, 1)
+                    matches.append((self._song_ids[row], title, artist))
+                    if len(matches) >= SCAN_LIMIT:
+                        break
+
+        # Titles that start with what was typed first, then artists, then the rest
+        def rank(match):
+            _, title, artist = match
+            return (not title.lower().startswith(query), not artist.lower().startswith(query), title.lower())
+
+        return sorted(matches, key=rank)[:limit]
+
+    def memory_bytes(self):
+        with self._lock:
+            postings = sum(p.itemsize * len(p) + sys.getsizeof(k) for k, p in self._postings.items())
+            return (len(self._text)
+                    + self._offsets.itemsize * len(self._offsets)
+                    + self._song_ids.itemsize * len(self._song_ids)
+                    + self._premium.itemsize * len(self._premium)
+                    + postings + sys.getsizeof(self._postings))
+
+    def within_budget(self):
+        songs = max(len(self), 1)
+        return self.memory_bytes() <= MEMORY_FLOOR + MEMORY_BUDGET * songs / 1_000_000
+
+
+# ── per-tenant registry ──────────────────────────────────────────────────────
+_indexes = {}                # (tenant_id, scope) -> TypeaheadIndex
+_indexes_lock = threading.Lock()
+
+SONGS_SQL = "SELECT song_id, title, artist, is_premium FROM songs ORDER BY song_id"
+
+
+def _fetch_rows(cur):
+    cur.execute(SONGS_SQL)
+    while True:
+        batch = cur.fetchmany(10000)
+        if not batch:
+            return
+        yield from batch
+
+
+def _build(cur):
+    index = TypeaheadIndex()
+    index.load(_fetch_rows(cur))
+    if not index.within_budget():
+        # Keep only an empty marker: suggest() asks the database instead
+        index = TypeaheadIndex()
+        index.over_budget = True
+    return index
+
+
+def get_index(cur, tenant_id, scope):
+    # cur must carry the same role/tenant as scope: RLS decides what gets indexed
+    key = (tenant_id, scope)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TypeaheadIndex()
+            index.stale = True
+
+    if index.stale or time.monotonic() - index.built_at > REBUILD_TTL:
+        with index.refresh_lock:
+            with _indexes_lock:
+                current = _indexes.get(key)
+            if current is not index:
+                return current          # another thread already swapped in a rebuild
+            # Cleared first so a notification arriving mid-build isn't lost
+            index.stale = False
+            mark = len(index.added_since(0))
+            try:
+                fresh = _build(cur)
+            except Exception:
+                index.stale = True
+                raise
+            # Songs added while the build ran may have committed after its snapshot
+            for row in index.added_since(mark):
+                fresh.add(*row)
+            with _indexes_lock:
+                fresh.stale = index.stale
+                _indexes[key] = index = fresh
+    return index
+
+
+def suggest(cur, tenant_id, scope, prefix, limit=MAX_SUGGESTIONS):
+    index = get_index(cur, tenant_id, scope)
+    if index.over_budget:
+        if len(prefix.strip()) < MIN_PREFIX:
+            return []
+        # RLS on songs applies the premium rule here
+        rows, _ = catalog_search.search_songs(cur, prefix.strip(), "title", limit)
+        return [(row[0], row[1], row[2]) for row in rows]
+    # Same rule as songs_listener_free_policy: free listeners never see premium songs
+    return index.suggest(prefix, include_premium=(scope != "listener_free"), limit=limit)
+
+
+def song_added(tenant_id, song_id, title, artist, is_premium):
+    with _indexes_lock:
+        indexes = [idx for (t, _), idx in _indexes.items() if t in (tenant_id, None)]
+    for index in indexes:
+        index.add(song_id, title, artist, is_premium)
+
+
+@catalog_cache.on_insert
+def _song_inserted(tenant_id, song):
+    song_added(tenant_id, song["song_id"], song["title"], song["artist"], song["is_premium"])
+
+
+@catalog_cache.on_invalidate
+def _mark_stale(tenant_id):
+    with _indexes_lock:
+        for (t, _), index in _indexes.items():
+            if tenant_id is None or t in (tenant_id, None):
+                index.stale = True
@@ -0,0 +1,161 @@
+# watchdog.py
+# Per-role timeout profiles and the long-running statement watchdog.
+# Requirements: pip install psycopg2-binary
+#
+# Every role gets a profile: statement_timeout and
+# idle_in_transaction_session_timeout (enforced by the server itself),
+# plus the budgets the watchdog enforces for anything that slips past them:
+# cancel an active statement after cancel_after_s, terminate its backend after
+# terminate_after_s, terminate a session left idle in a transaction after
+# idle_terminate_s. Listeners are kept tight, adminn analytics get room.
+#
+# Pooled connections all log in as app_login, so db_pool sets the profile and
+# application_name 'musicapp:<role>:<tenant>' on checkout; that name is how
+# the watchdog (and pg_stat_activity readers) tell role and tenant apart.
+# Direct logins (listenerr.py) get the same timeouts from ALTER ROLE ... SET
+# in MUSICAPPDATABASE.sql; keep the two in step.
+#
+#   python APP/manage.py watchdog run [--interval 5] [--dry-run]
+#
+# Runs with MANAGE_DSN: signalling other roles' backends needs superuser or
+# pg_signal_backend. Every cancel/terminate is logged to watchdog_events.
+
+import time
+from collections import namedtuple
+
+APP_NAME_PREFIX = "musicapp"
+POLL_INTERVAL   = 5.0       # seconds between pg_stat_activity polls
+
+Profile = namedtuple("Profile", ["statement_timeout_s", "idle_in_transaction_s",
+                                 "cancel_after_s", "terminate_after_s", "idle_terminate_s"])
+
+ROLE_PROFILES = {
+    "app_login":        Profile(5,   10,  10,  30,   30),
+    "listener_free":    Profile(5,   10,  10,  30,   30),
+    "listener_premium": Profile(5,   10,  10,  30,   30),
+    "appuser":          Profile(15,  30,  30,  120,  120),
+    "adminn":           Profile(120, 60,  300, 1800, 300),
+}
+
+IDLE_IN_TRANSACTION = ("idle in transaction", "idle in transaction (aborted)")
+
+ACTIVITY_SQL = "SELECT * FROM watchdog_activity()"
+
+LOG_EVENT_SQL = """
+    INSERT INTO watchdog_events(pid, db_role, tenant_id, usename, state, runtime_s, action, applied, query)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+RECENT_EVENTS_SQL = """
+    SELECT logged_at, pid, db_role, tenant_id, state, runtime_s, action, applied, query
+    FROM watchdog_events
+    ORDER BY logged_at DESC
+    LIMIT %s
+"""
+
+SIGNAL_SQL = {
+    "cancel":    "SELECT pg_cancel_backend(%s)",
+    "terminate": "SELECT pg_terminate_backend(%s)",
+}
+
+
+def application_name(role, tenant_id=None):
+    # pg_stat_activity truncates application_name at 63 bytes; a UUID fits
+    return f"{APP_NAME_PREFIX}:{role or '-'}:{tenant_id or '-'}"
+
+
+def session_settings(role):
+    # -> (statement_timeout, idle_in_transaction_session_timeout) as set_config values
+    profile = ROLE_PROFILES.get(role)
+    if profile is None:
+        return "0", "0"
+    return f"{profile.statement_timeout_s}s", f"{profile.idle_in_transaction_s}s"
+
+
+def connect_options(role):
+    statement_timeout, idle_timeout = session_settings(role)
+    return f"-c statement_timeout={statement_timeout} -c idle_in_transaction_session_timeout={idle_timeout}"
+
+
+# ── policy ───────────────────────────────────────────────────────────────────
+def decide(activity):
+    # -> "cancel", "terminate" or None for one watchdog_activity() row
+    profile = ROLE_PROFILES.get(activity["db_role"])
+    if profile is None:
+        return None         # manage jobs, replication, superuser sessions: not ours to police
+    if activity["state"] == "active":
+        if activity["runtime_s"] > profile.terminate_after_s:
+            return "terminate"
+        if activity["runtime_s"] > profile.cancel_after_s:
+            return "cancel"
+    elif activity["state"] in IDLE_IN_TRANSACTION:
+        # cancelling does nothing to an idle session; only ending it releases its locks
+        if activity["state_age_s"] > profile.idle_terminate_s:
+            return "terminate"
+    return None
+
+
+def budget_used(activity):
+    # share of the budget used before the watchdog steps in, for the live view
+    # (None for roles it doesn't police)
+    profile = ROLE_PROFILES.get(activity["db_role"])
+    if profile is None:
+        return None
+    if activity["state"] in IDLE_IN_TRANSACTION:
+        return activity["state_age_s"] / profile.idle_terminate_s
+    return activity["runtime_s"] / profile.cancel_after_s
+
+
+def fetch_activity(cur):
+    cur.execute(ACTIVITY_SQL)
+    columns = [col[0] for col in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def recent_events(cur, limit=50):
+    cur.execute(RECENT_EVENTS_SQL, (limit,))
+    return cur.fetchall()
+
+
+# ── enforcement ──────────────────────────────────────────────────────────────
+def sweep(cur, dry_run=False, acted=None):
+    # One poll: signal every backend over budget and log it.
+    # acted maps (pid, query_start) -> action already taken, so a statement
+    # is cancelled once and then only escalated, not re-signalled every poll.
+    acted = {} if acted is None else acted
+    activities = fetch_activity(cur)
+    running = {(a["pid"], a["query_start"]) for a in activities}
+    for key in [k for k in acted if k not in running]:
+        del acted[key]          # finished statements: keep the map small
+
+    events = []
+    for activity in activities:
+        action = decide(activity)
+        key = (activity["pid"], activity["query_start"])
+        if action is None or acted.get(key) in (action, "terminate"):
+            continue
+        applied = None
+        if not dry_run:
+            cur.execute(SIGNAL_SQL[action], (activity["pid"],))
+            applied = cur.fetchone()[0]     # False: the backend was already gone
+        acted[key] = action
+        runtime = activity["state_age_s"] if activity["state"] in IDLE_IN_TRANSACTION else activity["runtime_s"]
+        cur.execute(LOG_EVENT_SQL, (activity["pid"], activity["db_role"], activity["tenant_id"],
+                                    activity["usename"], activity["state"], round(runtime, 1),
+                                    action, applied, activity["query"]))
+        events.append((activity, action, applied, runtime))
+    return events
+
+
+def run(conn, interval=POLL_INTERVAL, dry_run=False, once=False, out=print):
+    acted = {}
+    with conn.cursor() as cur:
+        while True:
+            for activity, action, applied, runtime in sweep(cur, dry_run, acted):
+                status = "dry run" if applied is None else ("done" if applied else "backend gone")
+                out(f"{action:<9} pid {activity['pid']} {activity['db_role']} "
+                    f"tenant {str(activity['tenant_id'] or '-')[:8]} {activity['state']} "
+                    f"{runtime:.0f}s ({status}): {(activity['query'] or '')[:80]}")
+            if once:
+                return
+            time.sleep(interval)
@@ -0,0 +1,118 @@
+# bench_play_ingest.py
+# Play-event write throughput: record_song_play() + commit per click vs PlayEventBuffer.
+# Requirements: pip install psycopg2-binary
+#
+#   python BENCH/bench_play_ingest.py --events 50000 --baseline-events 2000
+#
+# Both paths write into a scratch bench_ingest.play_history (same columns as
+# play_history, no foreign keys) through search_path, using real song ids
+# from one tenant. The target is >= 20x the single-row rate.
+
+import argparse
+import time
+
+from common import BENCH_DSN, connect, print_table, use_app_modules
+
+use_app_modules()
+import identity_context  # noqa: E402
+import play_ingest  # noqa: E402
+
+SCHEMA = "bench_ingest"
+SEARCH_PATH_OPTIONS = f"-c search_path={SCHEMA},public"
+
+
+def build_scratch(cur):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.play_history (LIKE public.play_history INCLUDING DEFAULTS)")
+    # Own sequence, so the benchmark doesn't burn through public ids
+    cur.execute(f"CREATE SEQUENCE {SCHEMA}.play_history_history_id_seq OWNED BY {SCHEMA}.play_history.history_id")
+    cur.execute(f"ALTER TABLE {SCHEMA}.play_history ALTER COLUMN history_id "
+                f"SET DEFAULT nextval('{SCHEMA}.play_history_history_id_seq')")
+
+
+def pick_songs(cur):
+    cur.execute("""
+        SELECT tenant_id::text, array_agg(song_id ORDER BY song_id)
+        FROM songs
+        GROUP BY tenant_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """)
+    row = cur.fetchone()
+    if not row:
+        raise SystemExit("songs is empty - load DATA/MUSICAPPDATABASE.sql (or generate a dataset) first")
+    return row
+
+
+def run_single_row(tenant_id, song_ids, events):
+    conn = connect(autocommit=False)
+    with conn.cursor() as cur:
+        cur.execute(f"SET search_path = {SCHEMA}, public")
+        cur.execute("SELECT set_config('app.current_tenant', %s, false)", (tenant_id,))
+        conn.commit()
+        started = time.perf_counter()
+        for i in range(events):
+            cur.execute("SELECT record_song_play(%s, %s)", (song_ids[i % len(song_ids)], 180))
+            cur.fetchone()
+            conn.commit()
+        elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed
+
+
+def run_buffered(tenant_id, song_ids, events, flush_size):
+    identity = identity_context.IdentityContext("bench", "listener_premium", tenant_id,
+                                                "listener_premium", True, None)
+    buffer = play_ingest.PlayEventBuffer({"dsn": BENCH_DSN, "options": SEARCH_PATH_OPTIONS},
+                                         flush_size=flush_size)
+    conn = connect()
+    with conn.cursor() as cur:
+        cur.execute("SELECT set_config('app.current_tenant', %s, false)", (tenant_id,))
+        play_ingest.song_premium_map(cur, tenant_id)      # warm the gate, as a running app would
+        started = time.perf_counter()
+        for i in range(events):
+            buffer.submit(cur, identity, song_ids[i % len(song_ids)], 180)
+        buffer.close()                                    # includes the final flush
+        elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed, buffer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-row play inserts vs buffered batch ingestion")
+    parser.add_argument("--events", type=int, default=50_000)
+    parser.add_argument("--baseline-events", type=int, default=2_000)
+    parser.add_argument("--flush-size", type=int, default=play_ingest.FLUSH_SIZE)
+    parser.add_argument("--keep", action="store_true", help="keep the bench_ingest schema afterwards")
+    args = parser.parse_args()
+
+    conn = connect()
+    with conn.cursor() as cur:
+        build_scratch(cur)
+        tenant_id, song_ids = pick_songs(cur)
+
+    single = run_single_row(tenant_id, song_ids, args.baseline_events)
+    buffered, stats = run_buffered(tenant_id, song_ids, args.events, args.flush_size)
+
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.play_history")
+        rows = cur.fetchone()[0]
+        if not args.keep:
+            cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.close()
+
+    single_rate = args.baseline_events / single
+    buffered_rate = args.events / buffered
+    print_table(
+        ["path", "events", "seconds", "events/s", "speedup"],
+        [["record_song_play + commit", args.baseline_events, round(single, 2), round(single_rate), "1.0x"],
+         [f"PlayEventBuffer ({args.flush_size}/flush)", args.events, round(buffered, 2),
+          round(buffered_rate), f"{buffered_rate / single_rate:.1f}x"]]
+    )
+    print(f"\nrows written: {rows:,}  flushes: {stats['flushes']}  "
+          f"flush p50: {stats['flush_p50_ms']} ms  failed: {stats['failed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench_rating_histogram.py
+# Rating Distribution panel: client-side binning vs rating_histogram().
+# Requirements: pip install psycopg2-binary numpy pandas
+#
+#   python BENCH/bench_rating_histogram.py --sizes 10000,1000000,10000000
+#
+# "client" is what the Dashboard used to do: ship every rating and bin it in
+# pandas/numpy. "server" calls rating_histogram(20), which returns 20 rows.
+# Each size is loaded into a session TEMP table called songs; pg_temp is
+# searched first, so rating_histogram() reads it instead of public.songs.
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from common import connect, parse_sizes, print_table, summarize, timed
+
+BUCKETS = 20
+
+
+def load_ratings(cur, rows):
+    cur.execute("DROP TABLE IF EXISTS pg_temp.songs")
+    cur.execute("CREATE TEMP TABLE songs (rating NUMERIC(3,1))")
+    cur.execute("""
+        INSERT INTO pg_temp.songs (rating)
+        SELECT CASE WHEN random() < 0.05 THEN NULL
+                    ELSE round((random() * 5)::numeric, 1) END
+        FROM generate_series(1, %s)
+    """, (rows,))
+    cur.execute("ANALYZE pg_temp.songs")
+
+
+def client_binning(cur):
+    cur.execute("SELECT rating FROM songs WHERE rating IS NOT NULL")
+    df = pd.DataFrame(cur.fetchall(), columns=["Rating"])
+    counts, _ = np.histogram(df["Rating"].astype(float), bins=BUCKETS, range=(0, 5))
+    return counts
+
+
+def server_binning(cur):
+    cur.execute("SELECT song_count FROM rating_histogram(%s)", (BUCKETS,))
+    return np.array([row[0] for row in cur.fetchall()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client vs server rating histogram binning")
+    parser.add_argument("--sizes", default="10000,1000000,10000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = connect()
+    results = []
+    with conn.cursor() as cur:
+        for rows in parse_sizes(args.sizes):
+            print(f"Loading {rows:,} ratings...")
+            load_ratings(cur, rows)
+
+            client = summarize(timed(lambda: client_binning(cur), repeat=args.repeat))
+            server = summarize(timed(lambda: server_binning(cur), repeat=args.repeat))
+
+            # Both must agree bucket for bucket (5.0 goes in the last bucket either way)
+            if not np.array_equal(client_binning(cur), server_binning(cur)):
+                print("  warning: client and server bucket counts differ")
+
+            cur.execute("SELECT COUNT(rating) FROM songs")
+            shipped = cur.fetchone()[0]
+            results.append([
+                f"{rows:,}", f"{shipped:,}", client["median_ms"], BUCKETS, server["median_ms"],
+                f"{client['median_ms'] / max(server['median_ms'], 0.01):.1f}x",
+            ])
+    conn.close()
+
+    print()
+    print_table(["rows", "client rows", "client ms", "server rows", "server ms", "speedup"], results)
+
+
+if __name__ == "__main__":
+    main()
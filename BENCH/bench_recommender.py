@@ -0,0 +1,66 @@
+# bench_recommender.py
+# Batch time of the co-listen recommender on a synthetic tenant.
+# Requirements: pip install numpy scipy
+#
+#   python BENCH/bench_recommender.py --users 100000 --songs 1000000 --plays-per-user 40
+#
+# Plays follow a Zipf-like popularity curve (a few hits, a long tail), 30% of
+# songs are premium and 40% of users are premium listeners. Only the
+# NumPy/SciPy part is timed; loading play_history and the COPY of the
+# results scale with the number of (user, song) pairs and recommendations.
+
+import argparse
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from common import print_table, use_app_modules
+
+use_app_modules()
+import recommender  # noqa: E402
+
+
+def synthetic_plays(users, songs, plays_per_user, seed=42):
+    rng = np.random.default_rng(seed)
+    total = users * plays_per_user
+    rows = rng.integers(0, users, total)
+    cols = (rng.zipf(1.3, total) - 1) % songs
+    seconds = rng.integers(30, 300, total).astype(np.float32)
+    matrix = sp.csr_matrix((seconds, (rows, cols)), shape=(users, songs))
+    matrix.sum_duplicates()
+    matrix.data = np.log1p(matrix.data / 60.0)
+    premium_songs = rng.random(songs) < 0.3
+    premium_users = rng.random(users) < 0.4
+    return matrix, premium_songs, premium_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Co-listen recommender batch timing")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--songs", type=int, default=1_000_000)
+    parser.add_argument("--plays-per-user", type=int, default=40)
+    parser.add_argument("--top-k", type=int, default=recommender.TOP_K)
+    parser.add_argument("--neighbours", type=int, default=recommender.NEIGHBOURS)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    matrix, premium_songs, premium_users = synthetic_plays(args.users, args.songs, args.plays_per_user)
+    build_s = time.perf_counter() - started
+
+    (user_rows, song_cols, _, _), timings = recommender.compute(
+        matrix, premium_songs, premium_users, args.top_k, args.neighbours
+    )
+
+    # Gate check: no free listener may receive a premium song
+    leaks = int(np.sum(premium_songs[song_cols] & ~premium_users[user_rows]))
+
+    print_table(
+        ["users", "songs", "pairs", "matrix s", "similarity s", "scoring s", "recs", "premium leaks"],
+        [[f"{args.users:,}", f"{args.songs:,}", f"{matrix.nnz:,}", round(build_s, 2),
+          timings["similarity_s"], timings["scoring_s"], f"{len(user_rows):,}", leaks]]
+    )
+
+
+if __name__ == "__main__":
+    main()
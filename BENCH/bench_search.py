@@ -0,0 +1,126 @@
+# bench_search.py
+# Catalog search latency: the old ILIKE queries vs search_songs() on trigram indexes.
+# Requirements: pip install psycopg2-binary
+#
+#   python BENCH/bench_search.py --rows 3000000
+#
+# Builds a scratch catalog in schema bench_search (same columns as songs),
+# times the legacy queries on it without trigram indexes, then adds the
+# gin_trgm_ops indexes from MUSICAPPDATABASE.sql and times search_songs().
+# search_path puts bench_search first, so search_songs() reads the scratch
+# table. Runs as the benchmark superuser, i.e. without RLS.
+
+import argparse
+
+from common import connect, print_table, summarize, timed
+
+SCHEMA = "bench_search"
+
+WORDS = [
+    "love", "night", "heart", "dream", "fire", "rain", "summer", "dance", "river", "light",
+    "shadow", "golden", "broken", "wild", "sky", "ocean", "city", "midnight", "blue", "home",
+    "forever", "mountain", "song", "road", "star", "moon", "sun", "storm", "echo", "silver",
+    "paradise", "kathmandu", "himalaya", "phool", "maya", "sapana", "pahad", "saathi", "jindagi", "samaya",
+]
+FIRST_NAMES = ["Aasha", "Bipul", "Ed", "Taylor", "Narayan", "Sajjan", "Ani", "Billie", "Arijit", "Neetesh",
+               "Yama", "Adele", "Bruno", "Tribal", "Kutumba", "Prabesh", "Sushant", "Rihanna", "Drake", "Shreya"]
+LAST_NAMES = ["Sheeran", "Swift", "Gopal", "Raj", "Choying", "Eilish", "Singh", "Kunwar", "Buddha", "Mars",
+              "Kharel", "Kc", "Ghoshal", "Lama", "Rai", "Gurung", "Thapa", "Shrestha", "Tamang", "Magar"]
+GENRES = ["Pop", "Rock", "Hip Hop", "Rap", "Bollywood", "Love", "Indie", "Classic", "Folk", "Country", "Jazz", "Ghazal"]
+
+QUERIES = [("all", "love"), ("all", "midnite"), ("title", "golden river"), ("artist", "sheeran"), ("genre", "ghaz")]
+
+LEGACY_SQL = {
+    "all":    "SELECT title, artist, genre, rating, is_premium FROM songs "
+              "WHERE title ILIKE %(p)s OR artist ILIKE %(p)s OR genre ILIKE %(p)s",
+    "title":  "SELECT title, artist, genre, rating, is_premium FROM songs WHERE title ILIKE %(p)s",
+    "artist": "SELECT title, artist, genre, rating, is_premium FROM songs WHERE artist ILIKE %(p)s",
+    "genre":  "SELECT title, artist, genre, rating, is_premium FROM songs WHERE genre ILIKE %(p)s",
+}
+
+TRIGRAM_INDEXES = [
+    f"CREATE INDEX ON {SCHEMA}.songs USING gin (title gin_trgm_ops)",
+    f"CREATE INDEX ON {SCHEMA}.songs USING gin (artist gin_trgm_ops)",
+    f"CREATE INDEX ON {SCHEMA}.songs USING gin (genre gin_trgm_ops)",
+]
+
+
+def build_catalog(cur, rows):
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.songs (LIKE public.songs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    # Own sequence, so the benchmark doesn't burn through public.songs ids
+    cur.execute(f"CREATE SEQUENCE {SCHEMA}.songs_song_id_seq OWNED BY {SCHEMA}.songs.song_id")
+    cur.execute(f"ALTER TABLE {SCHEMA}.songs ALTER COLUMN song_id SET DEFAULT nextval('{SCHEMA}.songs_song_id_seq')")
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.songs (title, artist, genre, rating, is_premium, added_by, tenant_id)
+        SELECT initcap(w[1 + floor(random() * array_length(w, 1))::int] || ' ' ||
+                       w[1 + floor(random() * array_length(w, 1))::int] || ' ' ||
+                       w[1 + floor(random() * array_length(w, 1))::int]),
+               f[1 + floor(random() * array_length(f, 1))::int] || ' ' ||
+               l[1 + floor(random() * array_length(l, 1))::int],
+               g[1 + floor(random() * array_length(g, 1))::int],
+               round((random() * 5)::numeric, 1),
+               random() < 0.3,
+               'appuser',
+               gen_random_uuid()
+        FROM generate_series(1, %s),
+             (SELECT %s::text[] AS w, %s::text[] AS f, %s::text[] AS l, %s::text[] AS g) words
+    """, (rows, WORDS, FIRST_NAMES, LAST_NAMES, GENRES))
+    cur.execute(f"ANALYZE {SCHEMA}.songs")
+
+
+def search_page(cur, field, term, pages):
+    after_score = after_id = None
+    for _ in range(pages):
+        cur.execute("SELECT song_id, score FROM search_songs(%s, %s, 20, %s, %s)",
+                    (term, field, after_score, after_id))
+        rows = cur.fetchall()
+        if not rows:
+            return
+        after_id, after_score = rows[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy ILIKE search vs trigram search_songs()")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the bench_search schema afterwards")
+    args = parser.parse_args()
+
+    conn = connect()
+    results = []
+    with conn.cursor() as cur:
+        print(f"Building {args.rows:,}-song scratch catalog...")
+        build_catalog(cur, args.rows)
+        cur.execute(f"SET search_path = {SCHEMA}, public")
+
+        legacy = {}
+        for field, term in QUERIES:
+            params = {"p": f"%{term}%"}
+            legacy[(field, term)] = summarize(timed(
+                lambda: (cur.execute(LEGACY_SQL[field], params), cur.fetchall()), repeat=args.repeat))
+
+        print("Creating trigram indexes...")
+        for ddl in TRIGRAM_INDEXES:
+            cur.execute(ddl)
+        cur.execute(f"ANALYZE {SCHEMA}.songs")
+
+        for field, term in QUERIES:
+            first = summarize(timed(lambda: search_page(cur, field, term, 1), repeat=args.repeat))
+            fifth = summarize(timed(lambda: search_page(cur, field, term, 5), repeat=args.repeat))
+            old = legacy[(field, term)]
+            results.append([field, term, old["median_ms"], old["p95_ms"],
+                            first["median_ms"], first["p95_ms"], fifth["median_ms"]])
+
+        if not args.keep:
+            cur.execute("RESET search_path")
+            cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.close()
+
+    print()
+    print_table(["field", "term", "ILIKE p50", "ILIKE p95", "trgm p50", "trgm p95", "5 pages p50"], results)
+
+
+if __name__ == "__main__":
+    main()
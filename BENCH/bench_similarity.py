@@ -0,0 +1,82 @@
+# bench_similarity.py
+# "More like this": build time, query latency and recall of the similarity index.
+# Requirements: pip install numpy
+#
+#   python BENCH/bench_similarity.py --songs 10000,100000,1000000 --queries 200
+#
+# Synthetic catalogs with a Zipf-like artist distribution. Below
+# BRUTE_FORCE_LIMIT the index scans every song (exact); above it queries
+# only probe NPROBE IVF lists, so recall@k is measured against an exact
+# brute-force scan of the same vectors.
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from common import parse_sizes, print_table, summarize, timed, use_app_modules
+
+use_app_modules()
+import similarity  # noqa: E402
+
+GENRES = ["Pop", "Rock", "Jazz", "Folk", "Rap", "Classical", "Ghazal", "EDM", "Indie", "Blues"]
+
+
+def synthetic_songs(songs, seed=42):
+    rng = random.Random(seed)
+    artists = max(10, songs // 20)
+    weights = [1.0 / rank for rank in range(1, artists + 1)]
+    artist_ids = rng.choices(range(artists), weights=weights, k=songs)
+    return [(song_id, rng.choice(GENRES), f"Artist {artist}", round(rng.uniform(0, 5), 1), rng.random() < 0.3)
+            for song_id, artist in enumerate(artist_ids, 1)]
+
+
+def recall(index, rows, query_ids, k):
+    # Fraction of the exact top-k scores reached by the index's answers
+    vectors = similarity.feature_vectors(rows)
+    found = index.similar(query_ids, k)
+    hits = total = 0
+    for song_id in query_ids:
+        scores = vectors @ vectors[song_id - 1]
+        scores[song_id - 1] = -np.inf
+        exact = np.sort(scores)[-k:]
+        answer = [score for _, score in found.get(song_id, [])]
+        hits += sum(1 for score in answer if score >= exact[0] - 1e-6)
+        total += k
+    return hits / total if total else 1.0
+
+
+def bench(songs, queries, k, repeat):
+    rows = synthetic_songs(songs)
+    index = similarity.SimilarityIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    build_s = time.perf_counter() - started
+
+    rng = random.Random(7)
+    query_ids = [rng.randint(1, songs) for _ in range(queries)]
+    single = summarize(timed(lambda: index.similar([rng.choice(query_ids)], k), repeat=repeat * 20))
+    batch = summarize(timed(lambda: index.similar(query_ids, k), repeat=repeat))
+    mode = "brute force" if songs <= similarity.BRUTE_FORCE_LIMIT else f"IVF ({len(index._lists)} lists)"
+    return [f"{songs:,}", mode, round(build_s, 2), single["median_ms"], single["p95_ms"],
+            batch["median_ms"], round(recall(index, rows, query_ids[:50], k), 3),
+            round(index.memory_bytes() / 1e6, 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similarity index timings")
+    parser.add_argument("--songs", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200, help="songs per batch query")
+    parser.add_argument("--k", type=int, default=similarity.DEFAULT_K)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [bench(songs, args.queries, args.k, args.repeat) for songs in parse_sizes(args.songs)]
+    print(f"top-{args.k}, NPROBE {similarity.NPROBE}, {args.queries} songs per batch")
+    print_table(["songs", "mode", "build s", "1 query p50 ms", "1 query p95 ms",
+                 "batch p50 ms", "recall@k", "MB"], rows)
+
+
+if __name__ == "__main__":
+    main()
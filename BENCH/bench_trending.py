@@ -0,0 +1,96 @@
+# bench_trending.py
+# Hot Hits: this_week_famous() vs a lookup on the time-decayed trending board.
+# Requirements: pip install psycopg2-binary
+#
+#   python BENCH/bench_trending.py --plays 1000000 --songs 10000,1000000
+#
+# Part 1 is in-memory only: cost of TrendingBoard.record() per play and of a
+# top-12 read, for skewed (Zipf-like) plays over catalogs of each size.
+# Part 2 times this_week_famous() and the board seed + lookup against the
+# tenant with the most rolled-up plays in the loaded database.
+
+import argparse
+import random
+import time
+
+from common import connect, parse_sizes, print_table, summarize, timed, use_app_modules
+
+use_app_modules()
+import trending  # noqa: E402
+
+
+def skewed_ids(songs, plays, seed=42):
+    rng = random.Random(seed)
+    # rank r is played proportionally to 1 / r
+    weights = [1.0 / rank for rank in range(1, songs + 1)]
+    return rng.choices(range(1, songs + 1), weights=weights, k=plays)
+
+
+def bench_board(songs, plays, repeat):
+    ids = skewed_ids(songs, plays)
+    board = trending.TrendingBoard()
+    start_ts = time.time() - 7 * 86400
+    step = 7 * 86400 / plays
+
+    started = time.perf_counter()
+    for i, song_id in enumerate(ids):
+        board.record(song_id, song_id % 3 == 0, start_ts + i * step)
+    record_s = time.perf_counter() - started
+
+    lookup = summarize(timed(lambda: board.top(12, include_premium=False), repeat=repeat * 20))
+    return [f"{songs:,}", f"{plays:,}", round(record_s * 1e6 / plays, 2), round(plays / record_s),
+            lookup["median_ms"], lookup["p95_ms"]]
+
+
+def bench_database(repeat):
+    conn = connect()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT tenant_id::text, SUM(plays) FROM play_song_hourly
+            GROUP BY tenant_id ORDER BY 2 DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+        if not row:
+            conn.close()
+            return None
+        tenant_id, plays = row
+        cur.execute("SELECT set_config('app.current_tenant', %s, false)", (tenant_id,))
+
+        famous = summarize(timed(lambda: (cur.execute("SELECT * FROM this_week_famous()"), cur.fetchall()),
+                                 repeat=repeat))
+        seed = summarize(timed(lambda: trending.seed_board(cur), repeat=repeat))
+        board = trending.seed_board(cur)
+        lookup = summarize(timed(lambda: board.top(12), repeat=repeat * 20))
+    conn.close()
+    return tenant_id, plays, famous, seed, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="this_week_famous() vs the trending board")
+    parser.add_argument("--songs", default="10000,1000000", help="catalog sizes for the in-memory part")
+    parser.add_argument("--plays", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-db", action="store_true")
+    args = parser.parse_args()
+
+    rows = [bench_board(songs, args.plays, args.repeat) for songs in parse_sizes(args.songs)]
+    print(f"In-memory board (half-life {trending.HALF_LIFE_HOURS} h, top {trending.TOP_K})")
+    print_table(["songs", "plays", "us/play", "plays/s", "top-12 p50 ms", "top-12 p95 ms"], rows)
+
+    if args.skip_db:
+        return
+    result = bench_database(args.repeat)
+    if result is None:
+        print("\nNo rolled-up plays in the database; skipping this_week_famous() comparison")
+        return
+    tenant_id, plays, famous, seed, lookup = result
+    print(f"\nTenant {tenant_id} ({plays:,} plays rolled up)")
+    print_table(["query", "p50 ms", "p95 ms"], [
+        ["this_week_famous()", famous["median_ms"], famous["p95_ms"]],
+        ["board seed (every RESEED_INTERVAL)", seed["median_ms"], seed["p95_ms"]],
+        ["board top-12 lookup", lookup["median_ms"], lookup["p95_ms"]],
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# common.py
+# Shared helpers for the benchmark scripts in BENCH/.
+# Requirements: pip install psycopg2-binary
+#
+# Benchmarks run against a local Postgres that has DATA/MUSICAPPDATABASE.sql
+# loaded. Point them at it with BENCH_DSN; the default connects as the
+# superuser so scratch tables can be created and roles switched.
+
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+BENCH_DSN = os.environ.get("BENCH_DSN", "dbname=backup user=postgres host=localhost port=5432")
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "APP")
+
+
+def connect(dsn=BENCH_DSN, autocommit=True):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = autocommit
+    return conn
+
+
+def use_app_modules():
+    # Lets a benchmark import the modules the apps use (APP/ is not a package)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+
+
+def parse_sizes(text):
+    return [int(part.replace("_", "")) for part in text.split(",") if part.strip()]
+
+
+def timed(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(p * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs":      len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 2) if ordered else 0.0,
+        "p95_ms":    round(percentile(ordered, 0.95) * 1000, 2),
+        "min_ms":    round(ordered[0] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) if rows else len(str(h))
+              for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
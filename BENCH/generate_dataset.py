@@ -0,0 +1,302 @@
+# generate_dataset.py
+# Synthetic multi-tenant dataset (tenants, songs, users, play_history) loaded with COPY.
+# Requirements: pip install psycopg2-binary numpy
+#
+#   python BENCH/generate_dataset.py --scale small            # 3 tenants, 10k plays
+#   python BENCH/generate_dataset.py --scale medium --seed 7  # 10 tenants, 1M plays
+#   python BENCH/generate_dataset.py --scale large --reset    # 50 tenants, 50M plays
+#   python BENCH/generate_dataset.py --tenants 5 --songs 200000 --users 20000 --plays 5000000
+#
+# Same seed + same --end date = the same rows, so benchmark runs are comparable.
+#   tenants  Zipf-sized: the first tenant holds the most songs, users and plays
+#   songs    genre and artist both Zipf-skewed; ratings ~N(3.4, 0.9), 5% unrated;
+#            PREMIUM_SHARE premium
+#   users    age mix from AGE_BANDS, PREMIUM_USER_SHARE listener_premium,
+#            password "bench" (user_login compares it as stored)
+#   plays    a few heavy listeners, Zipf song popularity per tenant, free users
+#            never play premium songs; timestamps (UTC) follow DIURNAL by hour
+#            and WEEKLY by weekday over the last --days days; SKIP_SHARE of
+#            plays stop early
+#
+# Generated tenants are named "Bench Tenant NNN" with location "Synthetic";
+# --reset deletes them (and everything they own) first. Rows are COPYed with
+# triggers and FK checks off (session_replication_role = replica, so connect
+# as a superuser); the play rollups and song summaries are rebuilt afterwards.
+
+import argparse
+import io
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from common import BENCH_DSN, connect, print_table
+
+SCALES = {
+    "small":  dict(tenants=3,  songs=2_000,     users=1_000,   plays=10_000),
+    "medium": dict(tenants=10, songs=100_000,   users=50_000,  plays=1_000_000),
+    "large":  dict(tenants=50, songs=1_000_000, users=500_000, plays=50_000_000),
+}
+
+BENCH_LOCATION     = "Synthetic"
+TENANT_NAMESPACE   = uuid.UUID("6f1c2a52-3c1e-4d5e-9a47-1b2f0c9d8e01")   # uuid5 base for tenant ids
+BATCH_ROWS         = 500_000
+
+GENRES = ["Pop", "Hip Hop", "Rock", "Bollywood", "Rap", "Love", "Indie", "Folk", "EDM", "Jazz",
+          "Country", "Classic", "Ghazal", "Blues", "Metal", "Lok Dohori"]
+WORDS = ["Midnight", "Rain", "Golden", "Heart", "River", "Fire", "Dream", "Echo", "Silver", "Road",
+         "Moon", "Dance", "Lost", "Home", "Wild", "Sky", "Shadow", "Light", "Summer", "Blue"]
+
+GENRE_SKEW         = 1.0        # Zipf exponents
+ARTIST_SKEW        = 1.1
+SONG_SKEW          = 1.05
+LISTENER_SKEW      = 0.8
+TENANT_SKEW        = 1.0
+SONGS_PER_ARTIST   = 20
+PREMIUM_SHARE      = 0.25
+PREMIUM_USER_SHARE = 0.2
+SKIP_SHARE         = 0.25
+
+AGE_BANDS = [((5, 12), 0.08), ((13, 17), 0.12), ((18, 24), 0.25),
+             ((25, 34), 0.25), ((35, 49), 0.18), ((50, 80), 0.12)]
+# UTC hour-of-day and Monday-first weekday weights
+DIURNAL = [2, 1, 1, 1, 1, 2, 4, 6, 7, 6, 5, 5, 6, 5, 5, 6, 7, 8, 10, 11, 11, 9, 6, 4]
+WEEKLY  = [0.9, 0.9, 0.95, 1.0, 1.15, 1.25, 1.2]
+
+
+def zipf_weights(n, skew):
+    return 1.0 / np.arange(1, n + 1, dtype=np.float64) ** skew
+
+
+def split(total, shares, rng):
+    # at least one per tenant, the rest by share
+    return 1 + rng.multinomial(total - len(shares), shares / shares.sum())
+
+
+def copy_rows(cur, table, columns, lines):
+    buffer = io.StringIO("\n".join(lines) + "\n")
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+# ── generators (all numpy, one rng, fixed call order = deterministic) ────────
+def make_tenants(n):
+    return [(str(uuid.uuid5(TENANT_NAMESPACE, f"tenant-{i}")), f"Bench Tenant {i:03d}") for i in range(1, n + 1)]
+
+
+def make_songs(rng, tenants, per_tenant, first_id):
+    # -> song columns per tenant: ids (contiguous), premium flags, lengths, csv lines
+    songs = []
+    genre_p = zipf_weights(len(GENRES), GENRE_SKEW)
+    genre_p /= genre_p.sum()
+    song_id = first_id
+    for (tenant_id, _), count in zip(tenants, per_tenant):
+        artists = max(1, count // SONGS_PER_ARTIST)
+        artist_p = zipf_weights(artists, ARTIST_SKEW)
+        artist = rng.choice(artists, size=count, p=artist_p / artist_p.sum())
+        genre = rng.choice(len(GENRES), size=count, p=genre_p)
+        rating = np.clip(np.round(rng.normal(3.4, 0.9, count), 1), 0, 5)
+        rated = rng.random(count) >= 0.05
+        premium = rng.random(count) < PREMIUM_SHARE
+        length = np.clip(rng.normal(210, 50, count), 60, 600).astype(np.int32)
+        words = rng.integers(0, len(WORDS), size=(count, 2))
+        ids = np.arange(song_id, song_id + count)
+        lines = [f"{sid},{WORDS[w1]} {WORDS[w2]} {sid},Artist {tenant_id[:4]}-{a},{GENRES[g]},"
+                 f"{r if ok else ''},{'t' if p else 'f'},bench,{tenant_id}"
+                 for sid, (w1, w2), a, g, r, ok, p in zip(ids, words, artist, genre, rating, rated, premium)]
+        songs.append(dict(ids=ids, premium=premium, length=length, lines=lines))
+        song_id += count
+    return songs
+
+
+def make_users(rng, tenants, per_tenant):
+    users = []
+    band_p = np.array([share for _, share in AGE_BANDS])
+    for t, ((tenant_id, _), count) in enumerate(zip(tenants, per_tenant)):
+        band = rng.choice(len(AGE_BANDS), size=count, p=band_p / band_p.sum())
+        low = np.array([AGE_BANDS[b][0][0] for b in band])
+        high = np.array([AGE_BANDS[b][0][1] for b in band])
+        age = rng.integers(low, high + 1)
+        premium = rng.random(count) < PREMIUM_USER_SHARE
+        names = [f"bench_t{t + 1:03d}_u{i:07d}" for i in range(1, count + 1)]
+        lines = [f"{name},Listener {t + 1}-{i},{a},bench,{'listener_premium' if p else 'listener_free'},{tenant_id}"
+                 for i, (name, a, p) in enumerate(zip(names, age, premium), 1)]
+        users.append(dict(names=names, premium=premium, lines=lines))
+    return users
+
+
+class PlaySampler:
+    # Draws (user, song, played_at, duration) batches; every draw is a searchsorted
+    # on cumulative weights, so a batch costs O(n log n) whatever the catalog size
+    def __init__(self, rng, tenants, songs, users, days, end):
+        self.rng, self.tenants, self.songs = rng, tenants, songs
+        self.user_names = [name for u in users for name in u["names"]]
+        self.user_tenant = np.concatenate([np.full(len(u["names"]), t) for t, u in enumerate(users)])
+        self.user_premium = np.concatenate([u["premium"] for u in users])
+        self.user_cum = np.cumsum(rng.permutation(zipf_weights(len(self.user_names), LISTENER_SKEW)))
+
+        # per tenant: song popularity by random rank; free pool zeroes the premium songs
+        self.pools = []
+        for s in songs:
+            weights = rng.permutation(zipf_weights(len(s["ids"]), SONG_SKEW))
+            all_cum = np.cumsum(weights)
+            free_cum = np.cumsum(np.where(s["premium"], 0.0, weights))
+            self.pools.append((free_cum if free_cum[-1] > 0 else all_cum, all_cum))
+
+        self.start = datetime.combine(end - timedelta(days=days - 1), datetime.min.time(), tzinfo=timezone.utc)
+        weekday = np.array([WEEKLY[(self.start + timedelta(days=d)).weekday()] for d in range(days)])
+        self.day_cum = np.cumsum(weekday)
+        self.hour_cum = np.cumsum(np.array(DIURNAL, dtype=np.float64))
+
+    def _draw(self, cum, n):
+        return np.searchsorted(cum, self.rng.random(n) * cum[-1], side="right")
+
+    def batch(self, n):
+        user = self._draw(self.user_cum, n)
+        tenant = self.user_tenant[user]
+        premium = self.user_premium[user]
+        song_row = np.zeros(n, dtype=np.int64)
+        for t in np.unique(tenant):
+            for access in (False, True):
+                mask = (tenant == t) & (premium == access)
+                if mask.any():
+                    song_row[mask] = self._draw(self.pools[t][int(access)], int(mask.sum()))
+
+        day = self._draw(self.day_cum, n)
+        hour = self._draw(self.hour_cum, n)
+        seconds = day * 86400 + hour * 3600 + self.rng.integers(0, 3600, n)
+        played_at = (np.datetime64(self.start.replace(tzinfo=None), "s") + seconds.astype("timedelta64[s]")).astype(str)
+        skip = self.rng.random(n) < SKIP_SHARE
+
+        lines = []
+        for u, t, r, at, sk, frac in zip(user, tenant, song_row, played_at, skip, self.rng.random(n)):
+            song = self.songs[t]
+            length = int(song["length"][r])
+            duration = int(5 + frac * (length - 5)) if sk else length
+            lines.append(f"{self.user_names[u]},{song['ids'][r]},{at}+00,{duration},{self.tenants[t][0]}")
+        return lines
+
+
+# ── database steps ───────────────────────────────────────────────────────────
+def reset(cur):
+    cur.execute("SELECT tenant_id FROM tenants WHERE location = %s", (BENCH_LOCATION,))
+    ids = [row[0] for row in cur.fetchall()]
+    if ids:
+        for table in ("play_history", "user_recommendations", "age_candidate_pools", "age_pool_state",
+                      "users", "songs", "tenants"):
+            cur.execute(f"DELETE FROM {table} WHERE tenant_id = ANY(%s::uuid[])", (ids,))
+    return len(ids)
+
+
+def ensure_partitions(cur, start, end):
+    month = start.replace(day=1)
+    while month <= end:
+        cur.execute("SELECT create_play_history_partition(%s)", (month,))
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def refresh_derived(cur, tenants):
+    # Triggers were off during the load: rebuild what they would have maintained
+    cur.execute("SELECT rebuild_play_rollups()")
+    cur.execute("SELECT * FROM reconcile_song_stats(TRUE)")
+    cur.fetchall()
+    for tenant_id, _ in tenants:
+        cur.execute("""
+            INSERT INTO age_pool_state (tenant_id, stale) VALUES (%s, TRUE)
+            ON CONFLICT (tenant_id) DO UPDATE SET stale = TRUE
+        """, (tenant_id,))
+    cur.execute("ANALYZE tenants, songs, users, play_history")
+
+
+def generate(conn, scale, seed, days, end, do_reset):
+    rng = np.random.default_rng(seed)
+    results = []
+
+    def step(label, rows, fn):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        results.append([label, f"{rows:,}", round(elapsed, 2), f"{round(rows / elapsed) if elapsed else 0:,}"])
+
+    with conn.cursor() as cur:
+        cur.execute("SET TIME ZONE 'UTC'")
+        if do_reset:
+            print(f"Removed {reset(cur)} generated tenant(s)")
+        cur.execute("SELECT COUNT(*) FROM tenants WHERE location = %s", (BENCH_LOCATION,))
+        if cur.fetchone()[0]:
+            raise SystemExit("generated tenants already exist - re-run with --reset")
+
+        tenants = make_tenants(scale["tenants"])
+        shares = zipf_weights(len(tenants), TENANT_SKEW)
+        songs_per = split(scale["songs"], shares, rng)
+        users_per = split(scale["users"], shares, rng)
+
+        cur.execute("SELECT GREATEST(COALESCE(MAX(song_id), 0), (SELECT last_value FROM songs_song_id_seq)) FROM songs")
+        first_id = cur.fetchone()[0] + 1
+        songs = make_songs(rng, tenants, songs_per, first_id)
+        users = make_users(rng, tenants, users_per)
+        ensure_partitions(cur, end - timedelta(days=days - 1), end)
+
+        cur.execute("SET session_replication_role = replica")
+        try:
+            step("tenants", len(tenants), lambda: copy_rows(
+                cur, "tenants", ["tenant_id", "name", "location"],
+                [f"{tenant_id},{name},{BENCH_LOCATION}" for tenant_id, name in tenants]))
+            step("songs", scale["songs"], lambda: [copy_rows(
+                cur, "songs", ["song_id", "title", "artist", "genre", "rating", "is_premium", "added_by", "tenant_id"],
+                s["lines"]) for s in songs])
+            cur.execute("SELECT setval('songs_song_id_seq', %s)", (first_id + scale["songs"] - 1,))
+            step("users", scale["users"], lambda: [copy_rows(
+                cur, "users", ["user_name", "full_name", "age", "password_hash", "role_type", "tenant_id"],
+                u["lines"]) for u in users])
+
+            sampler = PlaySampler(rng, tenants, songs, users, days, end)
+
+            def load_plays():
+                left = scale["plays"]
+                while left > 0:
+                    n = min(BATCH_ROWS, left)
+                    copy_rows(cur, "play_history", ["user_name", "song_id", "played_at", "listen_duration", "tenant_id"],
+                              sampler.batch(n))
+                    left -= n
+            step("play_history", scale["plays"], load_plays)
+        finally:
+            cur.execute("SET session_replication_role = DEFAULT")
+
+        step("rollups + summaries", scale["plays"], lambda: refresh_derived(cur, tenants))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-tenant dataset")
+    parser.add_argument("--dsn", default=BENCH_DSN)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--tenants", type=int, help="override the scale's tenant count")
+    parser.add_argument("--songs", type=int, help="override the scale's song count")
+    parser.add_argument("--users", type=int, help="override the scale's user count")
+    parser.add_argument("--plays", type=int, help="override the scale's play count")
+    parser.add_argument("--days", type=int, default=90, help="days of plays, the last one being --end")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last day of plays (UTC)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="delete previously generated tenants first")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    if scale["songs"] < scale["tenants"] or scale["users"] < scale["tenants"]:
+        raise SystemExit("need at least one song and one user per tenant")
+
+    conn = connect(args.dsn, autocommit=False)
+    try:
+        results = generate(conn, scale, args.seed, args.days, args.end, args.reset)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"seed {args.seed}, plays {args.end - timedelta(days=args.days - 1)} .. {args.end} UTC")
+    print_table(["step", "rows", "seconds", "rows/s"], results)
+
+
+if __name__ == "__main__":
+    main()
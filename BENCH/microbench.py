@@ -0,0 +1,328 @@
+# microbench.py
+# Per-function microbenchmarks under every role, with an EXPLAIN plan regression guard.
+# Requirements: pip install psycopg2-binary numpy
+#
+#   python BENCH/microbench.py --size small --generate --update-baseline   # record a baseline
+#   python BENCH/microbench.py --size small                                # exit 1 on regressions
+#   python BENCH/microbench.py --size medium --only top_leaderboard,this_week_famous --plans-dir plans/
+#
+# Runs each SQL function in FUNCTIONS under appuser, adminn, listener_free and
+# listener_premium (identity set like db_pool.py does), against the
+# biggest generated tenant (generate_dataset.py; --generate rebuilds it at
+# --size first). Every call runs in its own transaction and is rolled back,
+# so writers like record_song_play() leave no trace.
+#
+# Timing runs have auto_explain off. One more run per function and role has
+# auto_explain on (ANALYZE, BUFFERS, nested statements, JSON, sent to the
+# client as NOTICEs), which is how the plans *inside* plpgsql and
+# non-inlined SQL functions are seen - a plain EXPLAIN only shows a Function
+# Scan. Against the baseline for the same --size, a run fails when
+#   - a relation of at least SEQ_SCAN_MIN_ROWS rows is now seq-scanned and
+#     was not before (a plan flip),
+#   - the median is more than --threshold slower and --min-delta-ms worse,
+#   - a call that used to succeed now errors.
+# Roles a function is not granted to show up as "denied" and are not failures.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import date
+
+from common import BENCH_DSN, connect, percentile, print_table
+
+import generate_dataset
+
+ROLES = ["appuser", "adminn", "listener_free", "listener_premium"]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json")
+SEQ_SCAN_MIN_ROWS = 10_000
+SCAN_NODES = {"Seq Scan", "Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+# label -> SQL; %(name)s parameters come from the role's context (see contexts())
+FUNCTIONS = {
+    "get_avg_rating_per_genre":      "SELECT * FROM get_avg_rating_per_genre()",
+    "listener_genre_counts":         "SELECT * FROM listener_genre_counts()",
+    "premium_recommendation":        "SELECT * FROM premium_recommendation(6)",
+    "get_listener_profiles":         "SELECT * FROM get_listener_profiles()",
+    "top_leaderboard":               "SELECT * FROM top_leaderboard()",
+    "get_age_based_recommendations": "SELECT * FROM get_age_based_recommendations(%(age)s, 12)",
+    "this_week_famous":              "SELECT * FROM this_week_famous()",
+    "popular_genres":                "SELECT * FROM popular_genres()",
+    "popular_artists":               "SELECT * FROM popular_artists()",
+    "tenant_dashboard_snapshot":     "SELECT tenant_dashboard_snapshot()",
+    "rating_histogram":              "SELECT * FROM rating_histogram(20)",
+    "search_songs":                  "SELECT * FROM search_songs('love', 'all', 20, NULL, NULL, FALSE)",
+    "search_songs_fuzzy":            "SELECT * FROM search_songs('midnite', 'title', 20, NULL, NULL, FALSE)",
+    "song_premium_flags":            "SELECT * FROM song_premium_flags()",
+    "my_listening_stats":            "SELECT * FROM my_listening_stats()",
+    "trending_seed":                 "SELECT * FROM trending_seed(240)",
+    "my_recommendations":            "SELECT * FROM my_recommendations(12)",
+    "record_song_play":              "SELECT record_song_play(%(song_id)s, 180)",
+    "add_song":                      "SELECT add_song('Microbench Song', 'Microbench', 'Pop', 3.5, FALSE)",
+}
+
+AUTO_EXPLAIN_ON = [
+    "SET LOCAL auto_explain.log_min_duration = 0",
+    "SET LOCAL auto_explain.log_analyze = on",
+    "SET LOCAL auto_explain.log_buffers = on",
+    "SET LOCAL auto_explain.log_nested_statements = on",
+    "SET LOCAL auto_explain.log_format = json",
+    "SET LOCAL auto_explain.log_level = notice",
+]
+
+# db_pool.py's identity replay, transaction-local so the rollback undoes it
+IDENTITY_SQL = """
+    SELECT set_config('role', %(role)s, true),
+           set_config('app.current_tenant', %(tenant_id)s, true),
+           set_config('app.current_username', %(username)s, true)
+"""
+
+_PARTITION_RE = re.compile(r"^(play_history)_(y\d{4}m\d{2}|default)$")
+
+
+# ── setup ────────────────────────────────────────────────────────────────────
+def pick_tenant(cur):
+    cur.execute("""
+        SELECT t.tenant_id::text, COUNT(s.song_id)
+        FROM tenants t JOIN songs s ON s.tenant_id = t.tenant_id
+        WHERE t.location = %s
+        GROUP BY t.tenant_id
+        ORDER BY 2 DESC, 1
+        LIMIT 1
+    """, (generate_dataset.BENCH_LOCATION,))
+    row = cur.fetchone()
+    if not row:
+        raise SystemExit("no generated tenants - run with --generate or BENCH/generate_dataset.py first")
+    return row[0]
+
+
+def dataset_fingerprint(cur, tenant_id):
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM songs WHERE tenant_id = %(t)s),
+               (SELECT COUNT(*) FROM users WHERE tenant_id = %(t)s),
+               (SELECT COALESCE(SUM(plays), 0) FROM play_song_daily WHERE tenant_id = %(t)s)
+    """, {"t": tenant_id})
+    songs, users, plays = cur.fetchone()
+    return {"songs": songs, "users": users, "plays": int(plays)}
+
+
+def contexts(cur, tenant_id):
+    # role -> identity + parameters; listeners are real users of the tenant
+    cur.execute("""
+        SELECT DISTINCT ON (role_type) role_type, user_name, age
+        FROM users WHERE tenant_id = %s
+        ORDER BY role_type, user_name
+    """, (tenant_id,))
+    listeners = {role: (name, age) for role, name, age in cur.fetchall()}
+    cur.execute("SELECT MIN(song_id) FROM songs WHERE tenant_id = %s AND is_premium IS FALSE", (tenant_id,))
+    free_song = cur.fetchone()[0]
+
+    result = {}
+    for role in ROLES:
+        username, age = listeners.get(role, (role, 30))
+        result[role] = {"role": role, "tenant_id": tenant_id, "username": username,
+                        "age": age, "song_id": free_song}
+    return result
+
+
+# ── one call ─────────────────────────────────────────────────────────────────
+def call(conn, sql, ctx, explain=False):
+    # -> (seconds, error or None); always rolled back
+    del conn.notices[:]
+    with conn.cursor() as cur:
+        try:
+            if explain:
+                for statement in AUTO_EXPLAIN_ON:
+                    cur.execute(statement)
+            cur.execute(IDENTITY_SQL, ctx)
+            started = time.perf_counter()
+            cur.execute(sql, ctx)
+            rows = cur.fetchall()
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            conn.rollback()
+            if getattr(e, "pgcode", None) == "42501":
+                return None, "denied"
+            return None, f"error: {str(e).strip().splitlines()[0]}"
+    conn.rollback()
+    # plpgsql writers report failures as text instead of raising
+    if len(rows) == 1 and isinstance(rows[0][0], str) and rows[0][0].lower().startswith("error"):
+        return elapsed, f"error: {rows[0][0]}"
+    return elapsed, None
+
+
+def captured_plans(conn):
+    plans = []
+    for notice in conn.notices:
+        if "plan:" in notice and "{" in notice:
+            plan = json.loads(notice[notice.index("{"):])
+            if "set_config('role'" not in plan.get("Query Text", ""):
+                plans.append(plan)
+    return plans
+
+
+def summarize_plans(cur, plans):
+    # -> ({relation: sorted scan types}, shared buffers of the top-level call, {relation: rows})
+    scans, raw_names = {}, set()
+
+    def walk(node):
+        if node.get("Node Type") in SCAN_NODES and node.get("Relation Name"):
+            raw_names.add(node["Relation Name"])
+            name = _PARTITION_RE.sub(r"\1", node["Relation Name"])
+            scans.setdefault(name, set()).add(node["Node Type"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    for plan in plans:
+        walk(plan["Plan"])
+    top = plans[-1]["Plan"] if plans else {}
+    buffers = top.get("Shared Hit Blocks", 0) + top.get("Shared Read Blocks", 0)
+
+    rows = {}
+    if raw_names:
+        cur.execute("SELECT relname, GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = ANY(%s)",
+                    (sorted(raw_names),))
+        for relname, tuples in cur.fetchall():
+            name = _PARTITION_RE.sub(r"\1", relname)
+            rows[name] = rows.get(name, 0) + tuples
+    return {name: sorted(types) for name, types in sorted(scans.items())}, buffers, rows
+
+
+def bench(conn, label, sql, ctx, repeat, plans_dir):
+    samples, error = [], None
+    for i in range(repeat + 1):                 # first run is warmup
+        elapsed, error = call(conn, sql, ctx)
+        if error:
+            return {"status": "denied" if error == "denied" else "error", "detail": error}
+        if i:
+            samples.append(elapsed)
+
+    call(conn, sql, ctx, explain=True)
+    plans = captured_plans(conn)
+    conn.rollback()
+    with conn.cursor() as cur:
+        scans, buffers, rows = summarize_plans(cur, plans)
+    conn.rollback()
+    if plans_dir:
+        with open(os.path.join(plans_dir, f"{label}.{ctx['role']}.json"), "w") as f:
+            json.dump(plans, f, indent=2)
+
+    ordered = sorted(samples)
+    return {
+        "status": "ok",
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "buffers": buffers,
+        "scans": scans,
+        "rows": rows,
+    }
+
+
+# ── regression checks ────────────────────────────────────────────────────────
+def regressions(current, baseline, threshold, min_delta_ms):
+    if not baseline:
+        return []
+    if current["status"] != "ok":
+        return ["now fails: " + current["detail"]] if baseline["status"] == "ok" else []
+    if baseline["status"] != "ok":
+        return []
+
+    problems = []
+    for relation, types in current["scans"].items():
+        was = baseline["scans"].get(relation, [])
+        if "Seq Scan" in types and "Seq Scan" not in was and current["rows"].get(relation, 0) >= SEQ_SCAN_MIN_ROWS:
+            problems.append(f"seq scan on {relation} (was {', '.join(was) or 'not scanned'})")
+    slower = current["median_ms"] - baseline["median_ms"]
+    if current["median_ms"] > baseline["median_ms"] * (1 + threshold) and slower > min_delta_ms:
+        problems.append(f"median {baseline['median_ms']} -> {current['median_ms']} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQL function microbenchmarks with plan regression guard")
+    parser.add_argument("--dsn", default=BENCH_DSN, help="superuser connection (auto_explain, role switching)")
+    parser.add_argument("--size", choices=sorted(generate_dataset.SCALES), default="small",
+                        help="dataset size the baseline belongs to")
+    parser.add_argument("--generate", action="store_true", help="regenerate the dataset at --size first")
+    parser.add_argument("--seed", type=int, default=42, help="dataset seed for --generate")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per function and role")
+    parser.add_argument("--only", help="comma-separated function labels")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the --size baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed median slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore slowdowns smaller than this")
+    parser.add_argument("--plans-dir", help="write every captured plan here as JSON")
+    args = parser.parse_args()
+
+    labels = [label.strip() for label in args.only.split(",")] if args.only else list(FUNCTIONS)
+    unknown = set(labels) - set(FUNCTIONS)
+    if unknown:
+        raise SystemExit(f"unknown function label(s): {', '.join(sorted(unknown))}")
+    if args.plans_dir:
+        os.makedirs(args.plans_dir, exist_ok=True)
+
+    conn = connect(args.dsn, autocommit=False)
+    if args.generate:
+        generate_dataset.generate(conn, generate_dataset.SCALES[args.size], args.seed, 90, date.today(), True)
+        conn.commit()
+
+    with conn.cursor() as cur:
+        tenant_id = pick_tenant(cur)
+        fingerprint = dataset_fingerprint(cur, tenant_id)
+        ctxs = contexts(cur, tenant_id)
+        # pools are rebuilt lazily on first use; build them now so no timed run does it
+        cur.execute("SELECT refresh_age_pools(%s)", (tenant_id,))
+    conn.commit()
+    conn.autocommit = True
+    conn.cursor().execute("LOAD 'auto_explain'")
+    conn.autocommit = False
+    conn.notices = []
+
+    baseline_all = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline_all = json.load(f)
+    baseline = baseline_all.get(args.size, {})
+    if baseline and baseline.get("dataset") != fingerprint:
+        print(f"warning: dataset {fingerprint} differs from the baseline's {baseline.get('dataset')}",
+              file=sys.stderr)
+
+    results, rows, failures = {}, [], 0
+    for label in labels:
+        results[label] = {}
+        for role in ROLES:
+            current = bench(conn, label, FUNCTIONS[label], ctxs[role], args.repeat, args.plans_dir)
+            results[label][role] = current
+            problems = regressions(current, baseline.get("functions", {}).get(label, {}).get(role),
+                                   args.threshold, args.min_delta_ms)
+            failures += bool(problems)
+            seq = [r for r, types in current.get("scans", {}).items() if "Seq Scan" in types]
+            rows.append([label, role, current.get("median_ms", current["status"]), current.get("p95_ms", ""),
+                         current.get("buffers", ""), ", ".join(seq) or "-",
+                         "; ".join(problems) or ("ok" if current["status"] == "ok" else current["status"])])
+    conn.close()
+
+    print(f"dataset {args.size}: tenant {tenant_id} {fingerprint}")
+    print_table(["function", "role", "median ms", "p95 ms", "buffers", "seq scans", "check"], rows)
+
+    if args.update_baseline:
+        baseline_all[args.size] = {"dataset": fingerprint, "functions": results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline_all, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {args.size} written to {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"No {args.size} baseline in {args.baseline} yet - run with --update-baseline")
+        return 0
+    if failures:
+        print(f"{failures} regression(s)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+# workload.py
+# Concurrent workload driver: many listeners, appusers and admins across tenants,
+# calling the same SQL entry points as the apps, through the app's connection pool.
+# Requirements: pip install psycopg2-binary
+#
+#   python BENCH/workload.py --workers 32 --duration 60 --out run.json
+#   python BENCH/workload.py --rate 500 --roles listener=95,appuser=4,admin=1
+#   python BENCH/workload.py --mix play=60,search=0 --compare run.json
+#
+# Each worker thread is one virtual user: it picks a role by --roles, then runs
+# that role's operations in MIX proportions (--mix overrides any weight, 0
+# disables). --rate paces all workers together at that many ops/s; without it
+# they run closed-loop. Operations in the first --warmup seconds are not counted.
+#
+# Listeners are sampled from users with --password (the generated dataset's
+# "bench", see generate_dataset.py) and logged in with user_login() up front.
+# Appuser and admin sessions get the identity the apps' login would give them.
+#
+# The JSON report (stdout, or --out) has count, errors, throughput and
+# p50/p95/p99/max latency per operation, so two runs can be diffed directly;
+# --compare prints the p50/p95/p99 change against an earlier report.
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from common import percentile, print_table, use_app_modules
+
+use_app_modules()
+import browse  # noqa: E402
+import catalog_search  # noqa: E402
+import db_pool  # noqa: E402
+import identity_context  # noqa: E402
+from identity_context import IdentityContext  # noqa: E402
+
+# role -> {operation: weight}
+MIX = {
+    "listener": {"play": 40, "browse": 20, "search": 15, "this_week_famous": 10,
+                 "age_recommendations": 8, "premium_recommendation": 5, "login": 2},
+    "appuser":  {"browse": 40, "search": 30, "leaderboard": 20, "this_week_famous": 10},
+    "admin":    {"leaderboard": 50, "browse": 25, "search": 25},
+}
+DEFAULT_ROLES = "listener=90,appuser=8,admin=2"
+
+SEARCH_TERMS = ["love", "midnight", "heart", "river", "golden", "summer", "drem", "pop", "rock", "jazz",
+                "ghazal", "artist", "moon", "light", "shadow"]
+SEARCH_FIELDS = ["all", "all", "title", "artist", "genre"]
+ERROR_SAMPLES = 3
+
+
+# ── sessions ─────────────────────────────────────────────────────────────────
+def load_sessions(pool, password, listeners, seed):
+    # Logs in up to `listeners` users and loads each of their tenants' song ids
+    with pool.checkout(None) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT user_name FROM users
+                WHERE password_hash = %s
+                ORDER BY md5(user_name || %s)
+                LIMIT %s
+            """, (password, str(seed), listeners))
+            names = [row[0] for row in cur.fetchall()]
+    if not names:
+        raise SystemExit("no users with that password - generate a dataset first (BENCH/generate_dataset.py)")
+
+    sessions, songs = [], {}
+    for name in names:
+        result, session = pool.login(name, password)
+        if session is None:
+            raise SystemExit(f"login failed for {name}: {result}")
+        identity = identity_context.load(pool, session)
+        if identity.tenant_id not in songs:
+            with pool.checkout(identity) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT song_id, is_premium FROM song_premium_flags()")
+                    rows = cur.fetchall()
+            songs[identity.tenant_id] = ([s for s, premium in rows if not premium], [s for s, _ in rows])
+        sessions.append(identity)
+    return sessions, songs
+
+
+def parse_weights(text):
+    weights = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, value = part.partition("=")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+# ── operations: (pool, identity, rng, ctx) -> None, raise on error ───────────
+def op_login(pool, identity, rng, ctx):
+    result, session = pool.login(identity.username, ctx["password"])
+    if session is None:
+        raise RuntimeError(result)
+
+
+def op_play(pool, identity, rng, ctx):
+    free_ids, all_ids = ctx["songs"][identity.tenant_id]
+    ids = all_ids if identity.is_premium else free_ids
+    if not ids:
+        return
+    with pool.checkout(identity) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT record_song_play(%s, %s)", (rng.choice(ids), rng.randint(30, 300)))
+            result = cur.fetchone()[0]
+    if result.lower().startswith("error"):
+        raise RuntimeError(result)
+
+
+def op_browse(pool, identity, rng, ctx):
+    premium = None if identity.db_role != "listener_free" else False
+    with pool.checkout(identity) as conn:
+        with conn.cursor() as cur:
+            rows, next_cursor = browse.browse_page(cur, rng.choice(list(browse.BROWSE_SORTS)),
+                                                   identity.tenant_id, premium=premium)
+            if next_cursor and rng.random() < 0.3:
+                browse.browse_page(cur, rng.choice(list(browse.BROWSE_SORTS)), identity.tenant_id,
+                                   premium=premium, after=next_cursor)
+
+
+def op_search(pool, identity, rng, ctx):
+    with pool.checkout(identity) as conn:
+        with conn.cursor() as cur:
+            catalog_search.search_songs(cur, rng.choice(SEARCH_TERMS), rng.choice(SEARCH_FIELDS),
+                                        own_only=(identity.db_role == "appuser"))
+
+
+def _query(sql, params_fn=lambda identity: None):
+    def op(pool, identity, rng, ctx):
+        with pool.checkout(identity) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params_fn(identity))
+                cur.fetchall()
+    return op
+
+
+OPERATIONS = {
+    "login":                  op_login,
+    "play":                   op_play,
+    "browse":                 op_browse,
+    "search":                 op_search,
+    "this_week_famous":       _query("SELECT * FROM this_week_famous()"),
+    "age_recommendations":    _query("SELECT * FROM get_age_based_recommendations(%s)", lambda i: (i.age,)),
+    "premium_recommendation": _query("SELECT * FROM premium_recommendation(6)"),
+    "leaderboard":            _query("SELECT * FROM top_leaderboard()"),
+}
+
+
+# ── driver ───────────────────────────────────────────────────────────────────
+def role_mix(role, identity, overrides):
+    weights = dict(MIX[role])
+    if role == "listener" and not identity.is_premium:
+        weights.pop("premium_recommendation")   # the apps only offer it to premium listeners
+    for name, weight in overrides.items():
+        if name in weights:
+            weights[name] = weight
+    return [(name, weight) for name, weight in weights.items() if weight > 0]
+
+
+def worker(index, args, pool, ctx, deadline, counted_from, samples, errors, lock):
+    rng = random.Random(args.seed * 1000 + index)
+    roles = [(role, weight) for role, weight in ctx["roles"].items() if weight > 0]
+    interval = args.workers / args.rate if args.rate else 0.0
+    next_at = time.perf_counter() + rng.random() * interval
+    local, local_errors = defaultdict(list), defaultdict(list)
+
+    while True:
+        if interval:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+
+        role = rng.choices([r for r, _ in roles], [w for _, w in roles])[0]
+        if role == "listener":
+            identity = rng.choice(ctx["sessions"])
+        elif role == "appuser":
+            identity = IdentityContext("appuser", "appuser", rng.choice(ctx["tenants"]), None, False, None)
+        else:
+            identity = IdentityContext("adminn", "adminn", None, None, False, None)
+        mix = role_mix(role, identity, ctx["mix"])
+        if not mix:
+            continue
+        name = rng.choices([n for n, _ in mix], [w for _, w in mix])[0]
+
+        started = time.perf_counter()
+        error = None
+        try:
+            OPERATIONS[name](pool, identity, rng, ctx)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}".strip()
+        elapsed = time.perf_counter() - started
+        if started >= counted_from:
+            local[name].append(elapsed)
+            if error:
+                local_errors[name].append(error)
+
+    with lock:
+        for name, values in local.items():
+            samples[name].extend(values)
+        for name, values in local_errors.items():
+            errors[name].extend(values)
+
+
+def report(samples, errors, measured_s):
+    operations = {}
+    for name in sorted(set(samples) | set(errors)):
+        ordered = sorted(samples[name])
+        operations[name] = {
+            "count":        len(ordered),
+            "errors":       len(errors[name]),
+            "ops_per_s":    round(len(ordered) / measured_s, 1),
+            "p50_ms":       round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms":       round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms":       round(percentile(ordered, 0.99) * 1000, 2),
+            "max_ms":       round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            "error_samples": sorted(set(errors[name]))[:ERROR_SAMPLES],
+        }
+    everything = sorted(v for values in samples.values() for v in values)
+    total = {
+        "count":     len(everything),
+        "errors":    sum(len(v) for v in errors.values()),
+        "ops_per_s": round(len(everything) / measured_s, 1),
+        "p50_ms":    round(percentile(everything, 0.50) * 1000, 2),
+        "p95_ms":    round(percentile(everything, 0.95) * 1000, 2),
+        "p99_ms":    round(percentile(everything, 0.99) * 1000, 2),
+    }
+    return operations, total
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["operations"]
+    rows = []
+    for name, stats in current.items():
+        old = baseline.get(name)
+        if not old:
+            rows.append([name, "new", "", ""])
+            continue
+        rows.append([name] + [f"{old[k]} -> {stats[k]} ({(stats[k] - old[k]) / old[k] * 100:+.0f}%)" if old[k]
+                              else f"{old[k]} -> {stats[k]}" for k in ("p50_ms", "p95_ms", "p99_ms")])
+    print_table(["operation", "p50 ms", "p95 ms", "p99 ms"], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent app workload with per-operation latency")
+    parser.add_argument("--dsn", help="libpq string for the pool (default: the app's app_login settings)")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds run before measuring")
+    parser.add_argument("--rate", type=float, default=0.0, help="total ops/s across workers (0 = closed loop)")
+    parser.add_argument("--roles", default=DEFAULT_ROLES, help="role weights, e.g. listener=90,appuser=8,admin=2")
+    parser.add_argument("--mix", default="", help="operation weight overrides, e.g. play=60,search=0")
+    parser.add_argument("--listeners", type=int, default=200, help="listener sessions logged in up front")
+    parser.add_argument("--password", default="bench", help="password of the sampled listeners")
+    parser.add_argument("--pool-size", type=int, help="pool max size (default: --workers)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare latencies with")
+    args = parser.parse_args()
+
+    pool_size = args.pool_size or args.workers
+    connect_kwargs = {"dsn": args.dsn} if args.dsn else {}
+    pool = db_pool.TenantConnectionPool(min_size=min(pool_size, db_pool.POOL_MIN_SIZE), max_size=pool_size,
+                                        **connect_kwargs)
+    sessions, songs = load_sessions(pool, args.password, args.listeners, args.seed)
+    ctx = {"sessions": sessions, "songs": songs, "tenants": sorted(songs), "password": args.password,
+           "roles": parse_weights(args.roles), "mix": parse_weights(args.mix)}
+    unknown = (set(ctx["roles"]) - set(MIX)) | (set(ctx["mix"]) - set(OPERATIONS))
+    if unknown:
+        raise SystemExit(f"unknown role/operation: {', '.join(sorted(unknown))}")
+
+    samples, errors, lock = defaultdict(list), defaultdict(list), threading.Lock()
+    started = time.perf_counter()
+    counted_from = started + args.warmup
+    deadline = counted_from + args.duration
+    threads = [threading.Thread(target=worker, name=f"workload-{i}",
+                                args=(i, args, pool, ctx, deadline, counted_from, samples, errors, lock))
+               for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    measured_s = time.perf_counter() - counted_from
+    pool_stats = pool.stats()
+    pool.close()
+
+    operations, total = report(samples, errors, measured_s)
+    config = {k: getattr(args, k) for k in ("workers", "duration", "warmup", "rate", "roles", "mix",
+                                            "listeners", "seed")}
+    config.update(pool_size=pool_size, tenants=len(songs))
+    result = {
+        "config": config,
+        "operations": operations,
+        "total": total,
+        "pool": pool_stats,
+    }
+
+    # human-readable summary on stderr, JSON on stdout (or --out) for diffing
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        print_table(["operation", "count", "errors", "ops/s", "p50 ms", "p95 ms", "p99 ms"],
+                    [[name, s["count"], s["errors"], s["ops_per_s"], s["p50_ms"], s["p95_ms"], s["p99_ms"]]
+                     for name, s in operations.items()]
+                    + [["(all)", total["count"], total["errors"], total["ops_per_s"],
+                        total["p50_ms"], total["p95_ms"], total["p99_ms"]]])
+        if args.compare:
+            print()
+            compare(operations, args.compare)
+    finally:
+        sys.stdout = stdout
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
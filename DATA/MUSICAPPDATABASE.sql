@@ -27,6 +27,16 @@ DO $$ BEGIN
  GRANT CONNECT ON DATABASE backup TO appuser,adminn,listener_free,listener_premium;
 GRANT USAGE ON SCHEMA public TO appuser,adminn,listener_free,listener_premium;
 
+--PER-ROLE TIMEOUTS (direct logins; pooled sessions get the same profile from APP/watchdog.py ROLE_PROFILES)
+ALTER ROLE listener_free    SET statement_timeout = '5s';
+ALTER ROLE listener_free    SET idle_in_transaction_session_timeout = '10s';
+ALTER ROLE listener_premium SET statement_timeout = '5s';
+ALTER ROLE listener_premium SET idle_in_transaction_session_timeout = '10s';
+ALTER ROLE appuser          SET statement_timeout = '15s';
+ALTER ROLE appuser          SET idle_in_transaction_session_timeout = '30s';
+ALTER ROLE adminn           SET statement_timeout = '120s';
+ALTER ROLE adminn           SET idle_in_transaction_session_timeout = '60s';
+
 --TABLE--
  --1.Tenants table
 CREATE TABLE tenants (
@@ -59,21 +69,25 @@ REFERENCES tenants(tenant_id)
 DROP TABLE IF EXISTS premium_subscription CASCADE;
 DROP TABLE IF EXISTS listener_profiles CASCADE;
 
---3.play_history table
+--3.play_history table (range-partitioned by month on played_at, see function 21)
 CREATE TABLE play_history(
- history_id         SERIAL PRIMARY KEY,
+ history_id         SERIAL,
  user_name          TEXT  NOT NULL,
  song_id            INTEGER NOT NULL,
- played_at          TIMESTAMPTZ DEFAULT NOW(),
+ played_at          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
  listen_duration    INTEGER CHECK (listen_duration>=0),
  tenant_id          UUID NOT NULL,
+ PRIMARY KEY(history_id, played_at),
 FOREIGN KEY(user_name)
 REFERENCES listener_profiles(user_name) ON DELETE CASCADE,
 FOREIGN KEY(song_id)
 REFERENCES songs (song_id) ON DELETE CASCADE,
 FOREIGN KEY(tenant_id)
 REFERENCES tenants (tenant_id) ON DELETE CASCADE
- );
+ ) PARTITION BY RANGE (played_at);
+
+-- catches plays outside the pre-created months until a partition exists for them
+CREATE TABLE play_history_default PARTITION OF play_history DEFAULT;
 
 --4.playlist_members
 CREATE TABLE IF NOT EXISTS playlist_members(
@@ -112,8 +126,194 @@ CREATE TABLE users(
  REFERENCES tenants(tenant_id) ON DELETE CASCADE
  );
 
+--7.play rollups (kept current by trg_play_history_rollups, function 22)
+-- bucket is the UTC hour / UTC day the plays fall in
+CREATE TABLE IF NOT EXISTS play_song_hourly(
+ tenant_id          UUID NOT NULL,
+ bucket             TIMESTAMPTZ NOT NULL,
+ song_id            INTEGER NOT NULL,
+ plays              BIGINT NOT NULL DEFAULT 0,
+ listen_seconds     BIGINT NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, bucket, song_id)
+ );
+
+CREATE TABLE IF NOT EXISTS play_song_daily(
+ tenant_id          UUID NOT NULL,
+ bucket             TIMESTAMPTZ NOT NULL,
+ song_id            INTEGER NOT NULL,
+ plays              BIGINT NOT NULL DEFAULT 0,
+ listen_seconds     BIGINT NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, bucket, song_id)
+ );
+
+CREATE TABLE IF NOT EXISTS play_user_daily(
+ tenant_id          UUID NOT NULL,
+ user_name          TEXT NOT NULL,
+ bucket             TIMESTAMPTZ NOT NULL,
+ plays              BIGINT NOT NULL DEFAULT 0,
+ listen_seconds     BIGINT NOT NULL DEFAULT 0,
+ rating_sum         NUMERIC NOT NULL DEFAULT 0,   -- song ratings at play time
+ rated_plays        BIGINT NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, user_name, bucket)
+ );
+
+-- one row per artist a user has played: COUNT(*) is "Unique Artists"
+CREATE TABLE IF NOT EXISTS play_user_artists(
+ tenant_id          UUID NOT NULL,
+ user_name          TEXT NOT NULL,
+ artist             VARCHAR(50) NOT NULL,
+ plays              BIGINT NOT NULL DEFAULT 0,
+ last_played_at     TIMESTAMPTZ,
+ PRIMARY KEY(tenant_id, user_name, artist)
+ );
+
+--8.user_recommendations (written in batch by APP/recommender.py, read by my_recommendations())
+CREATE TABLE IF NOT EXISTS user_recommendations(
+ tenant_id          UUID NOT NULL,
+ user_name          TEXT NOT NULL,
+ rank               SMALLINT NOT NULL,
+ song_id            INTEGER NOT NULL,
+ score              REAL NOT NULL,
+ generated_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+ PRIMARY KEY(tenant_id, user_name, rank),
+ FOREIGN KEY(song_id)
+ REFERENCES songs (song_id) ON DELETE CASCADE
+ );
+
+--9.age-group candidate pools (built by refresh_age_pools(), function 27)
+-- which genres each age group is recommended; edit rows here, not the function
+CREATE TABLE IF NOT EXISTS genre_age_groups(
+ age_group          TEXT NOT NULL CHECK(age_group IN ('kopila','phool','basanta')),
+ genre              VARCHAR(50) NOT NULL,
+ PRIMARY KEY(age_group, genre)
+ );
+
+INSERT INTO genre_age_groups (age_group, genre) VALUES
+ ('kopila', 'Pop'), ('kopila', 'Hip Hop'), ('kopila', 'Rock'), ('kopila', 'Rap'),
+ ('phool', 'Rock'), ('phool', 'Bollywood'), ('phool', 'Love'), ('phool', 'Indie'),
+ ('basanta', 'Classic'), ('basanta', 'Folk'), ('basanta', 'Country'), ('basanta', 'Jazz'), ('basanta', 'Ghazal')
+ON CONFLICT DO NOTHING;
+
+-- top-rated songs per tenant x age group ('all' = every genre) x access level;
+-- cum_weight is the running sum of weights in slot order, so one weighted
+-- draw is a single index probe
+CREATE TABLE IF NOT EXISTS age_candidate_pools(
+ tenant_id          UUID NOT NULL,
+ age_group          TEXT NOT NULL,
+ premium_access     BOOLEAN NOT NULL,
+ slot               INT NOT NULL,
+ song_id            INTEGER NOT NULL,
+ cum_weight         DOUBLE PRECISION NOT NULL,
+ PRIMARY KEY(tenant_id, age_group, premium_access, slot),
+ FOREIGN KEY(song_id)
+ REFERENCES songs (song_id) ON DELETE CASCADE
+ );
+
+-- a tenant without a row, or with stale = TRUE, is rebuilt on its next request
+CREATE TABLE IF NOT EXISTS age_pool_state(
+ tenant_id          UUID PRIMARY KEY,
+ stale              BOOLEAN NOT NULL DEFAULT TRUE,
+ refreshed_at       TIMESTAMPTZ
+ );
+
+--10.song summaries (kept current by the song_stats triggers, function 28)
+-- Split by is_premium so free listeners' view (is_premium = FALSE) is a filter,
+-- not a rescan; here is_premium means "is_premium IS NOT FALSE", as in RLS.
+-- Rows whose song_count dropped to 0 stay until reconcile_song_stats(TRUE).
+CREATE TABLE IF NOT EXISTS song_tenant_stats(
+ tenant_id          UUID NOT NULL,
+ is_premium         BOOLEAN NOT NULL,
+ song_count         BIGINT NOT NULL DEFAULT 0,
+ rated_songs        BIGINT NOT NULL DEFAULT 0,
+ rating_sum         NUMERIC NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, is_premium)
+ );
+
+CREATE TABLE IF NOT EXISTS song_genre_stats(
+ tenant_id          UUID NOT NULL,
+ genre              VARCHAR(60) NOT NULL,
+ is_premium         BOOLEAN NOT NULL,
+ song_count         BIGINT NOT NULL DEFAULT 0,
+ rated_songs        BIGINT NOT NULL DEFAULT 0,
+ rating_sum         NUMERIC NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, genre, is_premium)
+ );
+
+CREATE TABLE IF NOT EXISTS song_artist_stats(
+ tenant_id          UUID NOT NULL,
+ artist             VARCHAR(50) NOT NULL,
+ is_premium         BOOLEAN NOT NULL,
+ song_count         BIGINT NOT NULL DEFAULT 0,
+ rated_songs        BIGINT NOT NULL DEFAULT 0,
+ rating_sum         NUMERIC NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, artist, is_premium)
+ );
+
+CREATE TABLE IF NOT EXISTS song_uploader_stats(
+ tenant_id          UUID NOT NULL,
+ added_by           TEXT NOT NULL,
+ is_premium         BOOLEAN NOT NULL,
+ song_count         BIGINT NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, added_by, is_premium)
+ );
+
+-- bucket 0 = unrated, 1..20 = quarter-star bins (the Dashboard rating chart)
+CREATE TABLE IF NOT EXISTS song_rating_stats(
+ tenant_id          UUID NOT NULL,
+ is_premium         BOOLEAN NOT NULL,
+ bucket             SMALLINT NOT NULL,
+ song_count         BIGINT NOT NULL DEFAULT 0,
+ PRIMARY KEY(tenant_id, is_premium, bucket)
+ );
+
+--11.watchdog_events (cancels / terminations by APP/watchdog.py, read by the admin live view)
+CREATE TABLE IF NOT EXISTS watchdog_events(
+ event_id           BIGSERIAL PRIMARY KEY,
+ logged_at          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+ pid                INT NOT NULL,
+ db_role            TEXT,
+ tenant_id          UUID,
+ usename            TEXT,
+ state              TEXT,
+ runtime_s          NUMERIC(10,1),
+ action             TEXT NOT NULL CHECK (action IN ('cancel', 'terminate')),
+ applied            BOOLEAN,            -- NULL: dry run, FALSE: backend already gone
+ query              TEXT
+ );
+
+--12.query_snapshots (pg_stat_statements snapshots taken by APP/manage.py slow-report snapshot)
+CREATE TABLE IF NOT EXISTS query_snapshots(
+ snapshot_id        BIGSERIAL PRIMARY KEY,
+ taken_at           TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+ label              TEXT,               -- e.g. the deployed version
+ server_version     INT NOT NULL
+ );
+
+--13.query_snapshot_stats (cumulative counters per statement; reports diff consecutive snapshots)
+CREATE TABLE IF NOT EXISTS query_snapshot_stats(
+ snapshot_id        BIGINT NOT NULL REFERENCES query_snapshots(snapshot_id) ON DELETE CASCADE,
+ queryid            BIGINT NOT NULL,
+ db_role            TEXT NOT NULL,
+ toplevel           BOOLEAN NOT NULL,   -- FALSE: a statement run inside a function
+ query              TEXT NOT NULL,
+ query_group        TEXT,               -- app function it calls, e.g. 'search_songs()'; NULL = ad-hoc
+ calls              BIGINT NOT NULL,
+ total_ms           DOUBLE PRECISION NOT NULL,
+ rows               BIGINT NOT NULL,
+ shared_blks_hit    BIGINT NOT NULL,
+ shared_blks_read   BIGINT NOT NULL,
+ temp_blks_written  BIGINT NOT NULL,
+ plan               JSONB,              -- EXPLAIN (FORMAT JSON) for the snapshot's top offenders
+ plan_summary       TEXT,
+ plan_error         TEXT,
+ PRIMARY KEY(snapshot_id, queryid, db_role, toplevel)
+ );
+
 -----------------EXTENSION----------
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+-- needs shared_preload_libraries = 'pg_stat_statements' (and ideally pg_stat_statements.track = 'all')
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
 ----------RLS POLICY---
 --DROPPING POLICIES
 DO $$ 
@@ -214,30 +414,31 @@ CREATE POLICY playlist_members_default_deny ON playlist_members
  FOR ALL TO public USING (false);
 ---------------------------------------FUNCTION------------------------------------------------------
 
---2.get_avg_rating_per_genre
+--2.get_avg_rating_per_genre (from song_genre_stats; its RLS mirrors songs)
 CREATE OR REPLACE FUNCTION get_avg_rating_per_genre()
 RETURNS TABLE (genre_name VARCHAR, average_rating NUMERIC)
 LANGUAGE plpgsql
 AS $$
 BEGIN
     RETURN QUERY
-        SELECT genre, ROUND(AVG(rating), 1)
-        FROM songs
-        WHERE tenant_id = current_setting('app.current_tenant')::uuid
-        GROUP BY genre
+        SELECT g.genre, ROUND(SUM(g.rating_sum) / NULLIF(SUM(g.rated_songs), 0), 1)
+        FROM song_genre_stats g
+        WHERE g.tenant_id = current_setting('app.current_tenant')::uuid
+          AND g.song_count > 0
+        GROUP BY g.genre
         ORDER BY 2 DESC;
 END;
 $$;
----3.listener genre counts
+---3.listener genre counts (from song_genre_stats, free and premium songs alike)
 CREATE OR REPLACE FUNCTION listener_genre_counts()
 RETURNS TABLE(genre_name VARCHAR,song_count BIGINT )
 LANGUAGE sql SECURITY DEFINER 
 AS $$
-SELECT genre,COUNT(*)
-FROM songs
-WHERE tenant_id=current_setting('app.current_tenant')::uuid
-GROUP BY genre HAVING COUNT(*) >0
-ORDER BY COUNT(*) DESC;
+SELECT g.genre, SUM(g.song_count)::BIGINT
+FROM song_genre_stats g
+WHERE g.tenant_id=current_setting('app.current_tenant')::uuid
+GROUP BY g.genre HAVING SUM(g.song_count) >0
+ORDER BY 2 DESC;
 $$;
 ----4.premium_recommendation
 CREATE OR REPLACE FUNCTION premium_recommendation(limit_count INT DEFAULT 6)
@@ -295,7 +496,7 @@ EXCEPTION WHEN OTHERS THEN
     RETURN 'Error: ' || SQLERRM;
 END;
 $$;
---8.Top leaderboard
+--8.Top leaderboard (from song_uploader_stats)
 CREATE OR REPLACE FUNCTION top_leaderboard()
 RETURNS TABLE(
     uploader TEXT,
@@ -308,15 +509,16 @@ AS $$
 BEGIN
     RETURN QUERY
     SELECT 
-        s.added_by,
-        COUNT(s.song_id),
-        RANK() OVER (ORDER BY COUNT(s.song_id) DESC),
+        u.added_by,
+        SUM(u.song_count)::BIGINT,
+        RANK() OVER (ORDER BY SUM(u.song_count) DESC),
         t.name::TEXT   --  CAST FIX
-    FROM songs s
+    FROM song_uploader_stats u
     JOIN tenants t 
-         ON s.tenant_id = t.tenant_id
-    WHERE s.tenant_id = current_setting('app.current_tenant')::uuid
-    GROUP BY s.added_by, t.name
+         ON u.tenant_id = t.tenant_id
+    WHERE u.tenant_id = current_setting('app.current_tenant')::uuid
+      AND u.song_count > 0
+    GROUP BY u.added_by, t.name
     ORDER BY 3;
 END;
 $$;
@@ -381,7 +583,12 @@ END;
 $$ LANGUAGE plpgsql;
  
  ----------11.get_age_based_recommendations
-CREATE OR REPLACE FUNCTION get_age_based_recommendations()
+-- Draws from the precomputed candidate pool of the caller's tenant, age group
+-- and access level (function 27) instead of sorting the tenant's songs on every
+-- call: 3 x p_limit weighted draws, each one index probe on cum_weight.
+-- p_age skips the users lookup when the app already knows the caller's age.
+DROP FUNCTION IF EXISTS get_age_based_recommendations();
+CREATE OR REPLACE FUNCTION get_age_based_recommendations(p_age INT DEFAULT NULL, p_limit INT DEFAULT 12)
 RETURNS TABLE(
     title VARCHAR,
     artist VARCHAR,
@@ -391,13 +598,23 @@ RETURNS TABLE(
     recommended_for TEXT
 ) AS $$
 DECLARE
-    v_age INTEGER;
+    v_tenant UUID := current_setting('app.current_tenant', true)::uuid;
+    v_access BOOLEAN := current_user <> 'listener_free';
+    v_age INTEGER := p_age;
     v_group TEXT;
+    v_slots INTEGER;
+    v_total DOUBLE PRECISION;
 BEGIN
+    IF v_tenant IS NULL THEN
+        RETURN;
+    END IF;
+
     -- Get current logged-in user's age
-    SELECT age INTO v_age 
-    FROM users 
-    WHERE user_name = current_user;
+    IF v_age IS NULL THEN
+        SELECT u.age INTO v_age
+        FROM users u
+        WHERE u.user_name = COALESCE(NULLIF(current_setting('app.current_username', true), ''), current_user);
+    END IF;
 
     -- Auto classify age group
     v_group := CASE 
@@ -407,7 +624,44 @@ BEGIN
         ELSE 'basanta'
     END;
 
+    -- Rebuilds this tenant's pools only if songs changed since the last build
+    PERFORM ensure_age_pools();
+
+    SELECT p.slot, p.cum_weight INTO v_slots, v_total
+    FROM age_candidate_pools p
+    WHERE p.tenant_id = v_tenant AND p.age_group = v_group AND p.premium_access = v_access
+    ORDER BY p.slot DESC
+    LIMIT 1;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
     RETURN QUERY
+    WITH draws AS (
+        SELECT d.n, random() * v_total AS r
+        FROM generate_series(1, CASE WHEN v_slots > p_limit THEN 3 * p_limit ELSE 0 END) d(n)
+    ),
+    picked AS (
+        -- small pools are returned whole
+        SELECT p.song_id, p.slot AS first_draw
+        FROM age_candidate_pools p
+        WHERE v_slots <= p_limit
+          AND p.tenant_id = v_tenant AND p.age_group = v_group AND p.premium_access = v_access
+        UNION ALL
+        SELECT hit.song_id, MIN(d.n)
+        FROM draws d
+        CROSS JOIN LATERAL (
+            SELECT p.song_id
+            FROM age_candidate_pools p
+            WHERE p.tenant_id = v_tenant AND p.age_group = v_group AND p.premium_access = v_access
+              AND p.cum_weight >= d.r
+            ORDER BY p.cum_weight
+            LIMIT 1
+        ) hit
+        GROUP BY hit.song_id
+        ORDER BY 2
+        LIMIT p_limit
+    )
     SELECT
         s.title,
         s.artist,
@@ -420,20 +674,16 @@ BEGIN
             WHEN v_group = 'basanta'THEN '🌳 Basanta (Classic & Timeless)'
             ELSE '🎵 All Ages'
         END AS recommended_for
-    FROM songs s
-    WHERE s.tenant_id = current_setting('app.current_tenant', true)::uuid
-      AND (
-            (v_group = 'kopila' AND s.genre IN ('Pop', 'Hip Hop', 'Rock', 'Rap'))
-         OR (v_group = 'phool'  AND s.genre IN ('Rock', 'Bollywood', 'Love', 'Indie'))
-         OR (v_group = 'basanta'AND s.genre IN ('Classic', 'Folk', 'Country', 'Jazz', 'Ghazal'))
-         OR (v_group = 'all')
-      )
-    ORDER BY s.rating DESC, RANDOM()
-    LIMIT 12;
+    FROM picked
+    JOIN songs s ON s.song_id = picked.song_id
+    ORDER BY s.rating DESC NULLS LAST;
 END;
 $$ LANGUAGE plpgsql;
 
 --------12."This Week's Famous Songs" based on actual plays"-------------
+-- Reads the play rollups, not play_history: the partial first day of the 7-day
+-- window comes from play_song_hourly, whole days from play_song_daily, so the
+-- cost follows the number of songs played in the window, not the number of plays.
 CREATE OR REPLACE FUNCTION this_week_famous()
  RETURNS TABLE(
    song_id    INT,
@@ -444,8 +694,23 @@ CREATE OR REPLACE FUNCTION this_week_famous()
    is_premium BOOLEAN,
    play_count BIGINT
  ) AS $$
+ DECLARE
+    v_tenant UUID        := current_setting('app.current_tenant',true)::uuid;
+    v_since  TIMESTAMPTZ := date_trunc('hour', NOW() - INTERVAL '7 days', 'UTC');
+    v_day    TIMESTAMPTZ := date_trunc('day', NOW() - INTERVAL '7 days', 'UTC') + INTERVAL '1 day';
  BEGIN
       RETURN QUERY
+      WITH window_plays AS (
+            SELECT h.song_id, h.plays FROM play_song_hourly h
+            WHERE h.tenant_id = v_tenant AND h.bucket >= v_since AND h.bucket < v_day
+            UNION ALL
+            SELECT d.song_id, d.plays FROM play_song_daily d
+            WHERE d.tenant_id = v_tenant AND d.bucket >= v_day
+      ), totals AS (
+            SELECT w.song_id, SUM(w.plays)::BIGINT AS play_count
+            FROM window_plays w
+            GROUP BY w.song_id
+      )
       SELECT
             s.song_id,
             s.title,
@@ -453,18 +718,15 @@ CREATE OR REPLACE FUNCTION this_week_famous()
             s.genre,
             s.rating,
             s.is_premium,
-            COUNT(ph.history_id):: BIGINT AS play_count
- FROM songs s
- LEFT JOIN play_history ph ON s.song_id=ph.song_id
- WHERE s.tenant_id=current_setting('app.current_tenant',true)::uuid
- AND ph.played_at >= NOW() - INTERVAL '7 days'
- GROUP BY s.song_id,s.title,s.artist,s.genre,s.rating,s.is_premium
- ORDER BY play_count DESC, s.rating DESC
+            t.play_count
+ FROM totals t
+ JOIN songs s ON s.song_id=t.song_id
+ ORDER BY t.play_count DESC, s.rating DESC
  LIMIT 12;
 END;
 $$ LANGUAGE plpgsql;
 
------13.Popular Genres Function
+-----13.Popular Genres Function (from song_genre_stats)
 CREATE OR REPLACE FUNCTION popular_genres()
  RETURNS TABLE(
  genre VARCHAR,
@@ -474,17 +736,18 @@ CREATE OR REPLACE FUNCTION popular_genres()
  BEGIN
   RETURN QUERY
   SELECT 
-    s.genre,
- COUNT(*) :: BIGINT AS song_count,
- ROUND(AVG(s.rating),2) AS avg_rating
- FROM songs s
- WHERE s.tenant_id=current_setting('app.current_tenant',true)::uuid
- GROUP BY s.genre
- ORDER BY song_count DESC, avg_rating DESC
+    g.genre,
+ SUM(g.song_count) :: BIGINT,
+ ROUND(SUM(g.rating_sum) / NULLIF(SUM(g.rated_songs), 0), 2)
+ FROM song_genre_stats g
+ WHERE g.tenant_id=current_setting('app.current_tenant',true)::uuid
+   AND g.song_count > 0
+ GROUP BY g.genre
+ ORDER BY 2 DESC, 3 DESC
  LIMIT 8;
 END;
 $$ LANGUAGE plpgsql;
------14. Popular Artists Function
+-----14. Popular Artists Function (from song_artist_stats)
 CREATE OR REPLACE FUNCTION popular_artists()
  RETURNS TABLE(
         artist     VARCHAR,
@@ -494,13 +757,14 @@ CREATE OR REPLACE FUNCTION popular_artists()
  BEGIN 
    RETURN QUERY
    SELECT
-       s.artist,
-       COUNT(*)::BIGINT AS song_count,
-       ROUND(AVG(s.rating),2) AS avg_rating
- FROM songs s
- WHERE s.tenant_id=current_setting('app.current_tenant',true)::uuid
- GROUP BY s.artist
- ORDER BY song_count DESC, avg_rating DESC
+       a.artist,
+       SUM(a.song_count)::BIGINT,
+       ROUND(SUM(a.rating_sum) / NULLIF(SUM(a.rated_songs), 0), 2)
+ FROM song_artist_stats a
+ WHERE a.tenant_id=current_setting('app.current_tenant',true)::uuid
+   AND a.song_count > 0
+ GROUP BY a.artist
+ ORDER BY 2 DESC, 3 DESC
  LIMIT 8;
 END;
 $$ LANGUAGE plpgsql;
@@ -535,7 +799,722 @@ PERFORM set_config('app.current_tenant',v_tenant::text,false);
 RETURN 'Login successful as' || v_role_type;
 END;
 $$ LANGUAGE plpgsql;
+------16.tenant_dashboard_snapshot (every Dashboard panel in one round trip)
+-- Counts, averages and rating bins come from the song summaries (function 28),
+-- whose RLS mirrors songs, so the cost follows the number of genres and artists,
+-- not songs. SECURITY INVOKER on purpose. Top songs still read songs, but only
+-- the rows holding each genre's 5 best distinct ratings (idx_songs_genre_rating).
+CREATE OR REPLACE FUNCTION tenant_dashboard_snapshot()
+RETURNS JSONB
+LANGUAGE sql STABLE
+AS $$
+WITH totals AS (
+    SELECT is_premium, SUM(song_count) AS song_count,
+           SUM(rated_songs) AS rated_songs, SUM(rating_sum) AS rating_sum
+    FROM song_tenant_stats
+    WHERE song_count > 0
+    GROUP BY is_premium
+),
+genres AS (
+    SELECT genre, SUM(song_count) AS song_count,
+           SUM(rating_sum) / NULLIF(SUM(rated_songs), 0) AS avg_rating
+    FROM song_genre_stats
+    WHERE song_count > 0
+    GROUP BY genre
+),
+artists AS (
+    SELECT artist, SUM(song_count) AS song_count,
+           SUM(rating_sum) / NULLIF(SUM(rated_songs), 0) AS avg_rating
+    FROM song_artist_stats
+    WHERE song_count > 0
+    GROUP BY artist
+),
+bins AS (
+    SELECT bucket, SUM(song_count) AS song_count
+    FROM song_rating_stats
+    WHERE bucket > 0
+    GROUP BY bucket
+),
+ranked AS (
+    -- same DENSE_RANK as before, over each genre's top-5 distinct ratings only
+    SELECT DENSE_RANK() OVER (PARTITION BY g.genre ORDER BY s.rating DESC NULLS LAST) AS rank,
+           g.genre, s.title, s.artist, s.rating
+    FROM genres g
+    CROSS JOIN LATERAL (
+        SELECT MIN(d.rating) AS floor_rating, COUNT(*) AS ratings
+        FROM (SELECT DISTINCT x.rating FROM songs x
+              WHERE x.genre = g.genre AND x.rating IS NOT NULL
+              ORDER BY x.rating DESC
+              LIMIT 5) d
+    ) top
+    JOIN songs s ON s.genre = g.genre
+                AND (s.rating >= top.floor_rating OR (s.rating IS NULL AND top.ratings < 5))
+)
+SELECT jsonb_build_object(
+    'total_songs',    COALESCE((SELECT SUM(song_count) FROM totals), 0),
+    'premium_songs',  COALESCE((SELECT song_count FROM totals WHERE is_premium), 0),
+    'unique_artists', (SELECT COUNT(*) FROM artists),
+    'avg_rating',     (SELECT ROUND(SUM(rating_sum) / NULLIF(SUM(rated_songs), 0), 1) FROM totals),
+    'genres', COALESCE((
+        SELECT jsonb_agg(jsonb_build_array(genre, song_count, ROUND(avg_rating, 2)) ORDER BY song_count DESC)
+        FROM genres), '[]'),
+    'artists', COALESCE((
+        SELECT jsonb_agg(jsonb_build_array(artist, song_count, ROUND(avg_rating, 2)) ORDER BY song_count DESC)
+        FROM (SELECT * FROM artists ORDER BY song_count DESC LIMIT 10) a), '[]'),
+    'premium_split', COALESCE((
+        SELECT jsonb_agg(jsonb_build_array(is_premium, song_count))
+        FROM totals), '[]'),
+    'rating_bins', (
+        SELECT jsonb_agg(jsonb_build_array((b - 1) * 0.25, b * 0.25, COALESCE(c.song_count, 0)) ORDER BY b)
+        FROM generate_series(1, 20) b
+        LEFT JOIN bins c ON c.bucket = b),
+    'top_songs', COALESCE((
+        SELECT jsonb_agg(jsonb_build_array(rank, genre, title, artist, rating) ORDER BY genre, rank)
+        FROM ranked WHERE rank <= 5), '[]')
+);
+$$;
+------17.songs_changed notification (app-side catalog caches drop the tenant)
+-- Payload: JSON with tenant_id, op and song_id. INSERTs also carry the new row,
+-- so the in-memory indexes append it instead of rebuilding; UPDATE/DELETE make
+-- them rebuild. A row is at most ~1 KB, well under NOTIFY's 8000-byte limit.
+CREATE OR REPLACE FUNCTION notify_songs_changed()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('songs_changed', json_build_object(
+            'tenant_id', NEW.tenant_id, 'op', TG_OP, 'song_id', NEW.song_id,
+            'title', NEW.title, 'artist', NEW.artist, 'genre', NEW.genre,
+            'rating', NEW.rating, 'is_premium', NEW.is_premium)::text);
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('songs_changed', json_build_object(
+        'tenant_id', OLD.tenant_id, 'op', TG_OP, 'song_id', OLD.song_id)::text);
+    IF TG_OP = 'UPDATE' AND NEW.tenant_id IS DISTINCT FROM OLD.tenant_id THEN
+        PERFORM pg_notify('songs_changed', json_build_object(
+            'tenant_id', NEW.tenant_id, 'op', TG_OP, 'song_id', NEW.song_id)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_songs_changed ON songs;
+CREATE TRIGGER trg_songs_changed
+AFTER INSERT OR UPDATE OR DELETE ON songs
+FOR EACH ROW EXECUTE FUNCTION notify_songs_changed();
+------18.rating_histogram (binned in the database, only bucket counts go over the wire)
+CREATE OR REPLACE FUNCTION rating_histogram(p_buckets INT DEFAULT 20)
+RETURNS TABLE(bucket INT, range_start NUMERIC, range_end NUMERIC, song_count BIGINT)
+LANGUAGE sql STABLE
+AS $$
+SELECT b,
+       ROUND((b - 1) * 5.0 / p_buckets, 2),
+       ROUND(b * 5.0 / p_buckets, 2),
+       COALESCE(c.cnt, 0)
+FROM generate_series(1, p_buckets) b
+LEFT JOIN (
+    -- a rating of exactly 5.0 lands in the overflow bucket, fold it into the last one
+    SELECT LEAST(width_bucket(rating, 0, 5, p_buckets), p_buckets) AS bkt, COUNT(*) AS cnt
+    FROM songs
+    WHERE rating IS NOT NULL
+    GROUP BY 1
+) c ON c.bkt = b
+ORDER BY b;
+$$;
+------19.search_songs (trigram-ranked catalog search shared by both apps)
+-- Ranked by word_similarity so typos and partial words still match; the
+-- ILIKE / <% predicates are served by the gin_trgm_ops indexes below.
+-- SECURITY INVOKER + inlinable SQL: RLS still decides what each role sees.
+-- Keyset paging: pass the last row's (score, song_id) to get the next page.
+CREATE OR REPLACE FUNCTION search_songs(
+    p_term        TEXT,
+    p_field       TEXT    DEFAULT 'all',
+    p_limit       INT     DEFAULT 20,
+    p_after_score REAL    DEFAULT NULL,
+    p_after_id    INT     DEFAULT NULL,
+    p_own_only    BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE(song_id INT, title VARCHAR, artist VARCHAR, genre VARCHAR,
+              rating NUMERIC, is_premium BOOLEAN, score REAL)
+LANGUAGE sql STABLE
+AS $$
+SELECT hits.*
+FROM (
+    SELECT s.song_id, s.title, s.artist, s.genre, s.rating, s.is_premium,
+           CASE p_field
+               WHEN 'title'  THEN word_similarity(p_term, s.title)
+               WHEN 'artist' THEN word_similarity(p_term, s.artist)
+               WHEN 'genre'  THEN word_similarity(p_term, s.genre)
+               ELSE GREATEST(word_similarity(p_term, s.title),
+                             word_similarity(p_term, s.artist),
+                             word_similarity(p_term, s.genre))
+           END AS score
+    FROM songs s
+    WHERE ((p_field IN ('all', 'title')  AND (s.title  ILIKE '%' || p_term || '%' OR p_term <% s.title))
+        OR (p_field IN ('all', 'artist') AND (s.artist ILIKE '%' || p_term || '%' OR p_term <% s.artist))
+        OR (p_field IN ('all', 'genre')  AND (s.genre  ILIKE '%' || p_term || '%' OR p_term <% s.genre)))
+      AND (NOT p_own_only OR s.added_by = current_user)
+) hits
+WHERE p_after_score IS NULL
+   OR (hits.score, -hits.song_id) < (p_after_score, -p_after_id)
+ORDER BY hits.score DESC, hits.song_id
+LIMIT p_limit;
+$$;
+------20.song_premium_flags (premium gate for buffered play ingestion, APP/play_ingest.py)
+-- SECURITY DEFINER: a free listener's gate must also know the premium songs RLS hides
+-- from them. Still limited to the caller's tenant; returns ids and flags only.
+CREATE OR REPLACE FUNCTION song_premium_flags()
+RETURNS TABLE(song_id INT, is_premium BOOLEAN)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public
+AS $$
+SELECT s.song_id, COALESCE(s.is_premium, FALSE)
+FROM songs s
+WHERE s.tenant_id = current_setting('app.current_tenant', true)::uuid
+ORDER BY s.song_id;
+$$;
+------21.play_history partitions (one per month; APP/manage.py partitions keeps them ahead)
+-- The new month is built as a standalone table, takes over any of its rows that
+-- landed in play_history_default, and is attached with a matching CHECK so the
+-- attach doesn't have to scan it. Returns the partition name, NULL if it existed.
+CREATE OR REPLACE FUNCTION create_play_history_partition(p_month DATE)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_from DATE := date_trunc('month', p_month)::date;
+    v_to   DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    v_name TEXT := 'play_history_' || to_char(v_from, '"y"YYYY"m"MM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE play_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                    CHECK (played_at >= %L AND played_at < %L))', v_name, v_from, v_to);
+    EXECUTE format('WITH moved AS (
+                        DELETE FROM play_history_default
+                        WHERE played_at >= %L AND played_at < %L
+                        RETURNING *)
+                    INSERT INTO %I SELECT * FROM moved', v_from, v_to, v_name);
+    EXECUTE format('ALTER TABLE play_history ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   v_name, v_from, v_to);
+    RETURN v_name;
+END;
+$$;
+
+-- Last month through p_months_ahead months from now; returns the partitions it created
+CREATE OR REPLACE FUNCTION ensure_play_history_partitions(p_months_ahead INT DEFAULT 3)
+RETURNS SETOF TEXT
+LANGUAGE sql
+AS $$
+SELECT created
+FROM generate_series(date_trunc('month', NOW()) - INTERVAL '1 month',
+                     date_trunc('month', NOW()) + make_interval(months => p_months_ahead),
+                     INTERVAL '1 month') AS m,
+     create_play_history_partition(m::date) AS created
+WHERE created IS NOT NULL;
+$$;
+
+SELECT ensure_play_history_partitions();
+------22.play rollups trigger (statement level: one upsert per batch, not per play)
+-- The transition table holds every row of the INSERT, so a 1000-row batch from
+-- play_ingest.py costs one grouped upsert per rollup table. Keys are upserted in
+-- sorted order so concurrent batches can't deadlock. SECURITY DEFINER: the
+-- inserting role (app_login, listeners) needs no rights on the rollups or songs.
+CREATE OR REPLACE FUNCTION play_history_rollups()
+RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO play_song_hourly AS r (tenant_id, bucket, song_id, plays, listen_seconds)
+    SELECT tenant_id, date_trunc('hour', played_at, 'UTC'), song_id,
+           COUNT(*), COALESCE(SUM(listen_duration), 0)
+    FROM new_plays
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (tenant_id, bucket, song_id) DO UPDATE
+    SET plays = r.plays + EXCLUDED.plays,
+        listen_seconds = r.listen_seconds + EXCLUDED.listen_seconds;
+
+    INSERT INTO play_song_daily AS r (tenant_id, bucket, song_id, plays, listen_seconds)
+    SELECT tenant_id, date_trunc('day', played_at, 'UTC'), song_id,
+           COUNT(*), COALESCE(SUM(listen_duration), 0)
+    FROM new_plays
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (tenant_id, bucket, song_id) DO UPDATE
+    SET plays = r.plays + EXCLUDED.plays,
+        listen_seconds = r.listen_seconds + EXCLUDED.listen_seconds;
+
+    INSERT INTO play_user_daily AS r (tenant_id, user_name, bucket, plays, listen_seconds, rating_sum, rated_plays)
+    SELECT p.tenant_id, p.user_name, date_trunc('day', p.played_at, 'UTC'),
+           COUNT(*), COALESCE(SUM(p.listen_duration), 0),
+           COALESCE(SUM(s.rating), 0), COUNT(s.rating)
+    FROM new_plays p
+    LEFT JOIN songs s ON s.song_id = p.song_id
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (tenant_id, user_name, bucket) DO UPDATE
+    SET plays = r.plays + EXCLUDED.plays,
+        listen_seconds = r.listen_seconds + EXCLUDED.listen_seconds,
+        rating_sum = r.rating_sum + EXCLUDED.rating_sum,
+        rated_plays = r.rated_plays + EXCLUDED.rated_plays;
+
+    INSERT INTO play_user_artists AS r (tenant_id, user_name, artist, plays, last_played_at)
+    SELECT p.tenant_id, p.user_name, s.artist, COUNT(*), MAX(p.played_at)
+    FROM new_plays p
+    JOIN songs s ON s.song_id = p.song_id
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (tenant_id, user_name, artist) DO UPDATE
+    SET plays = r.plays + EXCLUDED.plays,
+        last_played_at = GREATEST(r.last_played_at, EXCLUDED.last_played_at);
+
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_play_history_rollups ON play_history;
+CREATE TRIGGER trg_play_history_rollups
+AFTER INSERT ON play_history
+REFERENCING NEW TABLE AS new_plays
+FOR EACH STATEMENT EXECUTE FUNCTION play_history_rollups();
+
+------23.my_listening_stats (History tab "Listening Stats" from the user rollups)
+CREATE OR REPLACE FUNCTION my_listening_stats()
+RETURNS TABLE(total_plays BIGINT, unique_artists BIGINT, avg_rating NUMERIC, listen_seconds BIGINT)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public
+AS $$
+SELECT COALESCE(SUM(d.plays), 0)::BIGINT,
+       (SELECT COUNT(*) FROM play_user_artists a
+        WHERE a.tenant_id = current_setting('app.current_tenant', true)::uuid
+          AND a.user_name = current_setting('app.current_username', true)),
+       ROUND(SUM(d.rating_sum) / NULLIF(SUM(d.rated_plays), 0), 1),
+       COALESCE(SUM(d.listen_seconds), 0)::BIGINT
+FROM play_user_daily d
+WHERE d.tenant_id = current_setting('app.current_tenant', true)::uuid
+  AND d.user_name = current_setting('app.current_username', true);
+$$;
+
+------24.rebuild_play_rollups (backfill / repair from play_history; APP/manage.py rollups rebuild)
+CREATE OR REPLACE FUNCTION rebuild_play_rollups()
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_plays BIGINT;
+BEGIN
+    LOCK TABLE play_history IN SHARE MODE;      -- no plays slip in between truncate and refill
+    TRUNCATE play_song_hourly, play_song_daily, play_user_daily, play_user_artists;
+
+    INSERT INTO play_song_hourly (tenant_id, bucket, song_id, plays, listen_seconds)
+    SELECT tenant_id, date_trunc('hour', played_at, 'UTC'), song_id, COUNT(*), COALESCE(SUM(listen_duration), 0)
+    FROM play_history GROUP BY 1, 2, 3;
+
+    INSERT INTO play_song_daily (tenant_id, bucket, song_id, plays, listen_seconds)
+    SELECT tenant_id, date_trunc('day', bucket, 'UTC'), song_id, SUM(plays), SUM(listen_seconds)
+    FROM play_song_hourly GROUP BY 1, 2, 3;
+
+    INSERT INTO play_user_daily (tenant_id, user_name, bucket, plays, listen_seconds, rating_sum, rated_plays)
+    SELECT p.tenant_id, p.user_name, date_trunc('day', p.played_at, 'UTC'), COUNT(*),
+           COALESCE(SUM(p.listen_duration), 0), COALESCE(SUM(s.rating), 0), COUNT(s.rating)
+    FROM play_history p LEFT JOIN songs s ON s.song_id = p.song_id
+    GROUP BY 1, 2, 3;
+
+    INSERT INTO play_user_artists (tenant_id, user_name, artist, plays, last_played_at)
+    SELECT p.tenant_id, p.user_name, s.artist, COUNT(*), MAX(p.played_at)
+    FROM play_history p JOIN songs s ON s.song_id = p.song_id
+    GROUP BY 1, 2, 3;
+
+    SELECT COALESCE(SUM(plays), 0) INTO v_plays FROM play_song_daily;
+    RETURN v_plays;
+END;
+$$;
+
+SELECT rebuild_play_rollups();
+
+-- per-song play counts are tenant data: own tenant only, like the song summaries
+ALTER TABLE play_song_hourly ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS play_song_hourly_tenant ON play_song_hourly;
+CREATE POLICY play_song_hourly_tenant ON play_song_hourly
+FOR SELECT
+USING(tenant_id = current_setting('app.current_tenant', true)::uuid);
+
+ALTER TABLE play_song_daily ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS play_song_daily_tenant ON play_song_daily;
+CREATE POLICY play_song_daily_tenant ON play_song_daily
+FOR SELECT
+USING(tenant_id = current_setting('app.current_tenant', true)::uuid);
+------25.trending_seed (hourly play counts that seed APP/trending.py boards)
+-- SECURITY DEFINER so one board per tenant knows every song's premium flag;
+-- the app filters premium songs out for free listeners.
+CREATE OR REPLACE FUNCTION trending_seed(p_hours NUMERIC DEFAULT 240)
+RETURNS TABLE(song_id INT, is_premium BOOLEAN, bucket_epoch DOUBLE PRECISION, plays BIGINT)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public
+AS $$
+SELECT h.song_id, COALESCE(s.is_premium, FALSE), extract(epoch FROM h.bucket)::DOUBLE PRECISION, h.plays
+FROM play_song_hourly h
+JOIN songs s ON s.song_id = h.song_id
+WHERE h.tenant_id = current_setting('app.current_tenant', true)::uuid
+  AND h.bucket >= NOW() - make_interval(secs => p_hours * 3600);
+$$;
+------26.my_recommendations (Recommendations tab: one primary-key range read)
+-- SECURITY INVOKER: the user_recommendations policy limits rows to the caller and
+-- the songs policies hide premium songs from free listeners. The batch already
+-- skips them; this also covers a downgrade since the last batch.
+CREATE OR REPLACE FUNCTION my_recommendations(p_limit INT DEFAULT 12)
+RETURNS TABLE(song_id INT, title VARCHAR, artist VARCHAR, genre VARCHAR,
+              rating NUMERIC, is_premium BOOLEAN, score REAL)
+LANGUAGE sql STABLE
+AS $$
+SELECT s.song_id, s.title, s.artist, s.genre, s.rating, s.is_premium, r.score
+FROM user_recommendations r
+JOIN songs s ON s.song_id = r.song_id
+WHERE r.tenant_id = current_setting('app.current_tenant', true)::uuid
+  AND r.user_name = current_setting('app.current_username', true)
+ORDER BY r.rank
+LIMIT p_limit;
+$$;
+
+ALTER TABLE user_recommendations ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS user_recommendations_own ON user_recommendations;
+CREATE POLICY user_recommendations_own ON user_recommendations
+FOR SELECT
+USING(tenant_id = current_setting('app.current_tenant', true)::uuid
+ AND user_name = current_setting('app.current_username', true));
+------27.age-group candidate pools (read by get_age_based_recommendations, function 11)
+-- Per tenant x age group x access level: the p_pool_size best-rated songs whose
+-- genre genre_age_groups maps to the group ('all' takes every genre), weighted
+-- 1 + rating^2. premium_access = FALSE pools hold only free songs.
+CREATE OR REPLACE FUNCTION refresh_age_pools(p_tenant UUID, p_pool_size INT DEFAULT 500)
+RETURNS INT
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_rows INT;
+BEGIN
+    -- Taken first: a songs change committing during the rebuild waits on this
+    -- row, then marks the tenant stale again, so no change is missed
+    INSERT INTO age_pool_state (tenant_id, stale, refreshed_at)
+    VALUES (p_tenant, FALSE, NOW())
+    ON CONFLICT (tenant_id) DO UPDATE SET stale = FALSE, refreshed_at = NOW();
+
+    DELETE FROM age_candidate_pools WHERE tenant_id = p_tenant;
+
+    INSERT INTO age_candidate_pools (tenant_id, age_group, premium_access, slot, song_id, cum_weight)
+    WITH candidates AS (
+        SELECT g.age_group, s.song_id, s.rating, s.is_premium
+        FROM songs s
+        JOIN genre_age_groups g ON g.genre = s.genre
+        WHERE s.tenant_id = p_tenant
+        UNION ALL
+        SELECT 'all', s.song_id, s.rating, s.is_premium
+        FROM songs s
+        WHERE s.tenant_id = p_tenant
+    ),
+    ranked AS (
+        SELECT c.age_group, a.premium_access, c.song_id, c.rating,
+               ROW_NUMBER() OVER (PARTITION BY c.age_group, a.premium_access
+                                  ORDER BY c.rating DESC NULLS LAST, c.song_id) AS slot
+        FROM candidates c
+        CROSS JOIN (VALUES (FALSE), (TRUE)) a(premium_access)
+        WHERE a.premium_access OR c.is_premium = FALSE
+    )
+    SELECT p_tenant, age_group, premium_access, slot, song_id,
+           SUM(1 + COALESCE(rating, 0) ^ 2) OVER (PARTITION BY age_group, premium_access ORDER BY slot)
+    FROM ranked
+    WHERE slot <= p_pool_size;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$;
+
+-- Called per request: a no-op unless the caller's tenant is stale or has no pools yet
+CREATE OR REPLACE FUNCTION ensure_age_pools()
+RETURNS VOID
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_tenant UUID := current_setting('app.current_tenant', true)::uuid;
+BEGIN
+    IF v_tenant IS NULL OR EXISTS (SELECT 1 FROM age_pool_state WHERE tenant_id = v_tenant AND NOT stale) THEN
+        RETURN;
+    END IF;
+    -- One session rebuilds; concurrent callers keep sampling the committed pools
+    IF pg_try_advisory_xact_lock(hashtext('age_candidate_pools'), hashtext(v_tenant::text)) THEN
+        PERFORM refresh_age_pools(v_tenant);
+    END IF;
+END;
+$$;
+
+-- Statement level: a bulk insert marks each tenant once. Transition tables allow
+-- only one event per trigger, hence three triggers on songs sharing this function.
+CREATE OR REPLACE FUNCTION mark_age_pools_stale()
+RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'genre_age_groups' THEN
+        UPDATE age_pool_state SET stale = TRUE WHERE NOT stale;
+    ELSIF TG_OP = 'INSERT' THEN
+        UPDATE age_pool_state SET stale = TRUE
+        WHERE NOT stale AND tenant_id IN (SELECT tenant_id FROM new_songs);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE age_pool_state SET stale = TRUE
+        WHERE NOT stale AND tenant_id IN (SELECT tenant_id FROM old_songs);
+    ELSE
+        -- only changes that can move a song between pools or reorder one
+        UPDATE age_pool_state SET stale = TRUE
+        WHERE NOT stale AND tenant_id IN (
+            SELECT v.tenant_id
+            FROM old_songs o
+            JOIN new_songs n ON n.song_id = o.song_id,
+            LATERAL (VALUES (o.tenant_id), (n.tenant_id)) v(tenant_id)
+            WHERE (o.genre, o.rating, o.is_premium, o.tenant_id)
+                  IS DISTINCT FROM (n.genre, n.rating, n.is_premium, n.tenant_id));
+    END IF;
+    RETURN NULL;
+END;
+$$;
 
+DROP TRIGGER IF EXISTS trg_songs_age_pools_ins ON songs;
+CREATE TRIGGER trg_songs_age_pools_ins
+AFTER INSERT ON songs
+REFERENCING NEW TABLE AS new_songs
+FOR EACH STATEMENT EXECUTE FUNCTION mark_age_pools_stale();
+
+DROP TRIGGER IF EXISTS trg_songs_age_pools_upd ON songs;
+CREATE TRIGGER trg_songs_age_pools_upd
+AFTER UPDATE ON songs
+REFERENCING OLD TABLE AS old_songs NEW TABLE AS new_songs
+FOR EACH STATEMENT EXECUTE FUNCTION mark_age_pools_stale();
+
+DROP TRIGGER IF EXISTS trg_songs_age_pools_del ON songs;
+CREATE TRIGGER trg_songs_age_pools_del
+AFTER DELETE ON songs
+REFERENCING OLD TABLE AS old_songs
+FOR EACH STATEMENT EXECUTE FUNCTION mark_age_pools_stale();
+
+DROP TRIGGER IF EXISTS trg_genre_age_groups_changed ON genre_age_groups;
+CREATE TRIGGER trg_genre_age_groups_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON genre_age_groups
+FOR EACH STATEMENT EXECUTE FUNCTION mark_age_pools_stale();
+
+-- free listeners only ever read the free pools of their own tenant
+ALTER TABLE age_candidate_pools ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS age_candidate_pools_tenant ON age_candidate_pools;
+CREATE POLICY age_candidate_pools_tenant ON age_candidate_pools
+FOR SELECT
+USING(tenant_id = current_setting('app.current_tenant', true)::uuid
+ AND (NOT premium_access OR current_user <> 'listener_free'));
+------28.song summaries (tenant / genre / artist / uploader / rating-bin counters)
+-- Statement-level delta triggers: every changed row contributes +1 (new) or -1
+-- (old) to its keys, grouped per statement, so a bulk insert is one upsert per
+-- key and an UPDATE that only touches the title nets to zero and writes nothing.
+-- Keys are upserted in sorted order so concurrent statements can't deadlock.
+-- The summary and its keys; rated summaries also carry rated_songs/rating_sum.
+CREATE OR REPLACE FUNCTION song_stats_targets()
+RETURNS TABLE(summary TEXT, keys TEXT, rated BOOLEAN)
+LANGUAGE sql IMMUTABLE
+AS $$
+VALUES ('song_tenant_stats',   'tenant_id, is_premium',           TRUE),
+       ('song_genre_stats',    'tenant_id, genre, is_premium',    TRUE),
+       ('song_artist_stats',   'tenant_id, artist, is_premium',   TRUE),
+       ('song_uploader_stats', 'tenant_id, added_by, is_premium', FALSE),
+       ('song_rating_stats',   'tenant_id, is_premium, bucket',   FALSE);
+$$;
+
+-- Every summary key, computed the same way from songs and from transition tables
+CREATE OR REPLACE FUNCTION song_stats_columns()
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE
+AS $$
+SELECT 'tenant_id, genre, artist, added_by, is_premium IS NOT FALSE AS is_premium, rating, '
+       'LEAST(COALESCE(width_bucket(rating, 0, 5, 20), 0), 20)::SMALLINT AS bucket';
+$$;
+
+CREATE OR REPLACE FUNCTION song_stats_apply()
+RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_cols TEXT := song_stats_columns();
+    v_changes TEXT;
+    t RECORD;
+BEGIN
+    -- transition tables are visible to EXECUTE as well
+    v_changes := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT %s, 1 AS sign FROM new_songs', v_cols)
+        WHEN 'DELETE' THEN format('SELECT %s, -1 AS sign FROM old_songs', v_cols)
+        ELSE format('SELECT %1$s, 1 AS sign FROM new_songs UNION ALL SELECT %1$s, -1 FROM old_songs', v_cols)
+    END;
+
+    FOR t IN SELECT * FROM song_stats_targets() LOOP
+        IF t.rated THEN
+            EXECUTE format($q$
+                INSERT INTO %1$I AS s (%2$s, song_count, rated_songs, rating_sum)
+                SELECT %2$s, SUM(sign), COALESCE(SUM(sign) FILTER (WHERE rating IS NOT NULL), 0),
+                       COALESCE(SUM(sign * rating), 0)
+                FROM (%3$s) c
+                GROUP BY %2$s
+                HAVING SUM(sign) <> 0 OR COALESCE(SUM(sign * rating), 0) <> 0
+                    OR COALESCE(SUM(sign) FILTER (WHERE rating IS NOT NULL), 0) <> 0
+                ORDER BY %2$s
+                ON CONFLICT (%2$s) DO UPDATE
+                SET song_count  = s.song_count + EXCLUDED.song_count,
+                    rated_songs = s.rated_songs + EXCLUDED.rated_songs,
+                    rating_sum  = s.rating_sum + EXCLUDED.rating_sum
+            $q$, t.summary, t.keys, v_changes);
+        ELSE
+            EXECUTE format($q$
+                INSERT INTO %1$I AS s (%2$s, song_count)
+                SELECT %2$s, SUM(sign)
+                FROM (%3$s) c
+                GROUP BY %2$s
+                HAVING SUM(sign) <> 0
+                ORDER BY %2$s
+                ON CONFLICT (%2$s) DO UPDATE
+                SET song_count = s.song_count + EXCLUDED.song_count
+            $q$, t.summary, t.keys, v_changes);
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$;
+
+-- Transition tables allow only one event per trigger, hence three
+DROP TRIGGER IF EXISTS trg_songs_stats_ins ON songs;
+CREATE TRIGGER trg_songs_stats_ins
+AFTER INSERT ON songs
+REFERENCING NEW TABLE AS new_songs
+FOR EACH STATEMENT EXECUTE FUNCTION song_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_songs_stats_upd ON songs;
+CREATE TRIGGER trg_songs_stats_upd
+AFTER UPDATE ON songs
+REFERENCING OLD TABLE AS old_songs NEW TABLE AS new_songs
+FOR EACH STATEMENT EXECUTE FUNCTION song_stats_apply();
+
+DROP TRIGGER IF EXISTS trg_songs_stats_del ON songs;
+CREATE TRIGGER trg_songs_stats_del
+AFTER DELETE ON songs
+REFERENCING OLD TABLE AS old_songs
+FOR EACH STATEMENT EXECUTE FUNCTION song_stats_apply();
+
+-- Drift check (APP/manage.py stats reconcile): recounts songs and compares every
+-- summary row, a missing row counting as zero. p_repair rebuilds the drifted
+-- summaries under a SHARE lock on songs (writers wait, readers don't), which
+-- also drops rows whose count reached zero.
+CREATE OR REPLACE FUNCTION reconcile_song_stats(p_repair BOOLEAN DEFAULT FALSE)
+RETURNS TABLE(summary TEXT, summary_rows BIGINT, drifted_rows BIGINT, zero_rows BIGINT, repaired BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cols TEXT := song_stats_columns();
+    v_measures TEXT;
+    v_compare TEXT;
+    t RECORD;
+BEGIN
+    IF p_repair THEN
+        LOCK TABLE songs IN SHARE MODE;
+    END IF;
+
+    FOR t IN SELECT * FROM song_stats_targets() LOOP
+        v_measures := CASE WHEN t.rated
+            THEN 'COUNT(*) AS song_count, COUNT(rating) AS rated_songs, COALESCE(SUM(rating), 0) AS rating_sum'
+            ELSE 'COUNT(*) AS song_count' END;
+        v_compare := CASE WHEN t.rated
+            THEN '(COALESCE(a.song_count, 0), COALESCE(a.rated_songs, 0), COALESCE(a.rating_sum, 0))
+                  IS DISTINCT FROM (COALESCE(s.song_count, 0), COALESCE(s.rated_songs, 0), COALESCE(s.rating_sum, 0))'
+            ELSE 'COALESCE(a.song_count, 0) IS DISTINCT FROM COALESCE(s.song_count, 0)' END;
+
+        summary := t.summary;
+        repaired := FALSE;
+        EXECUTE format($q$
+            WITH actual AS (
+                SELECT %2$s, %4$s FROM (SELECT %3$s FROM songs) c GROUP BY %2$s
+            )
+            SELECT COUNT(s.song_count), COUNT(*) FILTER (WHERE %5$s), COUNT(*) FILTER (WHERE s.song_count = 0)
+            FROM actual a
+            FULL JOIN %1$I s USING (%2$s)
+        $q$, t.summary, t.keys, v_cols, v_measures, v_compare)
+        INTO summary_rows, drifted_rows, zero_rows;
+
+        IF p_repair AND (drifted_rows > 0 OR zero_rows > 0) THEN
+            EXECUTE format('DELETE FROM %I', t.summary);
+            EXECUTE format('INSERT INTO %1$I (%2$s, %4$s) SELECT %2$s, %5$s FROM (SELECT %3$s FROM songs) c GROUP BY %2$s',
+                           t.summary, t.keys, v_cols,
+                           CASE WHEN t.rated THEN 'song_count, rated_songs, rating_sum' ELSE 'song_count' END,
+                           v_measures);
+            repaired := TRUE;
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+-- backfill (and repair) once, now that the triggers keep them current
+SELECT * FROM reconcile_song_stats(TRUE);
+
+-- same visibility as songs: own tenant, free listeners only see free songs
+DO $$
+DECLARE
+    v_summary TEXT;
+BEGIN
+    FOR v_summary IN SELECT summary FROM song_stats_targets() LOOP
+        EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_summary);
+        EXECUTE format('DROP POLICY IF EXISTS %I ON %I', v_summary || '_visible', v_summary);
+        EXECUTE format($q$
+            CREATE POLICY %I ON %I
+            FOR SELECT
+            USING(tenant_id = current_setting('app.current_tenant', true)::uuid
+             AND (NOT is_premium OR current_user <> 'listener_free'))
+        $q$, v_summary || '_visible', v_summary);
+    END LOOP;
+END $$;
+
+------29.watchdog_activity (non-idle app sessions for APP/watchdog.py and the admin live view)
+-- Pooled sessions log in as app_login and carry 'musicapp:<role>:<tenant>' in
+-- application_name; direct logins fall back to the login role. SECURITY DEFINER
+-- because pg_stat_activity hides other roles' query text from adminn.
+CREATE OR REPLACE FUNCTION watchdog_activity()
+RETURNS TABLE(pid INT, usename TEXT, application_name TEXT, db_role TEXT, tenant_id UUID, state TEXT,
+              query_start TIMESTAMPTZ, runtime_s DOUBLE PRECISION, state_age_s DOUBLE PRECISION,
+              wait_event TEXT, query TEXT)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = pg_catalog, public
+AS $$
+    SELECT a.pid,
+           a.usename::text,
+           a.application_name,
+           CASE WHEN a.application_name LIKE 'musicapp:%'
+                THEN split_part(a.application_name, ':', 2)
+                ELSE a.usename::text END,
+           CASE WHEN split_part(a.application_name, ':', 3) ~* '^[0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12}$'
+                THEN split_part(a.application_name, ':', 3)::uuid END,
+           a.state,
+           a.query_start,
+           EXTRACT(EPOCH FROM clock_timestamp() - a.query_start)::float8,
+           EXTRACT(EPOCH FROM clock_timestamp() - a.state_change)::float8,
+           concat_ws(':', a.wait_event_type, a.wait_event),
+           left(a.query, 1000)
+    FROM pg_stat_activity a
+    WHERE a.datname = current_database()
+      AND a.backend_type = 'client backend'
+      AND a.pid <> pg_backend_pid()
+      AND a.state <> 'idle'
+    ORDER BY a.query_start
+$$;
 
 
 
@@ -552,6 +1531,34 @@ GRANT EXECUTE ON FUNCTION this_week_famous TO listener_free, listener_premium, a
 GRANT EXECUTE ON FUNCTION user_login(TEXT,TEXT,UUID) TO app_login;
 GRANT SELECT ON users TO app_login;
 GRANT EXECUTE ON ALL FUNCTION IN SCHEMA public TO app_login;
+GRANT EXECUTE ON FUNCTION tenant_dashboard_snapshot TO appuser, adminn;
+GRANT EXECUTE ON FUNCTION rating_histogram TO appuser, adminn;
+GRANT EXECUTE ON FUNCTION search_songs TO appuser, adminn, listener_free, listener_premium;
+GRANT EXECUTE ON FUNCTION song_premium_flags TO listener_free, listener_premium;
+-- play_ingest.py writes batched plays on its own app_login connection
+GRANT INSERT ON play_history TO app_login;
+GRANT USAGE ON SEQUENCE play_history_history_id_seq TO app_login;
+GRANT SELECT ON play_song_hourly, play_song_daily TO listener_free, listener_premium, appuser, adminn;
+GRANT EXECUTE ON FUNCTION my_listening_stats TO listener_free, listener_premium;
+GRANT EXECUTE ON FUNCTION trending_seed TO listener_free, listener_premium, appuser, adminn;
+GRANT EXECUTE ON FUNCTION my_recommendations TO listener_free, listener_premium;
+GRANT SELECT ON user_recommendations TO listener_free, listener_premium;
+GRANT EXECUTE ON FUNCTION ensure_age_pools TO listener_free, listener_premium;
+GRANT SELECT ON age_candidate_pools TO listener_free, listener_premium;
+GRANT SELECT ON song_tenant_stats, song_genre_stats, song_artist_stats, song_uploader_stats, song_rating_stats
+TO appuser, adminn, listener_free, listener_premium;
+-- the summaries are written by the songs triggers only; repair locks songs
+REVOKE EXECUTE ON FUNCTION reconcile_song_stats FROM PUBLIC, appuser, adminn, listener_free, listener_premium, app_login;
+-- bulk import (APP/bulk_import.py) stages in a temp table and inserts as appuser; RLS keeps it in the tenant
+GRANT TEMPORARY ON DATABASE backup TO appuser;
+GRANT SELECT, INSERT ON songs TO appuser;
+GRANT USAGE ON SEQUENCE songs_song_id_seq TO appuser;
+-- query watchdog: only adminn gets the live view and the event log
+REVOKE EXECUTE ON FUNCTION watchdog_activity FROM PUBLIC, appuser, listener_free, listener_premium, app_login;
+GRANT EXECUTE ON FUNCTION watchdog_activity TO adminn;
+GRANT SELECT ON watchdog_events TO adminn;
+-- slow query report: snapshots are taken by manage.py, adminn only reads them
+GRANT SELECT ON query_snapshots, query_snapshot_stats TO adminn;
 ---------------------------------------Index-------------------------------------------------------------
 SELECT *FROM tenants;
 
@@ -564,6 +1571,35 @@ CREATE INDEX idx_subtenant_user ON premium_subscription(tenant_id,user_name);
 CREATE INDEX idx_song_search
 ON songs (tenant_id, title, artist);
 
+-- trigram indexes for search_songs(): leading-wildcard ILIKE and fuzzy <% matches
+CREATE INDEX IF NOT EXISTS idx_songs_title_trgm  ON songs USING gin (title  gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_songs_artist_trgm ON songs USING gin (artist gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_songs_genre_trgm  ON songs USING gin (genre  gin_trgm_ops);
+
+-- keyset indexes for the Browse tab (APP/browse.py): one per sort key, song_id as tiebreaker.
+-- DESC sorts walk the same index backwards; NULL ratings map to a sentinel so they sort last.
+CREATE INDEX IF NOT EXISTS idx_songs_browse_rating_desc ON songs (tenant_id, (COALESCE(rating, -1)), song_id);
+CREATE INDEX IF NOT EXISTS idx_songs_browse_rating_asc  ON songs (tenant_id, (COALESCE(rating, 99)), song_id);
+CREATE INDEX IF NOT EXISTS idx_songs_browse_title       ON songs (tenant_id, title, song_id);
+
+-- play_history indexes are defined on the partitioned parent and cascade to every month.
+-- Recent-window queries (played_at >= NOW() - ...) are pruned to the newest partitions.
+CREATE INDEX IF NOT EXISTS idx_play_history_tenant_played ON play_history (tenant_id, played_at);
+CREATE INDEX IF NOT EXISTS idx_play_history_song_played   ON play_history (song_id, played_at);
+-- newest-first history pages (my_history) walk this one in index order
+DROP INDEX IF EXISTS idx_play_history_user_played;
+CREATE INDEX IF NOT EXISTS idx_play_history_user_recent   ON play_history (user_name, played_at DESC, history_id DESC);
+
+-- watchdog live view: latest events first
+CREATE INDEX IF NOT EXISTS idx_watchdog_events_logged ON watchdog_events (logged_at DESC);
+
+-- weighted draws for get_age_based_recommendations(): first pool slot with cum_weight >= r
+CREATE INDEX IF NOT EXISTS idx_age_candidate_pools_draw
+ON age_candidate_pools (tenant_id, age_group, premium_access, cum_weight);
+
+-- Dashboard top songs per genre: the best distinct ratings are read off this index
+CREATE INDEX IF NOT EXISTS idx_songs_genre_rating ON songs (tenant_id, genre, rating);
+
 SELECT tablename, indexname FROM pg_indexes 
 WHERE schemaname = 'public' 
 ORDER BY tablename;
@@ -584,6 +1620,8 @@ FROM songs
 WHERE tenant_id = current_setting('app.current_tenant')::uuid;
 
 -----------------------------LONG RUNNING QUERIES----------------------
+-- APP/watchdog.py enforces per-role budgets on these (manage.py watchdog run);
+-- SELECT * FROM watchdog_events ORDER BY logged_at DESC; shows what it did.
 SELECT *FROM pg_stat_activity ;
 SELECT *FROM pg_stat_activity WHERE state='idle';
 SELECT *FROM pg_stat_activity WHERE state='active';
@@ -656,6 +1694,20 @@ ALTER VIEW listener_songs_view SET(security_barrier=true);
 REVOKE SELECT ON songs FROM listener_free,listener_premium;
 GRANT SELECT ON listener_songs_view TO listener_free,listener_premium;
 
+-- History tab (APP/history.py): the caller's plays. A view rather than a function:
+-- play_history is read with the owner's rights (listeners have no grant on it),
+-- yet the planner sees through it, so the keyset predicate and ORDER BY ... LIMIT
+-- reach idx_play_history_user_recent and a named cursor streams the export.
+DROP VIEW IF EXISTS my_history;
+CREATE OR REPLACE VIEW my_history AS
+SELECT p.history_id, s.title, s.artist, s.genre, s.rating, s.is_premium, p.played_at, p.listen_duration
+FROM play_history p
+JOIN songs s ON s.song_id = p.song_id
+WHERE p.user_name = current_setting('app.current_username', true)
+AND p.tenant_id = current_setting('app.current_tenant', true)::uuid;
+ALTER VIEW my_history SET(security_barrier=true);
+GRANT SELECT ON my_history TO listener_free,listener_premium;
+
 ---------------------TESTING-----------------------
 SET ROLE=listener_free;
 SELECT *FROM songs;
@@ -0,0 +1,185 @@
+# test_instrumentation.py
+# instrumentation.py: iterating instrumented cursors (plain and named), the
+# per-statement timings with their role/tenant labels, and the exporter.
+# Requirements: pip install psycopg2-binary
+#
+#   python -m unittest discover tests
+#
+# No database needed: the cursors are pure-Python stand-ins shaped like
+# psycopg2's (a plain cursor's __iter__ returns the cursor itself,
+# DictCursor's is a generator). psycopg2 itself must be installed, as for the
+# app; without it the tests fail to import rather than being skipped.
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "APP"))
+
+try:
+    import instrumentation
+except ImportError as e:
+    raise ImportError(f"instrumentation tests need psycopg2 (pip install psycopg2-binary): {e}") from e
+
+
+class FakeConnection:
+    instrument_role = "listener_free"
+    instrument_tenant = "tenant-a"
+
+
+class UntaggedConnection:
+    pass
+
+
+class FakeCursor:
+    # psycopg2.extensions.cursor: iter(cur) is cur, rows come from __next__
+    def __init__(self, rows, name=None, connection=None):
+        self.connection = connection or FakeConnection()
+        self.name = name
+        self.rowcount = -1
+        self._rows = rows
+        self._pos = 0
+
+    def execute(self, query, vars=None):
+        if "missing_table" in query:
+            raise RuntimeError('relation "missing_table" does not exist')
+        self._pos = 0
+        self.rowcount = -1 if self.name else len(self._rows)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pos >= len(self._rows):
+            raise StopIteration
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchall(self):
+        rows, self._pos = self._rows[self._pos:], len(self._rows)
+        return rows
+
+
+class FakeDictCursor(FakeCursor):
+    # psycopg2.extras.DictCursor: __iter__ is a generator over the base cursor
+    def __iter__(self):
+        rows = super().__iter__()
+        while True:
+            try:
+                yield dict(zip(("song_id", "title"), next(rows)))
+            except StopIteration:
+                return
+
+
+class CursorIterationTest(unittest.TestCase):
+    ROWS = [(i, f"song {i}") for i in range(2500)]
+
+    def setUp(self):
+        instrumentation.reset()
+
+    def iterate(self, base, name=None, sql="SELECT song_id, title FROM songs"):
+        cur = instrumentation.instrumented_cursor_class(base)(self.ROWS, name)
+        cur.execute(sql)
+        rows = [row for row in cur]
+        [stats] = instrumentation.snapshot()
+        return rows, stats
+
+    def test_plain_cursor(self):
+        rows, stats = self.iterate(FakeCursor)
+        self.assertEqual(rows, self.ROWS)
+        self.assertEqual(stats["calls"], 1)
+        self.assertEqual(stats["rows"], len(self.ROWS))        # from rowcount, not counted twice
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_named_cursor(self):
+        rows, stats = self.iterate(FakeCursor, name="history_export")
+        self.assertEqual(rows, self.ROWS)
+        self.assertEqual(stats["rows"], len(self.ROWS))        # counted while streaming
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_dict_cursor(self):
+        rows, stats = self.iterate(FakeDictCursor)
+        self.assertEqual(len(rows), len(self.ROWS))
+        self.assertEqual(rows[0], {"song_id": 0, "title": "song 0"})
+        self.assertEqual(stats["rows"], len(self.ROWS))
+
+
+class StatementStatsTest(unittest.TestCase):
+    def setUp(self):
+        instrumentation.reset()
+
+    def run_query(self, sql, connection=None):
+        cur = instrumentation.instrumented_cursor_class(FakeCursor)([(1, "a"), (2, "b")], connection=connection)
+        cur.execute(sql)
+        return cur.fetchall()
+
+    def test_role_and_tenant_labels(self):
+        self.run_query("SELECT * FROM songs WHERE song_id = 1")
+        self.run_query("SELECT * FROM songs WHERE song_id = 2")
+        self.run_query("SELECT * FROM songs WHERE song_id = 3", UntaggedConnection())
+        stats = {(s["role"], s["tenant"]): s for s in instrumentation.snapshot()}
+        self.assertEqual(set(stats), {("listener_free", "tenant-a"), ("-", "-")})
+        self.assertEqual(stats["listener_free", "tenant-a"]["calls"], 2)         # literals fingerprinted away
+        self.assertEqual(stats["listener_free", "tenant-a"]["fingerprint"], "SELECT * FROM songs WHERE song_id = ?")
+        self.assertEqual(stats["-", "-"]["calls"], 1)
+
+    def test_tag_ignores_plain_connections(self):
+        conn = UntaggedConnection()
+        instrumentation.tag(conn, "adminn", "tenant-b")
+        self.assertFalse(hasattr(conn, "instrument_role"))
+
+    def test_errors_are_recorded_and_raised(self):
+        cur = instrumentation.instrumented_cursor_class(FakeCursor)([])
+        with self.assertRaises(RuntimeError):
+            cur.execute("SELECT * FROM missing_table")
+        [stats] = instrumentation.snapshot()
+        self.assertEqual((stats["calls"], stats["errors"]), (1, 1))
+        self.assertEqual(stats["last_error"], 'relation "missing_table" does not exist')
+
+    def test_timings(self):
+        for seconds in (0.0001, 0.003, 0.003, 0.2):
+            instrumentation.record("SELECT 1", "appuser", "tenant-a", seconds)
+        [stats] = instrumentation.snapshot(window_minutes=5)
+        self.assertEqual(stats["calls"], 4)
+        self.assertEqual(sum(stats["histogram"]), 4)
+        self.assertEqual(stats["p50_ms"], 5.0)              # upper bound of the 2.5-5 ms bucket
+        self.assertEqual(stats["p99_ms"], 250.0)
+        self.assertAlmostEqual(stats["max_ms"], 200.0)
+        self.assertEqual(instrumentation.slowest(limit=1)[0]["fingerprint"], "SELECT ?")
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        instrumentation.reset()
+        instrumentation.record("SELECT * FROM songs", "listener_premium", "tenant-a", 0.002, rows=3)
+
+    def test_export_appends_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, "metrics.jsonl")
+            instrumentation._export_quietly(target)
+            instrumentation._export_quietly(target)
+            with open(target, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        [statement] = lines[0]["statements"]
+        self.assertEqual((statement["role"], statement["tenant"], statement["rows"]),
+                         ("listener_premium", "tenant-a", 3))
+        self.assertEqual(lines[0]["buckets_ms"], instrumentation.BUCKETS_MS)
+
+    def test_failed_export_is_reported_not_raised(self):
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(out):
+            instrumentation._export_quietly(directory)          # a directory can't be appended to
+        self.assertIn(f"metrics export to {directory} failed", out.getvalue())
+
+    def test_no_target_is_a_no_op(self):
+        self.assertIsNone(instrumentation.export(""))
+        self.assertIsNone(instrumentation.start_exporter(target=""))
+
+
+if __name__ == "__main__":
+    unittest.main()